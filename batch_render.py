@@ -0,0 +1,269 @@
+"""Headless batch renderer for render farm nodes.
+
+    python batch_render.py scene.usda --spp 1024 --res 1920x1080 -o out.exr
+
+Drives the same accumulation loop as main.py without Qt, writing the running average
+to the output path every --progress-every samples and/or --progress-seconds seconds.
+
+    python batch_render.py shot.usd --frames 1001-1100 --spp 256 -o shot.####.exr
+
+renders a frame range instead, refitting the BVH between frames (see UsdSequence).
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import sys
+import time
+
+from core.render import Render, BACKENDS, SAMPLERS
+from core.image import ImageBuffer
+from core.image_io import aov_path, save_image
+from core.accumulator import AOVS, Accumulator
+from core.postprocess import POSTPROCESS_STAGES
+from core.bvh import BVH_FORMATS
+from core.scene_cache import SceneCache
+from core.profiler import Profiler
+from core.tile_scheduler import TileScheduler
+from usd.loader import UsdLoader
+from usd.camera import UsdCamera
+from usd.scene import UsdScene
+from usd.sequence import UsdSequence
+
+
+def parse_resolution(value: str):
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Resolution must look like 1920x1080, got {value}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"Resolution must be positive, got {value}")
+    return width, height
+
+
+def parse_frames(value: str):
+    """START-END or START-END:STEP, inclusive; a single number renders one frame."""
+    match = re.fullmatch(r"(-?\d+)(?:-(-?\d+))?(?::(\d+))?", value.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"Frames must look like 1001-1100 or 1-100:2, got {value}")
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) is not None else start
+    step = int(match.group(3)) if match.group(3) is not None else 1
+    if end < start or step <= 0:
+        raise argparse.ArgumentTypeError(f"Empty frame range {value}")
+    return list(range(start, end + 1, step))
+
+
+def frame_path(pattern: str, frame: int) -> str:
+    """Replace the run of # in pattern with the zero padded frame (out.####.exr -> out.1001.exr)."""
+    match = re.search(r"#+", pattern)
+    if match is None:
+        root, extension = os.path.splitext(pattern)
+        return f"{root}.{frame:04d}{extension}"
+    return pattern[:match.start()] + f"{frame:0{len(match.group())}d}" + pattern[match.end():]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render a USD scene without a UI.")
+    parser.add_argument("scene", help="USD file to render")
+    parser.add_argument("-o", "--output", required=True, help="output image (.exr, .pfm, .npy, .png or .ppm)")
+    parser.add_argument("--spp", type=int, default=1024, help="samples per pixel")
+    parser.add_argument("--res", type=parse_resolution, default=(1024, 1024), help="resolution as WIDTHxHEIGHT")
+    parser.add_argument("--progress-every", type=int, default=0, help="write progressive output every N samples (0 disables)")
+    parser.add_argument("--progress-seconds", type=float, default=0.0, help="write progressive output every N seconds (0 disables)")
+    parser.add_argument("--backend", choices=BACKENDS, default="metal", help="metal shaders or the CPU wavefront tracer")
+    parser.add_argument("--bvh-format", choices=BVH_FORMATS, default="compact")
+    parser.add_argument("--sampler", choices=SAMPLERS, default="sobol", help="Owen-scrambled Sobol, R2 or the blue noise texture")
+    parser.add_argument("--seed", type=int, default=None, help="scramble seed of the sequence samplers")
+    parser.add_argument("--no-nee", action="store_true", help="disable next-event estimation, lights are only found by bounces")
+    parser.add_argument("--roulette-depth", type=int, default=3, help="first bounce of Russian roulette, 0 traces every path to the maximum depth")
+    parser.add_argument("--post", nargs="*", choices=POSTPROCESS_STAGES, default=["denoise"],
+                        help="filters of the accumulated image before every write, in order (none without stages)")
+    parser.add_argument("--aovs", nargs="+", choices=AOVS, default=[],
+                        help="also write these per-pixel outputs, e.g. out.exr gets out.depth.exr (.pfm next to 8-bit images)")
+    parser.add_argument("--blue-noise", default="512x512x4_3d_blue_noise.npy", help="blue noise texture (.npy) of --sampler blue_noise")
+    parser.add_argument("--adaptive", action="store_true", help="stop tracing tiles once they reach --noise-threshold")
+    parser.add_argument("--noise-threshold", type=float, default=0.02, help="relative standard error at which a tile is converged")
+    parser.add_argument("--min-spp", type=int, default=16, help="samples every pixel gets before adaptive sampling starts")
+    parser.add_argument("--tile-size", type=int, default=16, help="adaptive sampling tile size in pixels")
+    parser.add_argument("--time-budget", type=float, default=None, help="stop after this many seconds of rendering")
+    parser.add_argument("--report", default=None, help="write per-tile error and samples as JSON")
+    parser.add_argument("--workers", type=int, default=0, help="render CPU tiles on this many processes (0 renders full frames in this process)")
+    parser.add_argument("--bucket-size", type=int, default=64, help="tile size in pixels for --workers")
+    parser.add_argument("--samples-per-job", type=int, default=4, help="samples per tile job for --workers")
+    parser.add_argument("--cache-dir", default=None, help="compiled scene cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="always recompile the scene")
+    parser.add_argument("--profile", default=None, help="write per-stage timings and counters as JSON")
+    parser.add_argument("--trace", default=None, help="write a Chrome trace (chrome://tracing, Perfetto) of every stage")
+    parser.add_argument("--traversal-stats", action="store_true", help="count BVH node and triangle tests per pixel (slower debug kernels)")
+    parser.add_argument("--frames", type=parse_frames, default=None,
+                        help="render a frame range, e.g. 1001-1100 or 1-100:2; # in the output is replaced by the frame")
+    parser.add_argument("--rebuild-threshold", type=float, default=0.5,
+                        help="with --frames, rebuild the BVH once refitting grew its SAH cost by this fraction")
+    args = parser.parse_args(argv)
+    if args.frames is not None and args.report:
+        parser.error("--report is not supported with --frames")
+    if args.workers > 0 and args.backend != "cpu":
+        parser.error("--workers needs --backend cpu")
+    if args.workers > 0 and args.adaptive:
+        parser.error("--adaptive is not supported with --workers")
+    return args
+
+
+def create_render(args, camera, scene, profiler: Profiler) -> Render:
+    width, height = args.res
+    return Render(ImageBuffer(width, height), camera, scene, bvh_format=args.bvh_format,
+                  samples=args.spp, blue_noise_path=args.blue_noise, backend=args.backend,
+                  adaptive=args.adaptive, noise_threshold=args.noise_threshold, min_samples=args.min_spp,
+                  tile_size=args.tile_size, time_budget=args.time_budget,
+                  profiler=profiler, traversal_stats=args.traversal_stats, sampler=args.sampler, seed=args.seed, next_event=not args.no_nee,
+                  roulette_depth=args.roulette_depth, postprocess=args.post, aovs=args.aovs)
+
+
+def save_outputs(args, path: str, render: Render, accumulator: Accumulator):
+    """Write the post-processed image to path and every requested AOV next to it."""
+    save_image(path, accumulator.read(render.postprocess))
+    for name in args.aovs:
+        save_image(aov_path(path, name), accumulator.read_aov(name))
+
+
+def run_render(args, render: Render, on_sample=None) -> int:
+    if args.workers > 0:
+        scheduler = TileScheduler(render, workers=args.workers, tile_size=args.bucket_size, samples_per_job=args.samples_per_job)
+        return scheduler.run(on_sample=on_sample)
+    return render.run(on_sample=on_sample)
+
+
+def save_profile(args, profiler: Profiler):
+    if profiler.enabled:
+        profiler.print_summary()
+    if args.profile:
+        profiler.save_json(args.profile)
+        print(f"Wrote {args.profile}")
+    if args.trace:
+        profiler.save_chrome_trace(args.trace)
+        print(f"Wrote {args.trace}")
+
+
+def render_sequence(args, usd_loader: UsdLoader, profiler: Profiler) -> int:
+    """Render args.frames to frame_path(args.output, frame), one Render per frame."""
+    sequence = UsdSequence(usd_loader, rebuild_threshold=args.rebuild_threshold, profiler=profiler)
+    state = {"render": None, "stopped": False}
+
+    # Finish the current sample, write the frame and skip the rest of the range
+    def handle_signal(signum, frame):
+        print(f"Received signal {signum}, stopping after the current sample")
+        state["stopped"] = True
+        if state["render"] is not None:
+            state["render"].stop()
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    blue_noise_texture = None
+    frames_done = 0
+    prepare_time = render_time = 0.0
+    for frame in args.frames:
+        if state["stopped"]:
+            break
+        prepare_start_time = time.time()
+        with profiler.stage("frame_prepare", frame=frame):
+            scene = sequence.scene(frame)
+            camera = sequence.camera(frame)
+        frame_prepare_time = time.time() - prepare_start_time
+
+        render = create_render(args, camera, scene, profiler)
+        render.blue_noise_texture = blue_noise_texture
+        state["render"] = render
+        render_start_time = time.time()
+        samples_done = run_render(args, render)
+        frame_render_time = time.time() - render_start_time
+        blue_noise_texture = render.blue_noise_texture
+        if samples_done == 0:
+            break
+
+        output = frame_path(args.output, frame)
+        with profiler.stage("write_output"):
+            save_outputs(args, output, render, render.accumulator)
+        frames_done += 1
+        prepare_time += frame_prepare_time
+        render_time += frame_render_time
+        print(f"Wrote {output} (frame {frame}: prepare {frame_prepare_time:.3f} seconds, render {frame_render_time:.2f} seconds)")
+
+    if frames_done == 0:
+        print("No frames were rendered")
+        return 1
+    print(f"Frames:                {frames_done}/{len(args.frames)}")
+    print(f"BVH refits / rebuilds: {sequence.dynamic.refits} / {sequence.dynamic.rebuilds}")
+    print(f"Prepare time:          {prepare_time:.2f} seconds ({prepare_time / frames_done:.3f} per frame)")
+    print(f"Render time:           {render_time:.2f} seconds ({render_time / frames_done:.2f} per frame)")
+    save_profile(args, profiler)
+    return 2 if state["stopped"] else 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = Profiler(enabled=bool(args.profile or args.trace or args.traversal_stats))
+
+    load_start_time = time.time()
+    usd_loader = UsdLoader(args.scene)
+    if args.frames is not None:
+        return render_sequence(args, usd_loader, profiler)
+    camera = UsdCamera.load_camera(usd_loader)
+    cache = None if args.no_cache else SceneCache(args.cache_dir)
+    scene = UsdScene.load_scene(usd_loader, cache=cache, profiler=profiler)
+    load_time = time.time() - load_start_time
+
+    render = create_render(args, camera, scene, profiler)
+
+    # Finish the current sample and write what we have when the scheduler asks us to stop
+    def handle_signal(signum, frame):
+        print(f"Received signal {signum}, stopping after the current sample")
+        render.stop()
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    state = {"last_write": time.time(), "writes": 0, "write_time": 0.0}
+
+    # The running sum stays on the device, it is only read back when an output write is due
+    def on_sample(samples_done, accumulator):
+        now = time.time()
+        due = (args.progress_every > 0 and samples_done % args.progress_every == 0) or \
+              (args.progress_seconds > 0 and now - state["last_write"] >= args.progress_seconds)
+        if due and samples_done < args.spp:
+            with profiler.stage("write_output"):
+                save_outputs(args, args.output, render, accumulator)
+            state["last_write"] = time.time()
+            state["writes"] += 1
+            state["write_time"] += state["last_write"] - now
+
+    render_start_time = time.time()
+    samples_done = run_render(args, render, on_sample)
+    render_time = time.time() - render_start_time
+
+    if samples_done == 0:
+        print("No samples were rendered")
+        return 1
+
+    write_start_time = time.time()
+    with profiler.stage("write_output"):
+        save_outputs(args, args.output, render, render.accumulator)
+    state["write_time"] += time.time() - write_start_time
+    state["writes"] += 1
+
+    print(f"Wrote {args.output}")
+    print(f"Scene load time:       {load_time:.2f} seconds")
+    print(f"Render time:           {render_time:.2f} seconds ({samples_done}/{args.spp} samples)")
+    print(f"Seconds per sample:    {render_time / samples_done:.4f}")
+    print(f"Output writes:         {state['writes']} ({state['write_time']:.2f} seconds)")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(render.report(), f, indent=2)
+        print(f"Wrote {args.report}")
+    save_profile(args, profiler)
+    # Converging or running out of time budget counts as finishing, only an interrupt does not
+    return 2 if render.stop_reason == "stopped" else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
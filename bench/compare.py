@@ -0,0 +1,86 @@
+"""Flag performance regressions between two bench.run result files.
+
+    python -m bench.compare baseline.json results.json --threshold 0.1
+
+Exits with 1 if any metric got worse by more than the threshold (relative).
+"""
+import argparse
+import json
+import sys
+
+# Metric name -> True if higher is better
+METRICS = {
+    "ingest_seconds": False,
+    "compile_seconds": False,
+    "bvh_compact_bytes": False,
+    "primary_rays_per_second": True,
+    "secondary_rays_per_second": True,
+    "occlusion_rays_per_second": True,
+    "seconds_per_sample": False,
+}
+
+
+def load_results(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, min_seconds: float = 0.01) -> list:
+    """Return one row per (case, metric) present in both files.
+
+    Timings below min_seconds in both runs are reported but never flagged, they are mostly noise.
+    """
+    if baseline.get("bench_version") != current.get("bench_version"):
+        raise ValueError(f"Benchmark versions differ: {baseline.get('bench_version')} vs {current.get('bench_version')}")
+
+    baseline_cases = {(case["scene"], case["requested_triangles"]): case for case in baseline["cases"]}
+    rows = []
+    for case in current["cases"]:
+        key = (case["scene"], case["requested_triangles"])
+        if key not in baseline_cases:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = baseline_cases[key].get(metric), case.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            noise = metric.endswith("_seconds") and max(old, new) < min_seconds
+            rows.append({
+                "scene": key[0],
+                "triangles": case["triangles"],
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regression": worse > threshold and not noise,
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a baseline.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    baseline, current = load_results(args.baseline), load_results(args.current)
+    if baseline["machine"].get("platform") != current["machine"].get("platform") or \
+       baseline["settings"] != current["settings"]:
+        print("Warning: machine or settings differ from the baseline, numbers may not be comparable")
+
+    rows = compare(baseline, current, args.threshold)
+    print(f"{'scene':>18} {'triangles':>10} {'metric':>26} {'baseline':>12} {'current':>12} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['scene']:>18} {row['triangles']:>10} {row['metric']:>26} {row['baseline']:>12.4g} "
+              f"{row['current']:>12.4g} {row['change']:>+8.1%}{flag}")
+
+    regressions = sum(row["regression"] for row in rows)
+    print(f"\n{regressions} regressions over {len(rows)} comparisons (threshold {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Ray tracing benchmark on procedural scenes, no USD assets needed.
+
+    python -m bench.run -o results.json
+    python -m bench.run --scenes sphere triangle_soup --sizes 1000 100000 10000000 -o big.json
+
+Every (scene, size) pair records ingest time, scene compile (BVH build) time, BVH
+memory, closest-hit throughput of the CPU traversal for primary and diffuse secondary
+rays, occlusion-query throughput on the same secondary rays, and end-to-end seconds per
+sample through Render. Compare runs with bench.compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import mlx.core as mx
+
+from bench.scenes import SCENES, ProceduralScene
+from core.image import ImageBuffer
+from core.bvh import BVH_FORMATS
+from core.render import Render, BACKENDS
+from core.scene import compile_scene
+from kernels.cpu.structures import CpuScene, normalize
+from kernels.cpu.triangle_hit import hit, occluded
+from usd.geo import UsdGeo
+
+# Bump when the measurements change meaning, bench.compare refuses to mix versions
+BENCH_VERSION = 1
+
+
+def machine_metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "mlx": getattr(mx, "__version__", "unknown"),
+        "mlx_device": str(mx.default_device()),
+        "git_commit": commit,
+    }
+
+
+def _triangulate(mesh):
+    triangles, vnormals = UsdGeo.triangulate(mesh.points, mesh.face_vertex_counts, mesh.face_vertex_indices,
+                                             mesh.normals, mesh.normals_interpolation, mesh.xform)
+    return triangles, vnormals, np.full((triangles.shape[0] // 3, 1), mesh.material, dtype=np.int32)
+
+def ingest(scene: ProceduralScene):
+    """Triangulate every mesh with the USD loader's code path, returning per-mesh geos, norms and
+    mats plus the (geos, norms, mats) of every prototype."""
+    geos, norms, mats = [], [], []
+    for mesh in scene.meshes:
+        triangles, vnormals, mat_indices = _triangulate(mesh)
+        geos.append(triangles)
+        norms.append(vnormals)
+        mats.append(mat_indices)
+    prototypes = [_triangulate(mesh) for mesh in scene.prototypes]
+    return geos, norms, mats, prototypes
+
+
+def primary_rays(render: Render, num_rays: int, rng: np.random.Generator):
+    width, height = render.image_buffer.width, render.image_buffer.height
+    uv = rng.uniform(0.0, 1.0, (num_rays, 2)) * [width, height]
+    pixel00_loc = np.array(render.pixel00_loc, dtype=np.float32)
+    pixel_sample = pixel00_loc + uv[:, 0:1] * np.array(render.pixel_delta_u) + uv[:, 1:2] * np.array(render.pixel_delta_v)
+    origins = np.broadcast_to(np.array(render.camera.center, dtype=np.float32), pixel_sample.shape).astype(np.float32)
+    return origins, (pixel_sample - origins).astype(np.float32)
+
+
+def diffuse_rays(hit_record, rng: np.random.Generator):
+    """Cosine-weighted bounces off the primary hits, on the same side ray_color samples."""
+    points = hit_record.p[hit_record.hit]
+    normals = -hit_record.normal[hit_record.hit]
+    random = normalize(rng.normal(size=normals.shape).astype(np.float32))
+    directions = normalize(normals + random)
+    return points.astype(np.float32), directions.astype(np.float32)
+
+
+def best_of(repeat: int, function, *args):
+    """Run function repeat times, returning the fastest wall time and the last result."""
+    best = float("inf")
+    for _ in range(max(repeat, 1)):
+        start_time = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def rays_per_second(origins, directions, t_min, scene: CpuScene, repeat: int, query=hit):
+    """Rays per second of query (hit or occluded) and its last result."""
+    if len(origins) == 0:
+        return 0.0, None
+    seconds, result = best_of(repeat, query, origins, directions, t_min, 10000.0, scene)
+    return len(origins) / seconds, result
+
+
+def run_case(scene_name: str, num_triangles: int, args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    print(f"\n=== {scene_name} {num_triangles} ===")
+    scene = SCENES[scene_name](num_triangles, seed=args.seed)
+
+    ingest_seconds, (geos, norms, mats, prototypes) = best_of(args.repeat, ingest, scene)
+
+    # Concatenation, BVH build and leaf reordering
+    start_time = time.perf_counter()
+    compiled = compile_scene(geos, norms, mats, scene.lights, prototypes=prototypes, instances=scene.instances)
+    compile_seconds = time.perf_counter() - start_time
+
+    width, height = args.res
+    # The default sequence sampler needs no blue noise texture, which keeps the suite self-contained
+    render = Render(ImageBuffer(width, height), scene.camera, compiled, samples=args.spp, backend=args.backend, seed=args.seed,
+                    roulette_depth=args.roulette_depth, bvh_format=args.bvh_format)
+
+    nodes, instances = compiled.traversal_nodes(args.bvh_format)
+    cpu_scene = CpuScene(compiled.geos, compiled.norms, compiled.mats, nodes, instances, compiled.lights)
+    origins, directions = primary_rays(render, args.rays, rng)
+    primary_rate, hit_record = rays_per_second(origins, directions, 0.1, cpu_scene, args.repeat)
+    secondary_rate = occlusion_rate = 0.0
+    if hit_record is not None and hit_record.hit.any():
+        origins, directions = diffuse_rays(hit_record, rng)
+        secondary_rate, _ = rays_per_second(origins, directions, 0.0001, cpu_scene, args.repeat)
+        occlusion_rate, _ = rays_per_second(origins, directions, 0.0001, cpu_scene, args.repeat, occluded)
+
+    render_seconds = None
+    if args.spp > 0:
+        start_time = time.perf_counter()
+        samples_done = render.run()
+        render_seconds = (time.perf_counter() - start_time) / max(samples_done, 1)
+
+    return {
+        "scene": scene_name,
+        "requested_triangles": num_triangles,
+        "triangles": int(compiled.num_triangles),
+        "meshes": len(scene.meshes),
+        "instances": int(len(compiled.instances)),
+        "ingest_seconds": ingest_seconds,
+        "compile_seconds": compile_seconds,
+        "bvh_nodes": int(len(compiled.nodes)),
+        "bvh_compact_bytes": int(compiled.nodes.nbytes),
+        "bvh_flat_bytes": int(compiled.bboxes.nbytes + compiled.indices.nbytes),
+        "scene_bytes": int(compiled.nbytes),
+        "primary_rays_per_second": primary_rate,
+        "primary_hit_fraction": float(hit_record.hit.mean()) if hit_record is not None else 0.0,
+        "secondary_rays_per_second": secondary_rate,
+        "occlusion_rays_per_second": occlusion_rate,
+        "seconds_per_sample": render_seconds,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingest, BVH build, traversal and rendering on procedural scenes.")
+    parser.add_argument("-o", "--output", required=True, help="results JSON")
+    parser.add_argument("--scenes", nargs="+", choices=sorted(SCENES), default=sorted(SCENES))
+    parser.add_argument("--sizes", nargs="+", type=lambda v: int(float(v)), default=[1000, 10000, 100000, 1000000],
+                        help="triangle counts, e.g. 1e3 1e6 1e7 (the Cornell box has a fixed size)")
+    parser.add_argument("--rays", type=int, default=1 << 15, help="rays per traversal measurement")
+    parser.add_argument("--res", type=int, nargs=2, default=[128, 128], help="resolution of the end-to-end render")
+    parser.add_argument("--spp", type=int, default=4, help="samples of the end-to-end render (0 skips it)")
+    parser.add_argument("--backend", choices=BACKENDS, default="metal", help="backend of the end-to-end render")
+    parser.add_argument("--roulette-depth", type=int, default=3, help="first Russian roulette bounce of the end-to-end render (0 disables it)")
+    parser.add_argument("--bvh-format", choices=BVH_FORMATS, default="compact",
+                        help="node layout of the traversal measurements and the end-to-end render (flat traverses compact on the CPU)")
+    parser.add_argument("--repeat", type=int, default=3, help="ingest and traversal keep the best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cases = []
+    for scene_name in args.scenes:
+        sizes = [0] if scene_name == "cornell_box" else args.sizes
+        for num_triangles in sizes:
+            cases.append(run_case(scene_name, num_triangles, args))
+
+    results = {
+        "bench_version": BENCH_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_metadata(),
+        "settings": {"rays": args.rays, "res": args.res, "spp": args.spp, "backend": args.backend,
+                     "roulette_depth": args.roulette_depth, "bvh_format": args.bvh_format, "repeat": args.repeat, "seed": args.seed},
+        "cases": cases,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'scene':>18} {'triangles':>10} {'ingest s':>9} {'compile s':>9} {'bvh MB':>8} {'primary r/s':>12} {'diffuse r/s':>12} {'occluded r/s':>12} {'s/sample':>9}")
+    for case in cases:
+        seconds_per_sample = f"{case['seconds_per_sample']:.4f}" if case["seconds_per_sample"] is not None else "-"
+        print(f"{case['scene']:>18} {case['triangles']:>10} {case['ingest_seconds']:>9.3f} {case['compile_seconds']:>9.2f} "
+              f"{case['bvh_compact_bytes'] / 1e6:>8.2f} {case['primary_rays_per_second']:>12.0f} "
+              f"{case['secondary_rays_per_second']:>12.0f} {case['occlusion_rays_per_second']:>12.0f} {seconds_per_sample:>9}")
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
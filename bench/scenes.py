@@ -0,0 +1,138 @@
+import numpy as np
+import mlx.core as mx
+from core.camera import Camera
+from core.light import Light
+
+class Mesh:
+    """Polygon mesh in the form UsdGeo.triangulate ingests: points, face counts and indices, row-vector xform."""
+    def __init__(self, points, face_vertex_counts, face_vertex_indices, xform=None, normals=None, normals_interpolation="vertex", material=0):
+        self.points = np.asarray(points, dtype=np.float32)
+        self.face_vertex_counts = np.asarray(face_vertex_counts, dtype=np.int32)
+        self.face_vertex_indices = np.asarray(face_vertex_indices, dtype=np.int32)
+        self.xform = np.eye(4) if xform is None else np.asarray(xform, dtype=np.float64)
+        self.normals = normals
+        self.normals_interpolation = normals_interpolation
+        self.material = material
+
+class ProceduralScene:
+    """meshes are in world space; prototypes are object space meshes placed by instances,
+    (prototype index, row-vector object_to_world) pairs, as UsdGeo.load_instances returns them."""
+    def __init__(self, name: str, meshes: list, camera: Camera, lights: list = None, prototypes: list = None, instances: list = None):
+        self.name = name
+        self.meshes = meshes
+        self.camera = camera
+        self.lights = lights or []
+        self.prototypes = prototypes or []
+        self.instances = instances or []
+
+def _camera(center, look_at, fov=40.0) -> Camera:
+    return Camera(fov=fov, center=mx.array(center, dtype=mx.float32), look_at=mx.array(look_at, dtype=mx.float32),
+                  look_up=mx.array([0.0, 1.0, 0.0], dtype=mx.float32))
+
+def _translate_scale(offset, scale=1.0, rotation=None) -> np.ndarray:
+    xform = np.eye(4)
+    xform[:3, :3] = scale * (np.eye(3) if rotation is None else rotation)
+    xform[3, :3] = offset
+    return xform
+
+def _box(size, center) -> Mesh:
+    sx, sy, sz = np.asarray(size) / 2.0
+    points = np.array([[x, y, z] for x in (-sx, sx) for y in (-sy, sy) for z in (-sz, sz)])
+    # Outward facing quads of the eight corners above (index = 4x + 2y + z)
+    quads = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]
+    return Mesh(points, [4] * 6, np.ravel(quads), _translate_scale(center))
+
+def _uv_sphere(rings: int, segments: int):
+    """Points, counts and indices of a closed sphere with 2 * rings * segments triangles, roughly."""
+    theta = np.linspace(0.0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0.0, 2.0 * np.pi, segments, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing="ij")
+    ring_points = np.stack([np.sin(t) * np.cos(p), np.cos(t), np.sin(t) * np.sin(p)], axis=-1).reshape(-1, 3)
+    points = np.vstack([[0.0, 1.0, 0.0], ring_points, [0.0, -1.0, 0.0]])
+    bottom = len(points) - 1
+
+    s = np.arange(segments)
+    s_next = (s + 1) % segments
+    counts, indices = [], []
+    # Top cap, quad bands, bottom cap
+    indices.append(np.stack([np.zeros(segments, dtype=int), 1 + s_next, 1 + s], axis=1).ravel())
+    counts.append(np.full(segments, 3))
+    r = np.arange(rings - 3 + 1)[:, None]
+    if rings > 2:
+        a = 1 + r * segments + s
+        b = 1 + r * segments + s_next
+        quads = np.stack([a, b, b + segments, a + segments], axis=-1).reshape(-1, 4)
+        indices.append(quads.ravel())
+        counts.append(np.full(len(quads), 4))
+    last = 1 + (rings - 2) * segments
+    indices.append(np.stack([np.full(segments, bottom), last + s, last + s_next], axis=1).ravel())
+    counts.append(np.full(segments, 3))
+    return points, np.concatenate(counts), np.concatenate(indices)
+
+def cornell_box(num_triangles: int = 0, seed: int = 0) -> ProceduralScene:
+    """The classic box built from seven boxes (84 triangles); num_triangles is ignored."""
+    meshes = [
+        _box([10.0, 0.2, 10.0], [0.0, -0.1, 0.0]),    # floor
+        _box([10.0, 0.2, 10.0], [0.0, 10.1, 0.0]),    # ceiling
+        _box([10.0, 10.0, 0.2], [0.0, 5.0, -5.1]),    # back wall
+        _box([0.2, 10.0, 10.0], [-5.1, 5.0, 0.0]),    # left wall
+        _box([0.2, 10.0, 10.0], [5.1, 5.0, 0.0]),     # right wall
+        _box([3.0, 6.0, 3.0], [-1.8, 3.0, -1.5]),     # tall block
+        _box([3.0, 3.0, 3.0], [1.8, 1.5, 1.0]),       # short block
+    ]
+    light = Light()
+    light.Q = mx.array([-1.0, 9.99, -1.0])
+    light.u = mx.array([2.0, 0.0, 0.0])
+    light.v = mx.array([0.0, 0.0, 2.0])
+    light.color = mx.array([1.0, 1.0, 1.0])
+    light.intensity = 20.0
+    light.width = light.height = 2.0
+    return ProceduralScene("cornell_box", meshes, _camera([0.0, 5.0, 18.0], [0.0, 5.0, 0.0]), [light])
+
+def triangle_soup(num_triangles: int, seed: int = 0) -> ProceduralScene:
+    """Randomly placed and oriented small triangles filling a cube, the worst case for the BVH."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-5.0, 5.0, (num_triangles, 1, 3))
+    size = 10.0 / max(num_triangles, 1) ** (1.0 / 3.0)
+    points = (centers + rng.normal(0.0, size, (num_triangles, 3, 3))).reshape(-1, 3)
+    mesh = Mesh(points, np.full(num_triangles, 3), np.arange(3 * num_triangles))
+    return ProceduralScene("triangle_soup", [mesh], _camera([0.0, 0.0, 20.0], [0.0, 0.0, 0.0]))
+
+def sphere(num_triangles: int, seed: int = 0) -> ProceduralScene:
+    """One finely tessellated sphere with vertex normals."""
+    segments = max(int(np.sqrt(num_triangles)), 3)
+    rings = max(num_triangles // (2 * segments), 3)
+    points, counts, indices = _uv_sphere(rings, segments)
+    mesh = Mesh(points * 4.0, counts, indices, normals=points.astype(np.float32))
+    return ProceduralScene("sphere", [mesh], _camera([0.0, 0.0, 14.0], [0.0, 0.0, 0.0]))
+
+def _clutter_xforms(num_triangles: int, per_instance: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    xforms = []
+    for i in range(max(num_triangles // per_instance, 1)):
+        q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        xforms.append(_translate_scale(rng.uniform(-5.0, 5.0, 3), rng.uniform(0.05, 0.3), q))
+    return xforms
+
+def instanced_clutter(num_triangles: int, seed: int = 0) -> ProceduralScene:
+    """Many randomly transformed copies of a small sphere, one mesh per copy."""
+    points, counts, indices = _uv_sphere(8, 8)
+    meshes = [Mesh(points, counts, indices, xform, normals=points.astype(np.float32))
+              for xform in _clutter_xforms(num_triangles, int(np.sum(counts - 2)), seed)]
+    return ProceduralScene("instanced_clutter", meshes, _camera([0.0, 0.0, 20.0], [0.0, 0.0, 0.0]))
+
+def shared_clutter(num_triangles: int, seed: int = 0) -> ProceduralScene:
+    """instanced_clutter as real instances of one prototype, rendered through the two-level BVH."""
+    points, counts, indices = _uv_sphere(8, 8)
+    prototype = Mesh(points, counts, indices, normals=points.astype(np.float32))
+    instances = [(0, xform) for xform in _clutter_xforms(num_triangles, int(np.sum(counts - 2)), seed)]
+    return ProceduralScene("shared_clutter", [], _camera([0.0, 0.0, 20.0], [0.0, 0.0, 0.0]),
+                           prototypes=[prototype], instances=instances)
+
+SCENES = {
+    "cornell_box": cornell_box,
+    "triangle_soup": triangle_soup,
+    "sphere": sphere,
+    "instanced_clutter": instanced_clutter,
+    "shared_clutter": shared_clutter,
+}
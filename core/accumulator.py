@@ -0,0 +1,155 @@
+import time
+import mlx.core as mx
+import numpy as np
+from kernels.aov import AOV_CHANNELS
+
+# Every AOV an accumulator can return: the kernel outputs plus the samples each pixel received
+AOVS = (*AOV_CHANNELS, "samples")
+# Ids do not average, these keep the latest sample's value instead
+LATEST_AOVS = ("material",)
+
+class Accumulator:
+    """Running sum and second moment of samples kept as MLX arrays.
+
+    Nothing is copied to the host until read() or preview() is called. Samples are
+    stored in the kernel layout, shape (width, height, 3) with elem = (x + y * width) * 3,
+    so the flat order matches a (height, width) image. Pixels can be masked out of a
+    sample, counts tracks how many samples each pixel actually received. aovs names the
+    kernel AOVs (see kernels/aov.py) kept alongside the color, summed except LATEST_AOVS;
+    they are only allocated and added when named.
+    """
+    def __init__(self, width: int, height: int, aovs: tuple = ()):
+        self.width = width
+        self.height = height
+        self.sum = mx.zeros([width, height, 3], dtype=mx.float32)
+        self.sum_sq = mx.zeros([width, height, 3], dtype=mx.float32)
+        self.counts = mx.zeros([width, height, 1], dtype=mx.float32)
+        self.aovs = {name: mx.zeros([width, height, AOV_CHANNELS[name]], dtype=mx.float32) for name in aovs if name in AOV_CHANNELS}
+        self.count = 0
+
+    def add(self, sample: mx.array, mask: mx.array = None, aovs: dict = None):
+        """Add a sample and its AOVs by name; mask is a (width, height, 1) array of 0/1 selecting the pixels it covers."""
+        if mask is not None:
+            sample = sample * mask
+            self.counts = self.counts + mask
+        else:
+            self.counts = self.counts + 1.0
+        self.sum = self.sum + sample
+        self.sum_sq = self.sum_sq + sample * sample
+        for name, total in self.aovs.items():
+            if name in LATEST_AOVS:
+                self.aovs[name] = aovs[name] if mask is None else mx.where(mask > 0, aovs[name], total)
+            else:
+                self.aovs[name] = total + (aovs[name] if mask is None else aovs[name] * mask)
+        self.count += 1
+        # Evaluate now so the lazy graph does not grow by one node per sample
+        mx.eval(self.sum, self.sum_sq, self.counts, self.aovs)
+
+    def add_region(self, x0: int, y0: int, tile_sum: np.ndarray, tile_sum_sq: np.ndarray, tile_count: int, tile_aovs: dict = None):
+        """Merge the sums of tile_count samples of a (h, w, 3) region whose top left pixel is (x0, y0),
+        and their (h, w, channels) AOVs as add() keeps them."""
+        h, w, _ = tile_sum.shape
+        region = (slice(y0, y0 + h), slice(x0, x0 + w))
+
+        def merge(total: mx.array, values, replace: bool = False) -> mx.array:
+            image = total.reshape(self.height, self.width, total.shape[-1])
+            image[region] = values if replace else image[region] + values
+            return image.reshape(total.shape)
+        self.sum = merge(self.sum, mx.array(tile_sum))
+        self.sum_sq = merge(self.sum_sq, mx.array(tile_sum_sq))
+        self.counts = merge(self.counts, float(tile_count))
+        for name, total in self.aovs.items():
+            self.aovs[name] = merge(total, mx.array(tile_aovs[name]), replace=name in LATEST_AOVS)
+        mx.eval(self.sum, self.sum_sq, self.counts, self.aovs)
+
+    def average(self) -> mx.array:
+        return self.sum / mx.maximum(self.counts, 1.0)
+
+    def variance(self) -> mx.array:
+        """Variance of each pixel's mean, averaged over the channels, shape (width, height, 1)."""
+        n = mx.maximum(self.counts, 1.0)
+        mean = self.sum / n
+        variance = mx.maximum(self.sum_sq / n - mean * mean, 0.0).mean(axis=-1, keepdims=True)
+        return variance / mx.maximum(n - 1.0, 1.0)
+
+    def aov(self, name: str) -> mx.array:
+        """An AOV in the kernel layout (width, height, channels): the average over the pixel's
+        samples, the latest value of LATEST_AOVS, or for "samples" the counts."""
+        if name == "samples":
+            return self.counts
+        if name in LATEST_AOVS:
+            return self.aovs[name]
+        return self.aovs[name] / mx.maximum(self.counts, 1.0)
+
+    def read_aov(self, name: str) -> np.ndarray:
+        """Return an AOV as a float32 (height, width, channels) image."""
+        return np.array(self.aov(name)).reshape(self.height, self.width, -1)
+
+    def pixel_error(self, error_floor: float = 0.1) -> mx.array:
+        """Relative standard error of each pixel's mean as a (height, width) array.
+
+        The error is divided by (error_floor + luminance) so dark pixels are not held
+        to a tighter absolute tolerance than bright ones.
+        """
+        standard_error = mx.sqrt(self.variance()[..., 0])
+        error = standard_error / (error_floor + self.average().mean(axis=-1))
+        return error.reshape(self.height, self.width)
+
+    def tile_mean(self, values: mx.array, tile_size: int) -> mx.array:
+        """Average a (height, width) array over square tiles, partial edge tiles included."""
+        tiles_y = -(-self.height // tile_size)
+        tiles_x = -(-self.width // tile_size)
+        padding = [(0, tiles_y * tile_size - self.height), (0, tiles_x * tile_size - self.width)]
+        total = mx.pad(values, padding).reshape(tiles_y, tile_size, tiles_x, tile_size).sum(axis=(1, 3))
+        area = mx.pad(mx.ones_like(values), padding).reshape(tiles_y, tile_size, tiles_x, tile_size).sum(axis=(1, 3))
+        return total / area
+
+    def tile_error(self, tile_size: int, error_floor: float = 0.1) -> mx.array:
+        """RMS of the pixel errors in each tile, shape (tiles_y, tiles_x)."""
+        error = self.pixel_error(error_floor)
+        return mx.sqrt(self.tile_mean(error * error, tile_size))
+
+    def tile_samples(self, tile_size: int) -> mx.array:
+        return self.tile_mean(self.counts.reshape(self.height, self.width), tile_size)
+
+    def tile_mask(self, tiles: mx.array, tile_size: int) -> mx.array:
+        """Expand a (tiles_y, tiles_x) boolean array to a (width, height, 1) pixel mask."""
+        pixels = mx.repeat(mx.repeat(tiles, tile_size, axis=0), tile_size, axis=1)[:self.height, :self.width]
+        return pixels.astype(mx.float32).reshape(self.width, self.height, 1)
+
+    def image(self, postprocess = None) -> mx.array:
+        """The average in the kernel layout, run through postprocess (a core.postprocess.PostProcess) if given."""
+        return self.average() if postprocess is None else postprocess.apply(self)
+
+    def read(self, postprocess = None) -> np.ndarray:
+        """Return the average as a float32 (height, width, 3) image, post-processed if asked."""
+        return np.array(self.image(postprocess)).reshape(self.height, self.width, 3)
+
+    def preview(self, image: mx.array = None) -> np.ndarray:
+        """Return image (by default the average) as an 8-bit (height, width, 3) image, converted on the device."""
+        image = self.average() if image is None else image
+        image = mx.clip(image * 255.0, 0.0, 255.0).astype(mx.uint8)
+        return np.array(image).reshape(self.height, self.width, 3)
+
+class RateLimiter:
+    """Decides when a consumer is due for another image.
+
+    Due every every_n_samples samples and/or at most max_hz times per second; with
+    both disabled it is due on every sample.
+    """
+    def __init__(self, max_hz: float = 10.0, every_n_samples: int = 0):
+        self.max_hz = max_hz
+        self.every_n_samples = every_n_samples
+        self.last_time = None
+
+    def due(self, samples_done: int, final: bool = False) -> bool:
+        now = time.time()
+        if final or (self.max_hz <= 0 and self.every_n_samples <= 0):
+            is_due = True
+        else:
+            is_due = self.every_n_samples > 0 and samples_done % self.every_n_samples == 0
+            if self.max_hz > 0:
+                is_due = is_due or self.last_time is None or now - self.last_time >= 1.0 / self.max_hz
+        if is_due:
+            self.last_time = now
+        return is_due
@@ -1,142 +1,370 @@
 import mlx.core as mx
-from typing import List, Tuple
-from tqdm import tqdm
-
-class BVHNode:
-    def __init__(self, start: int, end: int, bbox: mx.array):
-        self.left = None
-        self.right = None
-        self.start = start
-        self.end = end
-        self.bbox = bbox
-        self.polygon_indices = []  # New attribute to store polygon indices
+import numpy as np
+
+# Compact 32-byte node record, mirrored by CompactBVHNode in triangle_hit.metal.
+# Internal nodes have count == 0 and child_or_offset pointing at the left child, the
+# right child is always stored next to it. Leaves have count > 0 and child_or_offset
+# indexing the first of their triangles in leaf-ordered geos/norms/mats.
+BVH_NODE_DTYPE = np.dtype([
+    ('box_min', np.float32, (3,)),
+    ('box_max', np.float32, (3,)),
+    ('child_or_offset', np.int32),
+    ('count', np.int32)
+])
+
+# Instance record of the two-level BVH, mirrored by Instance in triangle_hit.metal.
+# world_to_object maps row vectors into the prototype's space, p_obj = [p, 1] @ world_to_object,
+# and root is the prototype's bottom-level root in the shared node array.
+INSTANCE_DTYPE = np.dtype([
+    ('world_to_object', np.float32, (4, 3)),
+    ('root', np.int32),
+    ('prototype', np.int32),
+    ('pad', np.int32, (2,))
+])
+
+# Wide formats collapse the compact tree into nodes of this many children, see collapse_nodes
+BVH_WIDTHS = {"wide4": 4, "wide8": 8}
+BVH_FORMATS = ("flat", "compact", *BVH_WIDTHS)
+
+def wide_node_dtype(width: int) -> np.dtype:
+    """Wide node record, mirrored by WideBVHNode in triangle_hit.metal.
+
+    Child bounds are stored as structure of arrays, box_min[axis][child], so all children
+    of a node are tested at once. A child is a wide node index (count 0), a leaf given by
+    its first triangle and count (count > 0), or empty (child -1, inverted bounds).
+    """
+    return np.dtype([
+        ('box_min', np.float32, (3, width)),
+        ('box_max', np.float32, (3, width)),
+        ('child', np.int32, (width,)),
+        ('count', np.int32, (width,))
+    ])
+
+def collapse_nodes(nodes: np.ndarray, width: int = 4, roots=(0,)):
+    """Collapse compact binary nodes (see BVH.pack_nodes) into a tree of width-ary nodes.
+
+    Each wide node replaces a binary inner node and adopts its descendants: starting from
+    the two children, the inner child with the largest surface area is opened while slots
+    are free. Leaves keep their ranges, so leaf-ordered buffers (and instance records) stay
+    valid. roots are the binary subtree roots to collapse, e.g. both levels of a two-level
+    BVH; they become wide nodes 0 .. len(roots) - 1. Returns (wide nodes, wide roots).
+    """
+    if width not in BVH_WIDTHS.values():
+        raise ValueError(f"Unsupported BVH width: {width}, expected one of {tuple(BVH_WIDTHS.values())}")
+    count = nodes['count']
+    child = nodes['child_or_offset']
+    is_inner = (count == 0) & (child > 0)
+    extent = np.maximum(nodes['box_max'] - nodes['box_min'], 0.0)
+    area = extent[:, 0] * extent[:, 1] + extent[:, 1] * extent[:, 2] + extent[:, 2] * extent[:, 0]
+    priority = np.where(is_inner, area, -1.0)
+
+    # One pass per level of the wide tree, every node of the level collapsed at once
+    dtype = wide_node_dtype(width)
+    levels = []
+    work = np.asarray(roots, dtype=np.int64).reshape(-1)
+    next_id = work.shape[0]
+    while work.shape[0] > 0:
+        rows = np.arange(work.shape[0])
+        slots = np.full((work.shape[0], width), -1, dtype=np.int64)
+        slots[:, 0] = work
+        used = np.ones(work.shape[0], dtype=np.int64)
+        for _ in range(width - 1):
+            slot_priority = np.where(slots >= 0, priority[slots], -1.0)
+            pick = np.argmax(slot_priority, axis=1)
+            opened = np.nonzero(slot_priority[rows, pick] >= 0.0)[0]
+            node = slots[opened, pick[opened]]
+            slots[opened, pick[opened]] = child[node]
+            slots[opened, used[opened]] = child[node] + 1
+            used[opened] += 1
+
+        valid = slots >= 0
+        source = np.where(valid, slots, 0)
+        leaf_slot = valid & (count[source] > 0)
+        inner_slot = valid & is_inner[source]
+        ids = np.full(slots.shape, -1, dtype=np.int64)
+        ids[inner_slot] = next_id + np.arange(np.count_nonzero(inner_slot))
+
+        records = np.empty(work.shape[0], dtype=dtype)
+        filled = (leaf_slot | inner_slot)[..., None]
+        records['box_min'] = np.where(filled, nodes['box_min'][source], np.inf).transpose(0, 2, 1)
+        records['box_max'] = np.where(filled, nodes['box_max'][source], -np.inf).transpose(0, 2, 1)
+        records['child'] = np.where(inner_slot, ids, np.where(leaf_slot, child[source], -1))
+        records['count'] = np.where(leaf_slot, count[source], 0)
+        levels.append(records)
+
+        work = slots[inner_slot]
+        next_id += work.shape[0]
+
+    return np.concatenate(levels), np.arange(len(roots), dtype=np.int32)
 
 class BVH:
-    def __init__(self, geos: mx.array):
+    """Binned-SAH bounding volume hierarchy over a triangle soup.
+
+    The tree is built on contiguous NumPy buffers from an explicit work list (no
+    recursion) and flattened into the arrays read by render_kernel:
+      bboxes          - 6 floats per node (min xyz, max xyz)
+      indices         - 5 ints per node, see BVH INDEX LAYOUT in triangle_hit.metal
+      polygon_indices - triangle ids, each leaf owns a contiguous range
+    or, for the "compact" format, packed into BVH_NODE_DTYPE records with the
+    triangle buffers reordered into leaf order (see get_nodes and to_leaf_order).
+    """
+    BUILDER_VERSION = 2
+
+    def __init__(self, geos, num_bins: int = 16, max_leaf_size: int = 8, max_depth: int = 30,
+                 traversal_cost: float = 1.0, intersection_cost: float = 1.0):
         self.geos = geos
-        self.nodes: List[BVHNode] = []
-        self.indices: List[int] = []
-        self.bboxes: List[mx.array] = []
-        self.polygon_indices: List[int] = []
+        self.num_bins = num_bins
+        self.max_leaf_size = max_leaf_size
+        self.max_depth = max_depth
+        self.traversal_cost = traversal_cost
+        self.intersection_cost = intersection_cost
+
+        self.bboxes: np.ndarray = np.empty((0, 6), dtype=np.float32)
+        self.indices: np.ndarray = np.empty((0, 5), dtype=np.int32)
+        self.polygon_indices: np.ndarray = np.empty(0, dtype=np.int32)
 
         # Build the BVH
         self._build()
 
     def _build(self):
-        num_triangles = self.geos.shape[0] // 3
-        triangles = mx.arange(num_triangles)
-        
-        bboxes_min = mx.stack([mx.min(self.geos[i*3:(i+1)*3, :3], axis=0) for i in range(num_triangles)])
-        bboxes_max = mx.stack([mx.max(self.geos[i*3:(i+1)*3, :3], axis=0) for i in range(num_triangles)])
-        bboxes = mx.concatenate([bboxes_min, bboxes_max], axis=1)
-        
-        root = self._recursive_build(triangles, bboxes, 0)
-        self._flatten_bvh(root, -1, 0)
+        triangles = np.asarray(self.geos, dtype=np.float32).reshape(-1, 3, 3)
+        num_triangles = triangles.shape[0]
+
+        tri_min = triangles.min(axis=1)
+        tri_max = triangles.max(axis=1)
+        centroids = (tri_min + tri_max) * 0.5
+
+        max_nodes = max(2 * num_triangles - 1, 1)
+        bboxes = np.zeros((max_nodes, 6), dtype=np.float32)
+        indices = np.zeros((max_nodes, 5), dtype=np.int32)
+        order = np.arange(num_triangles, dtype=np.int32)
+
+        if num_triangles == 0:
+            indices[0] = [0, 0, -1, 0, 1]
+            num_nodes = 1
+        else:
+            num_nodes = self._build_nodes(order, tri_min, tri_max, centroids, bboxes, indices)
+
+        self.bboxes = bboxes[:num_nodes]
+        self.indices = indices[:num_nodes]
+        self.polygon_indices = order
+
         print("BVH construction completed")
-        print(f"Total nodes: {len(self.nodes)}")
-        print(f"Total leaf nodes: {sum(1 for i in range(0, len(self.indices), 5) if self.indices[i+4] == 1)}")
-        print(f"BVH depth: {max(self.indices[3::5])}")
+        print(f"Total nodes: {num_nodes}")
+        print(f"Total leaf nodes: {int(np.count_nonzero(self.indices[:, 4] == 1))}")
+        print(f"BVH depth: {int(self.indices[:, 3].max())}")
         print(f"Number of triangles: {num_triangles}")
 
-    def _recursive_build(self, triangle_indices: mx.array, bboxes: mx.array, depth: int) -> BVHNode:
-        bbox = mx.concatenate([mx.min(bboxes[:, :3], axis=0), mx.max(bboxes[:, 3:], axis=0)])
-        node = BVHNode(0, len(triangle_indices), bbox)
-        node.polygon_indices = triangle_indices.tolist()
-
-        if len(triangle_indices) <= 8 or depth > 30:
-            return node
-
-        centroids = (bboxes[:, :3] + bboxes[:, 3:]) * 0.5
-        centroid_min = mx.min(centroids, axis=0)
-        centroid_max = mx.max(centroids, axis=0)
-        centroid_extent = centroid_max - centroid_min
-
-        best_axis = mx.argmax(centroid_extent).item()
-        if centroid_extent[best_axis] < 1e-6:
-            return node
-
-        # Sort triangles based on their centroid along the best axis
-        sorted_indices = mx.argsort(centroids[:, best_axis])
-        triangle_indices = triangle_indices[sorted_indices]
-        bboxes = bboxes[sorted_indices]
-
-        # Try multiple split positions
-        best_cost = float('inf')
-        best_split = None
-
-        for ratio in [0.5, 0.3, 0.7]:
-            split = int(len(triangle_indices) * ratio)
-            if split == 0 or split == len(triangle_indices):
-                continue
-
-            left_bbox = mx.concatenate([mx.min(bboxes[:split, :3], axis=0), mx.max(bboxes[:split, 3:], axis=0)])
-            right_bbox = mx.concatenate([mx.min(bboxes[split:, :3], axis=0), mx.max(bboxes[split:, 3:], axis=0)])
-
-            left_cost = self._compute_surface_area(left_bbox) * split
-            right_cost = self._compute_surface_area(right_bbox) * (len(triangle_indices) - split)
-            total_cost = left_cost + right_cost
-
-            if total_cost < best_cost:
-                best_cost = total_cost
-                best_split = split
-
-        # Use the best split found
-        if best_split is None:
-            best_split = len(triangle_indices) // 2
-
-        node.left = self._recursive_build(triangle_indices[:best_split], bboxes[:best_split], depth + 1)
-        node.right = self._recursive_build(triangle_indices[best_split:], bboxes[best_split:], depth + 1)
-        node.start = min(node.left.start, node.right.start)
-        node.end = max(node.left.end, node.right.end)
-
-        return node
-
-    def _compute_surface_area(self, bbox: mx.array) -> float:
-        extents = bbox[3:] - bbox[:3]
-        return 2 * (extents[0] * extents[1] + extents[1] * extents[2] + extents[2] * extents[0]).item()
-
-    def _flatten_bvh(self, node: BVHNode, parent_idx: int, depth: int) -> int:
-        node_idx = len(self.nodes)
-        self.nodes.append(node)
-        self.bboxes.append(node.bbox)
-
-        is_leaf = node.left is None and node.right is None
-        if is_leaf:
-            start = len(self.polygon_indices)
-            count = len(node.polygon_indices)
-            self.polygon_indices.extend(node.polygon_indices)
-            self.indices.extend([start, count, parent_idx, depth, 1])
-        else:
-            self.indices.extend([0, 0, parent_idx, depth, 0])
-            left_idx = self._flatten_bvh(node.left, node_idx, depth + 1)
-            right_idx = self._flatten_bvh(node.right, node_idx, depth + 1)
-            
-            self.indices[node_idx * 5] = left_idx
-            self.indices[node_idx * 5 + 1] = right_idx
-        
-        return node_idx
+    def _build_nodes(self, order: np.ndarray, tri_min: np.ndarray, tri_max: np.ndarray, centroids: np.ndarray,
+                     bboxes: np.ndarray, indices: np.ndarray) -> int:
+        """Split nodes off an explicit work list until every node is a leaf.
+
+        Each pass pops the whole work list (one tree level) and processes it as a batch,
+        so the Python overhead is per level rather than per node. Every node owns the
+        contiguous range order[start:end], which is partitioned in place; after the last
+        pass order is the leaf-ordered polygon index array. Returns the node count.
+        """
+        num_bins = self.num_bins
+        work = np.array([[0, 0, order.shape[0], -1]], dtype=np.int64)  # node, start, end, parent
+        num_nodes = 1
+        depth = 0
+        while work.shape[0] > 0:
+            node_ids, starts, ends, parents = work.T
+            counts = ends - starts
+            num_work = work.shape[0]
+
+            # Gather the triangles of every node in the work list into one segmented array
+            segment_offsets = np.cumsum(counts) - counts
+            segment = np.repeat(np.arange(num_work), counts)
+            positions = np.arange(segment.shape[0]) - segment_offsets[segment] + starts[segment]
+            tri_ids = order[positions]
+
+            node_min = np.minimum.reduceat(tri_min[tri_ids], segment_offsets, axis=0)
+            node_max = np.maximum.reduceat(tri_max[tri_ids], segment_offsets, axis=0)
+            bboxes[node_ids, :3] = node_min
+            bboxes[node_ids, 3:] = node_max
+
+            cent = centroids[tri_ids]
+            cent_min = np.minimum.reduceat(cent, segment_offsets, axis=0)
+            cent_extent = np.maximum.reduceat(cent, segment_offsets, axis=0) - cent_min
+            node_area = np.maximum(self._compute_surface_area(node_min, node_max), 1e-12)
+
+            # Binned SAH: bounds are accumulated as [min, -max] so one ufunc.at call covers both
+            boxes = np.concatenate((tri_min[tri_ids], -tri_max[tri_ids]), axis=1)
+            best_cost = np.full(num_work, np.inf)
+            best_axis = np.zeros(num_work, dtype=np.int64)
+            best_bin = np.zeros(num_work, dtype=np.int64)
+            all_bins = np.empty((3, tri_ids.shape[0]), dtype=np.int64)
+            for axis in range(3):
+                extent = cent_extent[:, axis]
+                scale = np.where(extent >= 1e-6, num_bins / np.maximum(extent, 1e-6), 0.0)
+                bins = ((cent[:, axis] - cent_min[segment, axis]) * scale[segment]).astype(np.int64)
+                np.clip(bins, 0, num_bins - 1, out=bins)
+                all_bins[axis] = bins
+
+                keys = segment * num_bins + bins
+                bin_count = np.bincount(keys, minlength=num_work * num_bins).reshape(num_work, num_bins)
+                bin_bounds = np.full((num_work * num_bins, 6), np.inf, dtype=np.float32)
+                np.minimum.at(bin_bounds, keys, boxes)
+                bin_bounds = bin_bounds.reshape(num_work, num_bins, 6)
+
+                # Split k puts bins [0, k] on the left and bins [k + 1, num_bins) on the right
+                left_bounds = np.minimum.accumulate(bin_bounds, axis=1)[:, :-1]
+                right_bounds = np.minimum.accumulate(bin_bounds[:, ::-1], axis=1)[:, ::-1][:, 1:]
+                left_count = np.cumsum(bin_count, axis=1)[:, :-1]
+                right_count = counts[:, None] - left_count
+                left_area = self._compute_surface_area(left_bounds[..., :3], -left_bounds[..., 3:])
+                right_area = self._compute_surface_area(right_bounds[..., :3], -right_bounds[..., 3:])
+
+                valid = (left_count > 0) & (right_count > 0)
+                cost = self.traversal_cost + self.intersection_cost * (
+                    left_count * np.where(valid, left_area, 0.0) +
+                    right_count * np.where(valid, right_area, 0.0)) / node_area[:, None]
+                cost = np.where(valid, cost, np.inf)
+                k = np.argmin(cost, axis=1)
+                axis_cost = cost[np.arange(num_work), k]
+                better = axis_cost < best_cost
+                best_cost = np.where(better, axis_cost, best_cost)
+                best_axis = np.where(better, axis, best_axis)
+                best_bin = np.where(better, k, best_bin)
+
+            leaf_cost = self.intersection_cost * counts
+            is_leaf = (~np.isfinite(best_cost)) | (counts <= 1) | (depth >= self.max_depth)
+            is_leaf |= (counts <= self.max_leaf_size) & (leaf_cost <= best_cost)
+
+            leaves = np.nonzero(is_leaf)[0]
+            indices[node_ids[leaves]] = np.stack([starts[leaves], counts[leaves], parents[leaves],
+                                                  np.full(leaves.shape[0], depth), np.ones(leaves.shape[0], dtype=np.int64)], axis=1)
+
+            splits = np.nonzero(~is_leaf)[0]
+            if splits.shape[0] == 0:
+                break
+            left_ids = num_nodes + 2 * np.arange(splits.shape[0])
+            right_ids = left_ids + 1
+            num_nodes += 2 * splits.shape[0]
+            indices[node_ids[splits]] = np.stack([left_ids, right_ids, parents[splits],
+                                                  np.full(splits.shape[0], depth), np.zeros(splits.shape[0], dtype=np.int64)], axis=1)
+
+            # Stable in-place partition of each split node's range into left then right
+            moving = ~is_leaf[segment]
+            goes_left = all_bins[best_axis[segment], np.arange(segment.shape[0])] <= best_bin[segment]
+            left_rank = np.cumsum(goes_left & moving) - 1
+            right_rank = np.cumsum(~goes_left & moving) - 1
+            left_before = left_rank[segment_offsets] - (goes_left & moving)[segment_offsets] + 1
+            right_before = right_rank[segment_offsets] - (~goes_left & moving)[segment_offsets] + 1
+            num_left = np.bincount(segment, weights=goes_left & moving, minlength=num_work).astype(np.int64)
+
+            new_positions = np.where(goes_left,
+                                     starts[segment] + left_rank - left_before[segment],
+                                     starts[segment] + num_left[segment] + right_rank - right_before[segment])
+            order[new_positions[moving]] = tri_ids[moving]
+
+            mids = starts[splits] + num_left[splits]
+            work = np.concatenate((
+                np.stack([left_ids, starts[splits], mids, node_ids[splits]], axis=1),
+                np.stack([right_ids, mids, ends[splits], node_ids[splits]], axis=1)))
+            depth += 1
+
+        return num_nodes
+
+    def refit(self, geos):
+        """Recompute the bounds for moved triangles, keeping the tree.
+
+        geos must hold the same triangles, in the same order, as at build time. Leaves are
+        refit from their triangles, then internal nodes from their children, deepest first.
+        """
+        triangles = np.asarray(geos, dtype=np.float32).reshape(-1, 3, 3)
+        if triangles.shape[0] != len(self.polygon_indices):
+            raise ValueError(f"Cannot refit {len(self.polygon_indices)} triangles to {triangles.shape[0]}")
+        self.geos = geos
+        ordered = triangles[self.polygon_indices]
+
+        is_leaf = self.indices[:, 4] == 1
+        leaves = np.nonzero(is_leaf & (self.indices[:, 1] > 0))[0]
+        if leaves.shape[0] > 0:
+            # Leaf ranges partition the leaf-ordered triangles, so one reduceat covers them all
+            leaves = leaves[np.argsort(self.indices[leaves, 0])]
+            starts = self.indices[leaves, 0]
+            self.bboxes[leaves, :3] = np.minimum.reduceat(ordered.min(axis=1), starts, axis=0)
+            self.bboxes[leaves, 3:] = np.maximum.reduceat(ordered.max(axis=1), starts, axis=0)
+
+        inner = np.nonzero(~is_leaf)[0]
+        depths = self.indices[inner, 3]
+        for depth in range(int(depths.max()) if inner.shape[0] else -1, -1, -1):
+            nodes = inner[depths == depth]
+            left, right = self.indices[nodes, 0], self.indices[nodes, 1]
+            self.bboxes[nodes, :3] = np.minimum(self.bboxes[left, :3], self.bboxes[right, :3])
+            self.bboxes[nodes, 3:] = np.maximum(self.bboxes[left, 3:], self.bboxes[right, 3:])
+
+    def sah_cost(self) -> float:
+        """Expected cost of a ray through the tree under the SAH, relative to the root's area.
+
+        Refitting keeps the topology while the bounds loosen, so the cost grows as the
+        geometry moves away from the configuration the tree was built for.
+        """
+        area = self._compute_surface_area(self.bboxes[:, :3].astype(np.float64), self.bboxes[:, 3:].astype(np.float64))
+        is_leaf = self.indices[:, 4] == 1
+        cost = self.traversal_cost * area[~is_leaf].sum() + self.intersection_cost * (area[is_leaf] * self.indices[is_leaf, 1]).sum()
+        return float(cost / max(area[0], 1e-12))
+
+    def over_boxes(box_min: np.ndarray, box_max: np.ndarray, **settings):
+        """Build a BVH over axis aligned boxes (e.g. instance bounds) instead of triangles.
+
+        Each box goes in as the degenerate triangle (min, max, max), whose bounds are the box.
+        """
+        box_min = np.asarray(box_min, dtype=np.float32)
+        box_max = np.asarray(box_max, dtype=np.float32)
+        return BVH(np.stack([box_min, box_max, box_max], axis=1).reshape(-1, 3), **settings)
+
+    def _compute_surface_area(self, box_min: np.ndarray, box_max: np.ndarray):
+        extents = np.maximum(box_max - box_min, 0.0)
+        return 2.0 * (extents[..., 0] * extents[..., 1] + extents[..., 1] * extents[..., 2] + extents[..., 2] * extents[..., 0])
 
     def get_bboxes(self) -> mx.array:
-        return mx.concatenate(self.bboxes)
+        return mx.array(self.bboxes.reshape(-1))
 
     def get_indices(self) -> mx.array:
-        return mx.array(self.indices, dtype=mx.int32)
+        return mx.array(self.indices.reshape(-1), dtype=mx.int32)
 
     def get_polygon_indices(self) -> mx.array:
         return mx.array(self.polygon_indices, dtype=mx.int32)
 
+    def pack_nodes(self) -> np.ndarray:
+        nodes = np.empty(len(self.indices), dtype=BVH_NODE_DTYPE)
+        nodes['box_min'] = self.bboxes[:, :3]
+        nodes['box_max'] = self.bboxes[:, 3:]
+        is_leaf = self.indices[:, 4] == 1
+        # Leaves keep their polygon_indices range, which is also their range in leaf order
+        nodes['child_or_offset'] = self.indices[:, 0]
+        nodes['count'] = np.where(is_leaf, self.indices[:, 1], 0)
+        if not np.all(self.indices[~is_leaf, 1] == self.indices[~is_leaf, 0] + 1):
+            raise Exception("Compact BVH nodes require siblings to be stored next to each other")
+        return nodes
+
+    def collapse(self, width: int = 4) -> np.ndarray:
+        """The compact nodes collapsed into wide_node_dtype(width) records, root first."""
+        return collapse_nodes(self.pack_nodes(), width)[0]
+
+    def get_nodes(self) -> mx.array:
+        # MLX has no structured dtypes, the records are passed as raw 32-bit words
+        return mx.array(self.pack_nodes().view(np.float32).reshape(-1))
+
+    def to_leaf_order(self, array) -> np.ndarray:
+        """Reorder a per-triangle buffer (geos, norms or mats) to match the leaf ranges."""
+        array = np.asarray(array)
+        num_triangles = len(self.polygon_indices)
+        per_triangle = array.reshape(num_triangles, -1)[self.polygon_indices]
+        return per_triangle.reshape(array.shape)
+
     def print_bvh(self, show_non_leaf_nodes=True):
         def print_node(index, depth):
-            if index == -1 or index >= len(self.nodes):
+            if index == -1 or index >= len(self.indices):
                 print(f"{'  ' * depth}Invalid node index: {index}")
                 return
-            
+
             indent = "  " * depth
-            bbox = self.bboxes[index]
-            
-            node_data = self.indices[index * 5 : index * 5 + 5]
-            child1, child2, parent, node_depth, is_leaf = node_data
-            
+            child1, child2, parent, node_depth, is_leaf = self.indices[index]
+
             if is_leaf:
                 print(f"{indent}Leaf Node (depth {depth}): {child2} triangles")
             elif show_non_leaf_nodes:
@@ -147,11 +375,11 @@ class BVH:
                 print_node(child1, depth + 1)
                 print_node(child2, depth + 1)
 
+        leaf_counts = self.indices[self.indices[:, 4] == 1, 1]
         print("BVH Tree Structure:")
-        print(f"Total nodes: {len(self.nodes)}")
-        leaf_nodes = [node for node in self.nodes if node.left is None and node.right is None]
-        print(f"Leaf nodes: {len(leaf_nodes)}")
-        print(f"Max depth: {max(self.indices[3::5])}")
-        print(f"Average triangles per leaf: {sum(node.end - node.start for node in leaf_nodes) / len(leaf_nodes):.2f}")
-        print(f"Max triangles in a leaf: {max(node.end - node.start for node in leaf_nodes)}")
-        print_node(0, 0)
\ No newline at end of file
+        print(f"Total nodes: {len(self.indices)}")
+        print(f"Leaf nodes: {len(leaf_counts)}")
+        print(f"Max depth: {int(self.indices[:, 3].max())}")
+        print(f"Average triangles per leaf: {leaf_counts.mean():.2f}")
+        print(f"Max triangles in a leaf: {int(leaf_counts.max())}")
+        print_node(0, 0)
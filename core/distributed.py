@@ -0,0 +1,266 @@
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+import numpy as np
+import mlx.core as mx
+
+from .accumulator import Accumulator
+from .camera import Camera
+from .image import ImageBuffer
+from .postprocess import PostProcess
+from .render import Render
+from .scene import CompiledScene
+
+# Message framing: header length and payload length, then a JSON header, then raw array bytes
+FRAME = struct.Struct("!IQ")
+
+def _dtype(descr) -> np.dtype:
+    if isinstance(descr, str):
+        return np.dtype(descr)
+    # Structured dtypes (the BVH nodes) come back from JSON as lists of lists
+    return np.lib.format.descr_to_dtype([tuple(field) for field in descr])
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        received += n
+    return buffer
+
+def send_message(sock: socket.socket, header: dict, arrays: dict = None):
+    """Send a JSON header followed by the raw bytes of arrays; recv_message rebuilds them."""
+    arrays = {name: np.ascontiguousarray(array) for name, array in (arrays or {}).items()}
+    header = dict(header, arrays=[[name, np.lib.format.dtype_to_descr(array.dtype), list(array.shape)] for name, array in arrays.items()])
+    encoded = json.dumps(header).encode()
+    payload_size = sum(array.nbytes for array in arrays.values())
+    sock.sendall(FRAME.pack(len(encoded), payload_size) + encoded)
+    for array in arrays.values():
+        if array.nbytes:
+            sock.sendall(array.reshape(-1).view(np.uint8))
+
+def recv_message(sock: socket.socket):
+    header_size, payload_size = FRAME.unpack(_recv_exact(sock, FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size).decode())
+    payload = _recv_exact(sock, payload_size)
+    arrays, offset = {}, 0
+    for name, descr, shape in header.pop("arrays"):
+        dtype = _dtype(descr)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return header, arrays
+
+def sample_seed(seed: int, sample: int, sampler: str = "blue_noise") -> int:
+    """random_seed for render_kernel's sample, the same on every machine. The sequence
+    samplers scramble the whole frame with the seed itself, as Render does, and tell
+    samples apart by index."""
+    if sampler != "blue_noise":
+        return seed
+    return int(np.random.default_rng([seed, sample]).integers(0, 2**20))
+
+class Coordinator:
+    """Splits a render into disjoint sample ranges and farms them out to RenderWorkers over TCP.
+
+    Every worker receives the compiled scene, camera and blue noise when it connects, then
+    takes one range at a time and returns the range's sum and sum of squares, plus the aovs and
+    those postprocess needs. A worker that disconnects or exceeds job_timeout is dropped and its
+    range goes back in the queue. postprocess runs on backend when the merged image is read with
+    accumulator.read(coordinator.postprocess).
+    """
+    def __init__(self, scene: CompiledScene, camera: Camera, width: int, height: int, samples: int,
+                 blue_noise_texture: np.ndarray, samples_per_job: int = 16, host: str = "0.0.0.0",
+                 port: int = 5555, job_timeout: float = 600.0, seed: int = None, sampler: str = "sobol", next_event: bool = True,
+                 roulette_depth: int = 3, postprocess: tuple = (), backend: str = "metal",
+                 aovs: tuple = ()):
+        self.scene = scene
+        self.camera = camera
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.blue_noise_texture = np.asarray(blue_noise_texture, dtype=np.float32)
+        self.samples_per_job = samples_per_job
+        self.host = host
+        self.port = port
+        self.job_timeout = job_timeout
+        self.seed = seed if seed is not None else int(np.random.default_rng().integers(0, 2**31))
+        self.sampler = sampler
+        self.next_event = next_event
+        self.roulette_depth = roulette_depth
+        self.postprocess = PostProcess(postprocess, backend)
+        self.aovs = tuple(dict.fromkeys((*aovs, *self.postprocess.aovs)))
+
+        self.jobs = queue.Queue()
+        for start in range(0, samples, samples_per_job):
+            self.jobs.put((start, min(start + samples_per_job, samples)))
+        self.accumulator = Accumulator(width, height, self.aovs)
+        self.samples_done = 0
+        # Connection threads queue results, the thread in run() merges them (MLX streams are per thread)
+        self.results = queue.Queue()
+        self.finished = threading.Event()
+        self.workers_seen = 0
+        self.jobs_reassigned = 0
+
+    def scene_message(self):
+        camera = {name: np.array(getattr(self.camera, name), dtype=np.float32).tolist() for name in ("center", "look_at", "look_up")}
+        header = {"type": "scene", "width": self.width, "height": self.height, "samples": self.samples,
+                  "fov": float(self.camera.fov), "sampler": self.sampler, "next_event": self.next_event,
+                  "roulette_depth": self.roulette_depth, "postprocess": list(self.postprocess.stages), "aovs": list(self.aovs), **camera}
+        arrays = {name: getattr(self.scene, name) for name in CompiledScene.ARRAYS}
+        arrays["blue_noise_texture"] = self.blue_noise_texture
+        return header, arrays
+
+    def run(self, on_progress = None, worker_processes = (), idle_timeout: float = None) -> Accumulator:
+        """Serve workers until every sample is merged, stop() is called or no worker is left.
+
+        on_progress(samples_done, accumulator) is called after each merged range. No worker
+        is left once no connection is open and either every process in worker_processes
+        (e.g. local workers) has exited or idle_timeout seconds passed; the accumulator then
+        holds the samples merged so far.
+        """
+        server = socket.create_server((self.host, self.port))
+        server.settimeout(0.1)
+        print(f"Coordinator listening on {self.host}:{self.port}, {self.jobs.qsize()} jobs of {self.samples_per_job} samples")
+        scene_message = self.scene_message()
+        threads = []
+        idle_since = time.time()
+        try:
+            while not self.finished.is_set():
+                try:
+                    connection, address = server.accept()
+                    self.workers_seen += 1
+                    thread = threading.Thread(target=self.serve, args=(connection, address, scene_message), daemon=True)
+                    thread.start()
+                    threads.append(thread)
+                except socket.timeout:
+                    pass
+                # Before draining, so a worker's last result is merged before it counts as gone
+                connected = any(thread.is_alive() for thread in threads)
+                while not self.results.empty():
+                    self.merge(*self.results.get(), on_progress)
+                if connected:
+                    idle_since = time.time()
+                elif not self.finished.is_set() and self.workers_gone(worker_processes, idle_since, idle_timeout):
+                    print(f"No workers left, stopping at {self.samples_done}/{self.samples} samples")
+                    break
+        finally:
+            self.finished.set()
+            server.close()
+            for thread in threads:
+                thread.join(timeout=5.0)
+        return self.accumulator
+
+    def workers_gone(self, worker_processes, idle_since: float, idle_timeout: float) -> bool:
+        if worker_processes and all(process.poll() is not None for process in worker_processes):
+            return True
+        return idle_timeout is not None and time.time() - idle_since >= idle_timeout
+
+    def serve(self, connection: socket.socket, address, scene_message):
+        name = f"{address[0]}:{address[1]}"
+        job = None
+        try:
+            connection.settimeout(self.job_timeout)
+            hello, _ = recv_message(connection)
+            print(f"Worker {name} connected ({hello.get('backend')})")
+            send_message(connection, *scene_message)
+            while not self.finished.is_set():
+                try:
+                    job = self.jobs.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                start, end = job
+                send_message(connection, {"type": "job", "start": start, "end": end, "seed": self.seed})
+                result, arrays = recv_message(connection)
+                if result.get("type") != "result" or result.get("start") != start:
+                    raise ValueError(f"Unexpected reply {result.get('type')}")
+                self.results.put((result, arrays))
+                print(f"Worker {name} finished samples {start}-{end} in {result['seconds']:.2f} seconds")
+                job = None
+            send_message(connection, {"type": "done"})
+        except (OSError, ValueError) as e:
+            print(f"Lost worker {name}: {e}")
+            if job is not None:
+                # Give the range to the next free worker
+                self.jobs.put(job)
+                self.jobs_reassigned += 1
+        finally:
+            connection.close()
+
+    def merge(self, result: dict, arrays: dict, on_progress):
+        shape = (self.height, self.width, 3)
+        aovs = {name: arrays[f"aov_{name}"].reshape(self.height, self.width, -1) for name in self.accumulator.aovs}
+        self.accumulator.add_region(0, 0, arrays["sum"].reshape(shape), arrays["sum_sq"].reshape(shape), result["count"], aovs)
+        self.accumulator.count += result["count"]
+        self.samples_done += result["count"]
+        if self.samples_done >= self.samples:
+            self.finished.set()
+        if on_progress is not None:
+            on_progress(self.samples_done, self.accumulator)
+
+    def stop(self):
+        self.finished.set()
+
+class RenderWorker:
+    """Connects to a Coordinator, renders the sample ranges it is given and returns their sums."""
+    def __init__(self, host: str, port: int, backend: str = "metal", bvh_format: str = "compact", connect_timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.backend = backend
+        self.bvh_format = bvh_format
+        self.connect_timeout = connect_timeout
+
+    def connect(self) -> socket.socket:
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection((self.host, self.port))
+            except OSError:
+                # The coordinator may still be loading the scene
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def run(self) -> int:
+        """Render until the coordinator says done, returning the number of samples rendered."""
+        connection = self.connect()
+        samples_rendered = 0
+        try:
+            send_message(connection, {"type": "hello", "backend": self.backend})
+            header, arrays = recv_message(connection)
+            render = self.create_render(header, arrays)
+            print(f"Received scene: {render.scene.num_triangles} triangles, {header['width']}x{header['height']}")
+
+            while True:
+                job, _ = recv_message(connection)
+                if job["type"] == "done":
+                    break
+                start_time = time.time()
+                accumulator = Accumulator(header["width"], header["height"], render.aovs)
+                for sample in range(job["start"], job["end"]):
+                    accumulator.add(render.render_sample(sample, random_seed=sample_seed(job["seed"], sample, render.sampler)),
+                                    aovs=render.aov_data)
+                aovs = {f"aov_{name}": np.array(values) for name, values in accumulator.aovs.items()}
+                send_message(connection,
+                             {"type": "result", "start": job["start"], "end": job["end"], "count": accumulator.count,
+                              "seconds": time.time() - start_time},
+                             {"sum": np.array(accumulator.sum), "sum_sq": np.array(accumulator.sum_sq), **aovs})
+                samples_rendered += accumulator.count
+        finally:
+            connection.close()
+        return samples_rendered
+
+    def create_render(self, header: dict, arrays: dict) -> Render:
+        scene = CompiledScene(**{name: arrays[name] for name in CompiledScene.ARRAYS})
+        camera = Camera(fov=header["fov"], center=mx.array(header["center"]), look_at=mx.array(header["look_at"]), look_up=mx.array(header["look_up"]))
+        render = Render(ImageBuffer(header["width"], header["height"]), camera, scene, bvh_format=self.bvh_format,
+                        samples=header["samples"], backend=self.backend, sampler=header["sampler"], next_event=header["next_event"],
+                        roulette_depth=header["roulette_depth"], postprocess=header["postprocess"], aovs=header["aovs"])
+        render.blue_noise_texture = arrays["blue_noise_texture"]
+        render.prepare()
+        return render
@@ -0,0 +1,91 @@
+import os
+import struct
+import zlib
+import numpy as np
+from kernels.aov import UNIT_AOVS
+
+FLOAT_FORMATS = (".exr", ".pfm", ".npy")
+BYTE_FORMATS = (".png", ".ppm")
+
+def to_8bit(image: np.ndarray) -> np.ndarray:
+    return (image * 255).clip(0, 255).astype(np.uint8)
+
+def save_image(path: str, image: np.ndarray):
+    """Save a linear float (height, width, 3) image, picking the format from the extension.
+
+    .exr/.pfm/.npy keep the float values, .png/.ppm are clipped to 8 bits. Single-channel
+    images (e.g. depth AOVs) are written as grey. The file is written next to its
+    destination and renamed, so readers never see a partial image.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    image = np.ascontiguousarray(image, dtype=np.float32)
+    if image.shape[-1] == 1:
+        image = np.repeat(image, 3, axis=-1)
+    directory = os.path.dirname(os.path.abspath(path))
+    staging = os.path.join(directory, f".{os.path.basename(path)}.tmp{extension}")
+
+    if extension == ".exr":
+        _save_exr(staging, image)
+    elif extension == ".pfm":
+        _save_pfm(staging, image)
+    elif extension == ".npy":
+        np.save(staging, image)
+    elif extension == ".png":
+        _save_png(staging, to_8bit(image))
+    elif extension == ".ppm":
+        _save_ppm(staging, to_8bit(image))
+    else:
+        raise ValueError(f"Unsupported image format: {extension}, expected one of {FLOAT_FORMATS + BYTE_FORMATS}")
+    os.replace(staging, path)
+
+def aov_path(path: str, name: str) -> str:
+    """Where an AOV of the image at path goes: out.exr -> out.depth.exr.
+
+    Next to a .png/.ppm image only albedo keeps the extension, the other AOVs would be
+    clipped to 8 bits and go to .pfm instead: out.png -> out.depth.pfm.
+    """
+    root, extension = os.path.splitext(path)
+    if extension.lower() in BYTE_FORMATS and name not in UNIT_AOVS:
+        extension = ".pfm"
+    return f"{root}.{name}{extension}"
+
+def _save_exr(path: str, image: np.ndarray):
+    try:
+        import OpenEXR
+        import Imath
+    except ImportError:
+        raise ImportError("Writing .exr requires the OpenEXR package (pip install OpenEXR), or use .pfm/.npy for float output")
+    height, width, _ = image.shape
+    header = OpenEXR.Header(width, height)
+    channel = Imath.Channel(Imath.PixelType(Imath.PixelType.FLOAT))
+    header["channels"] = {"R": channel, "G": channel, "B": channel}
+    exr = OpenEXR.OutputFile(path, header)
+    exr.writePixels({name: image[:, :, i].tobytes() for i, name in enumerate("RGB")})
+    exr.close()
+
+def _save_pfm(path: str, image: np.ndarray):
+    height, width, _ = image.shape
+    with open(path, "wb") as f:
+        # Negative scale means little endian, rows are stored bottom to top
+        f.write(f"PF\n{width} {height}\n-1.0\n".encode())
+        f.write(np.flipud(image).astype("<f4").tobytes())
+
+def _save_ppm(path: str, image: np.ndarray):
+    height, width, _ = image.shape
+    with open(path, "wb") as f:
+        f.write(f"P6\n{width} {height}\n255\n".encode())
+        f.write(image.tobytes())
+
+def _save_png(path: str, image: np.ndarray):
+    height, width, _ = image.shape
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    # Every scanline starts with filter type 0 (none)
+    scanlines = np.concatenate((np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 3)), axis=1)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
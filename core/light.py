@@ -1,4 +1,6 @@
 import mlx.core as mx
+import numpy as np
+from kernels.cpu.light import LIGHT_STRIDE
 
 class Light:
     def __init__(self):
@@ -18,3 +20,23 @@ class Light:
             [0.0, 0.0, 0.0],
             [0.0, 0.0, 0.0]
         ])
+
+# Row layout of the packed light table, LIGHT_STRIDE floats per light
+#  [0:3]  Q          - corner of the rect light
+#  [3:6]  u, [6:9] v - edge vectors
+#  [9:12] color
+#  [12]   intensity
+#  [13]   width, [14] height
+#  [15]   padding
+
+def pack_lights(lights: list) -> np.ndarray:
+    table = np.zeros((len(lights), LIGHT_STRIDE), dtype=np.float32)
+    for i, light in enumerate(lights):
+        table[i, 0:3] = np.array(light.Q)
+        table[i, 3:6] = np.array(light.u)
+        table[i, 6:9] = np.array(light.v)
+        table[i, 9:12] = np.array(light.color)
+        table[i, 12] = light.intensity
+        table[i, 13] = light.width
+        table[i, 14] = light.height
+    return table
@@ -0,0 +1,64 @@
+import mlx.core as mx
+import numpy as np
+from kernels.denoise_kernel import denoise_kernel
+from kernels.sharpen_kernel import sharpen_kernel
+from kernels.cpu.denoise import denoise
+from kernels.cpu.sharpen import sharpen
+from .accumulator import Accumulator
+
+# "denoise" is the edge-aware a-trous filter, "sharpen" the 3x3 sharpen the renderer used to run on every sample
+POSTPROCESS_STAGES = ("denoise", "sharpen")
+# AOVs each stage needs accumulated, the denoiser's guides
+STAGE_AOVS = {"denoise": ("normal", "albedo"), "sharpen": ()}
+
+class PostProcess:
+    """Filters applied in order to the accumulated image at display and output time, never per sample.
+
+    backend runs the Metal kernels ("metal") or their NumPy counterparts ("cpu"). The
+    denoiser is steered by the variance of the accumulated mean, so it smooths less as
+    samples converge; see denoise_kernel for the parameters.
+    """
+    def __init__(self, stages = ("denoise",), backend = "metal", iterations = 4,
+                 sigma_color = 2.0, sigma_normal = 128.0, sigma_albedo = 0.1):
+        for stage in stages:
+            if stage not in POSTPROCESS_STAGES:
+                raise ValueError(f"Unknown post-process stage: {stage}, expected one of {POSTPROCESS_STAGES}")
+        self.stages = tuple(stages)
+        self.backend = backend
+        self.iterations = iterations
+        self.sigma_color = sigma_color
+        self.sigma_normal = sigma_normal
+        self.sigma_albedo = sigma_albedo
+
+    @property
+    def aovs(self) -> tuple:
+        """Names of the AOVs the stages need accumulated."""
+        return tuple(dict.fromkeys(name for stage in self.stages for name in STAGE_AOVS[stage]))
+
+    def apply(self, accumulator: Accumulator) -> mx.array:
+        """The accumulator's average run through every stage, in the kernel layout (width, height, 3)."""
+        image = accumulator.average()
+        if self.backend == "cpu":
+            return mx.array(self.apply_cpu(accumulator, image))
+        for stage in self.stages:
+            if stage == "denoise":
+                image = denoise_kernel(image, accumulator.variance(), accumulator.aov("normal"), accumulator.aov("albedo"),
+                                       self.iterations, self.sigma_color, self.sigma_normal, self.sigma_albedo)
+            else:
+                image = sharpen_kernel(image)
+        return image
+
+    def apply_cpu(self, accumulator: Accumulator, image: mx.array) -> np.ndarray:
+        width, height = accumulator.width, accumulator.height
+
+        def to_image(data: mx.array) -> np.ndarray:
+            return np.array(data).reshape(height, width, -1)
+        image = to_image(image)
+        for stage in self.stages:
+            if stage == "denoise":
+                image = denoise(image, to_image(accumulator.variance())[..., 0], to_image(accumulator.aov("normal")),
+                                to_image(accumulator.aov("albedo")), self.iterations,
+                                self.sigma_color, self.sigma_normal, self.sigma_albedo)
+            else:
+                image = sharpen(image)
+        return image.reshape(width, height, 3)
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class Profiler:
+    """Wall time per named stage plus numeric counters, exported as JSON or a Chrome trace.
+
+    Wrap work in `with profiler.stage("name"):`; a disabled profiler records nothing and
+    costs a function call per stage. MLX is lazy, so callers timing device work should
+    evaluate the result inside the stage when profiler.enabled is set.
+    Load the trace in chrome://tracing or https://ui.perfetto.dev.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, start, time.perf_counter() - start, threading.get_ident(), args))
+
+    def counter(self, name: str, value: float):
+        if self.enabled:
+            self.counters.setdefault(name, []).append((time.perf_counter(), float(value)))
+
+    def summary(self) -> dict:
+        wall_seconds = time.perf_counter() - self.origin
+        stages = {}
+        for name, _, duration, _, _ in self.events:
+            stage = stages.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stage["count"] += 1
+            stage["total_seconds"] += duration
+            stage["max_seconds"] = max(stage["max_seconds"], duration)
+        for stage in stages.values():
+            stage["mean_seconds"] = stage["total_seconds"] / stage["count"]
+            stage["fraction_of_wall"] = stage["total_seconds"] / wall_seconds if wall_seconds > 0 else 0.0
+
+        counters = {}
+        for name, samples in self.counters.items():
+            values = [value for _, value in samples]
+            counters[name] = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values), "max": max(values)}
+        return {"wall_seconds": wall_seconds, "stages": stages, "counters": counters}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\n{'stage':>20} {'count':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} {'% wall':>7}")
+        for name, stage in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+            print(f"{name:>20} {stage['count']:>7} {stage['total_seconds']:>9.3f} {stage['mean_seconds'] * 1e3:>9.2f} "
+                  f"{stage['max_seconds'] * 1e3:>9.2f} {stage['fraction_of_wall'] * 100:>6.1f}%")
+        for name, counter in summary["counters"].items():
+            print(f"{name:>20} mean {counter['mean']:.2f}, max {counter['max']:.0f}")
+
+    def save_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def save_chrome_trace(self, path: str):
+        """Write stages as complete ("X") events and counters as counter ("C") events, in microseconds."""
+        pid = os.getpid()
+        events = []
+        for name, start, duration, thread_id, args in self.events:
+            events.append({"name": name, "ph": "X", "pid": pid, "tid": thread_id,
+                           "ts": (start - self.origin) * 1e6, "dur": duration * 1e6, "args": args})
+        for name, samples in self.counters.items():
+            for timestamp, value in samples:
+                events.append({"name": name, "ph": "C", "pid": pid, "ts": (timestamp - self.origin) * 1e6, "args": {name: value}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
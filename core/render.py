@@ -3,28 +3,93 @@ from .camera import Camera
 import mlx.core as mx
 import numpy as np
 from kernels.render_kernel import render_kernel
-from kernels.sharpen_kernel import sharpen_kernel
-from PySide6.QtCore import QThread, Signal
+from kernels.cpu_render_kernel import cpu_render_kernel
+from kernels.cpu.structures import CpuScene
+from kernels.registry import registry
+from kernels.aov import AOV_CHANNELS
 from .vector import *
-from .bvh import BVH
+from .bvh import BVH_FORMATS
+from .scene import CompiledScene
+from .accumulator import AOVS, Accumulator, RateLimiter
+from .postprocess import PostProcess
+from .profiler import Profiler
 import time
 from tqdm import tqdm
 from tools.bluenoise import BlueNoiseGenerator
-from scipy.ndimage import gaussian_filter
 
-class Render(QThread):
-    image_ready = Signal(np.ndarray)
+# "metal" runs the shaders in kernels/metal, "cpu" the NumPy wavefront tracer in kernels/cpu
+BACKENDS = ("metal", "cpu")
+# Sample streams: Owen-scrambled Sobol, the R2 sequence, or the blue noise texture (see sampler.metal)
+SAMPLERS = ("sobol", "r2", "blue_noise")
 
-    def __init__(self, image_buffer: ImageBuffer, camera: Camera, lights: list, geos: list, norms: list, mats: list, is_vertical_fov = False, fov_in_degrees = True):
-        super().__init__()
+def load_blue_noise(sampler: str, path: str) -> np.ndarray:
+    """The blue noise texture for the texture sampler, a placeholder buffer for the sequences."""
+    if sampler != "blue_noise":
+        return np.zeros(4, dtype=np.float32)
+    return np.asarray(BlueNoiseGenerator(256, 100, 5).load_noise(filename=path), dtype=np.float32)
+
+class Render:
+    """Progressive path tracer for a compiled scene.
+
+    Has no UI dependencies: ui.render_thread.RenderThread drives it from Qt and
+    batch_render.py from the command line.
+    """
+    def __init__(self, image_buffer: ImageBuffer, camera: Camera, scene: CompiledScene, is_vertical_fov = False, fov_in_degrees = True, bvh_format = "compact",
+                 samples = 1024, blue_noise_path = "512x512x4_3d_blue_noise.npy", backend = "metal",
+                 display_hz = 10.0, display_every = 0,
+                 adaptive = False, noise_threshold = 0.02, min_samples = 16, tile_size = 16, time_budget = None,
+                 profiler = None, traversal_stats = False, sampler = "sobol", seed = None, next_event = True,
+                 roulette_depth = 3, postprocess = (), aovs = ()):
+        if bvh_format not in BVH_FORMATS:
+            raise ValueError(f"Unknown BVH format: {bvh_format}, expected one of {BVH_FORMATS}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
+        if sampler not in SAMPLERS:
+            raise ValueError(f"Unknown sampler: {sampler}, expected one of {SAMPLERS}")
+        if scene.instanced and bvh_format == "flat":
+            raise ValueError("Instanced scenes need the compact or a wide BVH format")
+        for name in aovs:
+            if name not in AOVS:
+                raise ValueError(f"Unknown AOV: {name}, expected one of {AOVS}")
 
         self.running = True
         self.image_buffer = image_buffer
         self.camera = camera
-        self.lights = lights
-        self.geos = geos
-        self.norms = norms
-        self.mats = mats
+        self.scene = scene
+        self.bvh_format = bvh_format
+        self.backend = backend
+        self.samples = samples
+        self.blue_noise_path = blue_noise_path
+        self.sampler = sampler
+        # Scrambles the sequence samplers for the whole frame, the texture sampler draws a seed per sample
+        self.seed = seed if seed is not None else int(np.random.default_rng().integers(0, 2**31))
+        # Sample the scene's lights at every bounce, with MIS against the bounce hitting them
+        self.next_event = next_event
+        # First bounce that goes through Russian roulette, 0 traces every path to the maximum depth
+        self.roulette_depth = roulette_depth
+        # Filters of the accumulated image at display and output time, none by default, see core.postprocess
+        self.postprocess = PostProcess(postprocess, backend)
+        # AOVs accumulated next to the color, the requested ones and those the post-process needs
+        self.aovs = tuple(dict.fromkeys((*aovs, *self.postprocess.aovs)))
+        # The kernel AOVs of the last sample
+        self.aov_data = {}
+        self.display_hz = display_hz
+        self.display_every = display_every
+        self.accumulator = Accumulator(image_buffer.width, image_buffer.height, self.aovs)
+        # Adaptive sampling stops tracing a tile once its relative error is below noise_threshold
+        self.adaptive = adaptive
+        self.noise_threshold = noise_threshold
+        self.min_samples = min_samples
+        self.tile_size = tile_size
+        self.time_budget = time_budget
+        self.stop_reason = None
+        self.buffers = None
+        self.cpu_scene = None
+        self.blue_noise_texture = None
+        # Stage timings are only meaningful with a profiler, which also forces evaluation per stage
+        self.profiler = profiler or Profiler(enabled=False)
+        # Debug build of the kernels counting BVH work per pixel, see Profiler counters
+        self.traversal_stats = traversal_stats
 
         print("Initialized render engine")
         focal_length = mx.linalg.norm(self.camera.center - self.camera.look_at)
@@ -49,97 +114,244 @@ class Render(QThread):
         viewport_upper_left = camera.center - (focal_length * w) - viewport_u/2.0 - viewport_v/2.0
         self.pixel00_loc = viewport_upper_left + 0.5 * (self.pixel_delta_u + self.pixel_delta_v)
 
-    def run(self):
-        print("Preparing geos")
-        all_geos = None 
-        all_norms = None
-        all_mats = None
-        for geo in self.geos:
-            if all_geos is None:
-                all_geos = geo
-            else:
-                all_geos = np.vstack((all_geos, geo))
-        geos = mx.array(all_geos)
-
-        print("Preparing normals")
-        for norm in self.norms:
-            if all_norms is None:
-                all_norms = norm
-            else:
-                all_norms = np.vstack((all_norms, norm))
-        norms = mx.array(all_norms)
-
-
-        print("Preparing materials")
-        for mat in self.mats:
-            if all_mats is None:
-                all_mats = mat
-            else:
-                all_mats = np.vstack((all_mats, mat))
-        mats = mx.array(all_mats, dtype=mx.int32)  
-
-        print("Building BVH")
-        bvh_start_time = time.time()
-        bvh = BVH(geos)
-        bvh_end_time = time.time()
-        print(f"BVH construction time: {bvh_end_time - bvh_start_time:.2f} seconds")
-     
-
-        bboxes = mx.array(bvh.get_bboxes())
-        indices = mx.array(bvh.get_indices())
-        polygon_indices = mx.array(bvh.get_polygon_indices())
-
-        samples = 1024
-        np_image_buffer = None
+    def to_image(self, accumulated: np.ndarray) -> np.ndarray:
+        """Reshape an accumulated frame into a (height, width, 3) image."""
+        return accumulated.reshape(self.image_buffer.height, self.image_buffer.width, 3)
 
-        start_time = time.time()
+    def prepare(self):
+        """Upload the scene and load blue noise once (texture sampler only); run() calls this before the first sample."""
+        with self.profiler.stage("upload"):
+            self.upload()
+
+    def upload(self):
+        scene = self.scene
+        buffers = {
+            "geos": mx.array(scene.geos),
+            "norms": mx.array(scene.norms),
+            "mats": mx.array(scene.mats, dtype=mx.int32),
+            "bvh_nodes": None, "bboxes": None, "indices": None, "polygon_indices": None, "instances": None,
+            "lights": mx.array(scene.lights.reshape(-1)) if len(scene.lights) else None,
+        }
+        nodes, instances = scene.traversal_nodes(self.bvh_format)
+        if self.bvh_format != "flat":
+            # MLX has no structured dtypes, the node records are passed as raw 32-bit words
+            buffers["bvh_nodes"] = mx.array(np.ascontiguousarray(nodes).view(np.float32).reshape(-1))
+            if scene.instanced:
+                buffers["instances"] = mx.array(np.ascontiguousarray(instances).view(np.float32).reshape(-1))
+        else:
+            buffers["bboxes"] = mx.array(scene.bboxes.reshape(-1))
+            buffers["indices"] = mx.array(scene.indices.reshape(-1), dtype=mx.int32)
+            buffers["polygon_indices"] = mx.array(scene.polygon_indices, dtype=mx.int32)
+        if self.profiler.enabled:
+            mx.eval([buffer for buffer in buffers.values() if buffer is not None])
+        self.buffers = buffers
 
-        blue_noise_generator = BlueNoiseGenerator(256, 100, 5)
-        blue_noise_texture = blue_noise_generator.load_noise(filename="512x512x4_3d_blue_noise.npy")
-        blue_noise_texture_size = blue_noise_texture.shape[0]
+        # The CPU tracer walks the compact nodes for the flat format too
+        self.cpu_scene = CpuScene(scene.geos, scene.norms, scene.mats, nodes, instances, scene.lights) if self.backend == "cpu" else None
 
-        for i in tqdm(range(samples), desc="Rendering", unit="sample"):
-            if not self.running:
-                break 
-            self.image_buffer.data = render_kernel(
+        if self.blue_noise_texture is None:
+            self.blue_noise_texture = load_blue_noise(self.sampler, self.blue_noise_path)
+
+    def render_sample(self, sample: int, active: mx.array = None, random_seed: int = None) -> mx.array:
+        """Trace one full-frame sample into image_buffer.data and return it, with its AOVs in aov_data.
+
+        random_seed offsets the per-pixel noise sequences; None draws a fresh one, a fixed
+        value makes the sample reproducible (e.g. on another machine). The sequence samplers
+        tell samples apart by index and use self.seed unless given one for the frame.
+        """
+        if self.buffers is None:
+            self.prepare()
+        profiler = self.profiler
+
+        with profiler.stage("kernel", sample=sample):
+            stats = self.dispatch(sample, active, random_seed)
+            if profiler.enabled:
+                mx.eval(self.image_buffer.data)
+        if stats is not None:
+            self.record_traversal_stats(np.array(stats), active)
+        return self.image_buffer.data
+
+    def dispatch(self, sample: int, active: mx.array = None, random_seed: int = None):
+        """Run the backend's kernel into image_buffer.data and aov_data, returning the traversal counters if enabled."""
+        buffers = self.buffers
+        blue_noise_texture = self.blue_noise_texture
+        aovs = tuple(name for name in self.aovs if name in AOV_CHANNELS)
+        extras = {}
+        if random_seed is None and self.sampler != "blue_noise":
+            random_seed = self.seed
+
+        if self.backend == "cpu":
+            sample_data = cpu_render_kernel(
+                image_buffer  = self.image_buffer.data,
+                camera_center = self.camera.center,
+                pixel00_loc   = self.pixel00_loc,
+                pixel_delta_u = self.pixel_delta_u,
+                pixel_delta_v = self.pixel_delta_v,
+                sample        = sample,
+                samples       = self.samples,
+                scene         = self.cpu_scene,
+                blue_noise_texture = blue_noise_texture,
+                random_seed   = random_seed,
+                active        = np.array(active) if active is not None else None,
+                traversal_stats = self.traversal_stats,
+                sampler       = self.sampler,
+                next_event    = self.next_event,
+                roulette_depth = self.roulette_depth,
+                aovs          = aovs,
+            )
+            if self.traversal_stats or aovs:
+                sample_data, extras = sample_data
+                extras = {name: mx.array(values) for name, values in extras.items()}
+            self.image_buffer.data = mx.array(sample_data)
+
+        else:
+            sample_data = render_kernel(
                 image_buffer  = self.image_buffer.data, 
                 camera_center = self.camera.center,
                 pixel00_loc   = self.pixel00_loc, 
                 pixel_delta_u = self.pixel_delta_u, 
                 pixel_delta_v = self.pixel_delta_v,
-                sample        = i,
-                samples       = samples,
-                geos          = geos,
-                norms         = norms,
-                mats          = mats,
-                bboxes        = bboxes,
-                indices       = indices,
-                polygon_indices = polygon_indices,
+                sample        = sample,
+                samples       = self.samples,
+                geos          = buffers["geos"],
+                norms         = buffers["norms"],
+                mats          = buffers["mats"],
+                bboxes        = buffers["bboxes"],
+                indices       = buffers["indices"],
+                polygon_indices = buffers["polygon_indices"],
                 blue_noise_texture  = blue_noise_texture,
-                blue_noise_texture_size = blue_noise_texture_size,
+                blue_noise_texture_size = blue_noise_texture.shape[0],
+                bvh_nodes     = buffers["bvh_nodes"],
+                bvh_format    = self.bvh_format,
+                random_seed   = random_seed,
+                active        = active,
+                traversal_stats = self.traversal_stats,
+                instances     = buffers["instances"],
+                sampler       = self.sampler,
+                lights        = buffers["lights"],
+                light_count   = len(self.scene.lights),
+                next_event    = self.next_event,
+                roulette_depth = self.roulette_depth,
+                aovs          = aovs,
             )
+            if self.traversal_stats or aovs:
+                sample_data, extras = sample_data
+            self.image_buffer.data = sample_data
+        self.aov_data = {name: extras[name] for name in aovs}
+        return extras.get("stats")
 
-            self.image_buffer.data = sharpen_kernel(self.image_buffer.data)
+    def record_traversal_stats(self, stats: np.ndarray, active: mx.array = None):
+        """Per-pixel AABB tests, triangle tests and deepest stack of one sample, over the traced pixels."""
+        stats = stats.reshape(-1, 3)
+        if active is not None:
+            stats = stats[np.array(active).reshape(-1) > 0]
+        if len(stats) == 0:
+            return
+        self.profiler.counter("aabb_tests_per_pixel", stats[:, 0].mean())
+        self.profiler.counter("triangle_tests_per_pixel", stats[:, 1].mean())
+        self.profiler.counter("max_stack_depth", stats[:, 2].max())
 
-            if np_image_buffer is None:
-                np_image_buffer = np.array(self.image_buffer.data)
-            else:
-                np_image_buffer += np.array(self.image_buffer.data)
+    def run(self, on_sample = None, on_display = None):
+        """Accumulate samples until done or stopped.
 
-            # Calculate average image
-            avg_image = np_image_buffer / float(i+1)
+        The running sum stays in self.accumulator on the device. on_sample(samples_done,
+        accumulator) is called after every sample and reads back only if it asks to.
+        on_display(samples_done, image) receives the 8-bit preview of the post-processed
+        average, produced at most display_hz times per second and/or every display_every
+        samples, plus once at the end.
+        Stops after self.samples passes, when time_budget seconds have elapsed, or in
+        adaptive mode once every tile is below noise_threshold (see report()).
+        Returns the number of sample passes rendered.
+        """
+        self.running = True
+        self.prepare()
+        profiler = self.profiler
+        samples = self.samples
+        samples_done = 0
+        self.accumulator = Accumulator(self.image_buffer.width, self.image_buffer.height, self.aovs)
+        display_limiter = RateLimiter(self.display_hz, self.display_every)
+        samples_displayed = 0
 
-            # Ensure the image is in the correct format for display
-            image_data = (avg_image * 255).clip(0, 255).astype(np.uint8)
+        def display(samples_done):
+            with profiler.stage("postprocess"):
+                image = self.accumulator.image(self.postprocess)
+                if profiler.enabled:
+                    mx.eval(image)
+            with profiler.stage("readback"):
+                preview = self.accumulator.preview(image)
+            with profiler.stage("emit"):
+                on_display(samples_done, preview)
 
-            self.image_ready.emit(image_data)
-            
-            # Update progress bar
-            tqdm.write(f"Completed {i+1}/{samples} samples")
+        start_time = time.time()
+
+        self.stop_reason = "samples"
+        for i in tqdm(range(samples), desc="Rendering", unit="sample"):
+            if not self.running:
+                self.stop_reason = "stopped"
+                break 
+            if self.time_budget is not None and time.time() - start_time >= self.time_budget:
+                self.stop_reason = "time_budget"
+                break
+
+            active = None
+            if self.adaptive and samples_done >= self.min_samples:
+                with profiler.stage("adaptive_mask"):
+                    active_tiles = self.accumulator.tile_error(self.tile_size) > self.noise_threshold
+                    converged = not mx.any(active_tiles).item()
+                    if not converged:
+                        active = self.accumulator.tile_mask(active_tiles, self.tile_size)
+                if converged:
+                    self.stop_reason = "converged"
+                    break
+
+            self.render_sample(i, active=active)
+            with profiler.stage("accumulate"):
+                self.accumulator.add(self.image_buffer.data, active, self.aov_data)
+            samples_done = i + 1
+
+            if on_sample is not None:
+                with profiler.stage("on_sample"):
+                    on_sample(samples_done, self.accumulator)
+            if on_display is not None and display_limiter.due(samples_done, final=samples_done == samples):
+                display(samples_done)
+                samples_displayed = samples_done
+
+        # Stopped, out of time or converged: show the last samples too
+        if on_display is not None and samples_done > samples_displayed:
+            display(samples_done)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
         print(f"Total rendering time: {elapsed_time:.2f} seconds")
+        if self.backend == "metal":
+            kernel_stats = registry.stats()
+            print(f"Kernel compiles: {kernel_stats['compiles']}, cache hits: {kernel_stats['cache_hits']}")
+        if self.adaptive:
+            report = self.report()
+            print(f"Adaptive sampling stopped ({self.stop_reason}): {report['mean_spp']:.1f} mean spp over {samples_done} passes, "
+                  f"mean tile error {report['mean_error']:.4f}, max {report['max_error']:.4f}")
+        return samples_done
+
+    def report(self) -> dict:
+        """Achieved error and samples spent per tile, rows top to bottom.
+
+        Compare against a fixed-spp render at mean_spp, which costs the same number of samples.
+        """
+        tile_error = np.array(self.accumulator.tile_error(self.tile_size))
+        tile_samples = np.array(self.accumulator.tile_samples(self.tile_size))
+        return {
+            "stop_reason": self.stop_reason,
+            "passes": self.accumulator.count,
+            "tile_size": self.tile_size,
+            "noise_threshold": self.noise_threshold,
+            "mean_spp": float(np.array(self.accumulator.counts).mean()),
+            "mean_error": float(tile_error.mean()),
+            "max_error": float(tile_error.max()),
+            "tiles_converged": int((tile_error <= self.noise_threshold).sum()),
+            "tiles": int(tile_error.size),
+            "tile_error": tile_error.tolist(),
+            "tile_samples": tile_samples.tolist(),
+        }
 
     def stop(self):
         self.running = False
\ No newline at end of file
@@ -0,0 +1,255 @@
+import json
+import os
+import time
+import numpy as np
+from .bvh import BVH, BVH_WIDTHS, INSTANCE_DTYPE, collapse_nodes
+from .light import pack_lights
+from .profiler import Profiler
+
+class CompiledScene:
+    """Render-ready scene buffers.
+
+    Triangles are stored in BVH leaf order, so both BVH formats index geos/norms/mats
+    directly: the compact nodes through their offsets and the flat layout through
+    polygon_indices, which is the identity permutation.
+      geos, norms - float32 (3 * num_triangles, 3)
+      mats        - int32 (num_triangles, 1)
+      bboxes      - float32 (num_nodes, 6), indices - int32 (num_nodes, 5)
+      nodes       - BVH_NODE_DTYPE (num_nodes,)
+      lights      - float32 (num_lights, LIGHT_STRIDE)
+      instances   - INSTANCE_DTYPE (num_instances,), empty unless the scene is instanced
+
+    Instanced scenes use a two-level BVH (compact format only): nodes starts with the
+    top-level tree, whose leaves index instances, followed by one bottom-level tree per
+    prototype over its object space triangles. bboxes and indices are empty.
+    """
+    ARRAYS = ("geos", "norms", "mats", "bboxes", "indices", "nodes", "lights", "instances")
+
+    def __init__(self, geos, norms, mats, bboxes, indices, nodes, lights, instances=None):
+        self.geos = geos
+        self.norms = norms
+        self.mats = mats
+        self.bboxes = bboxes
+        self.indices = indices
+        self.nodes = nodes
+        self.lights = lights
+        self.instances = instances if instances is not None else np.empty(0, dtype=INSTANCE_DTYPE)
+
+    @property
+    def num_triangles(self) -> int:
+        return self.mats.shape[0]
+
+    @property
+    def instanced(self) -> bool:
+        return len(self.instances) > 0
+
+    @property
+    def polygon_indices(self) -> np.ndarray:
+        return np.arange(self.num_triangles, dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"num_triangles": self.num_triangles, "num_nodes": len(self.nodes),
+                       "num_instances": len(self.instances), "nbytes": self.nbytes}, f)
+
+    def traversal_nodes(self, bvh_format: str = "compact"):
+        """(nodes, instances) the tracers walk for bvh_format. The wide formats collapse the compact
+        nodes (see collapse_nodes), instance roots then index the wide nodes; the others keep them."""
+        if bvh_format not in BVH_WIDTHS:
+            return self.nodes, self.instances
+        if not self.instanced:
+            return collapse_nodes(self.nodes, BVH_WIDTHS[bvh_format])[0], self.instances
+        roots, inverse = np.unique(self.instances['root'], return_inverse=True)
+        nodes, wide_roots = collapse_nodes(self.nodes, BVH_WIDTHS[bvh_format], np.concatenate([[0], roots]))
+        instances = np.array(self.instances)
+        instances['root'] = wide_roots[1:][inverse]
+        return nodes, instances
+
+    def load(directory: str, mmap_mode: str = "r"):
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in CompiledScene.ARRAYS}
+        return CompiledScene(**arrays)
+
+
+def compile_scene(geos: list, norms: list, mats: list, lights: list, profiler: Profiler = None,
+                  prototypes: list = None, instances: list = None, **bvh_settings) -> CompiledScene:
+    """Concatenate per-mesh buffers, build the BVH and reorder the triangles into leaf order.
+
+    With instances, (prototype, object_to_world) pairs into prototypes, a list of object
+    space (geos, norms, mats), the scene gets a two-level BVH instead (see compile_instances).
+    """
+    profiler = profiler or Profiler(enabled=False)
+    if instances:
+        return compile_instances(geos, norms, mats, lights, prototypes, instances, profiler, **bvh_settings)
+    print("Preparing geos")
+    with profiler.stage("concatenate"):
+        all_geos = _concatenate(geos, 3, np.float32)
+        all_norms = _concatenate(norms, 3, np.float32)
+        all_mats = _concatenate(mats, 1, np.int32)
+
+    print("Building BVH")
+    bvh_start_time = time.time()
+    with profiler.stage("bvh_build", triangles=len(all_mats)):
+        bvh = BVH(all_geos, **bvh_settings)
+    bvh_end_time = time.time()
+    print(f"BVH construction time: {bvh_end_time - bvh_start_time:.2f} seconds")
+
+    with profiler.stage("leaf_reorder"):
+        return pack_scene(bvh, all_geos, all_norms, all_mats, lights)
+
+def pack_scene(bvh: BVH, all_geos: np.ndarray, all_norms: np.ndarray, all_mats: np.ndarray, lights: list) -> CompiledScene:
+    """CompiledScene of concatenated buffers and the BVH built (or refit) over them."""
+    return CompiledScene(
+        geos=bvh.to_leaf_order(all_geos),
+        norms=bvh.to_leaf_order(all_norms),
+        mats=bvh.to_leaf_order(all_mats),
+        bboxes=bvh.bboxes.copy(),
+        indices=bvh.indices,
+        nodes=bvh.pack_nodes(),
+        lights=pack_lights(lights),
+    )
+
+class DynamicScene:
+    """Compiles successive frames of a scene whose triangles move, refitting instead of rebuilding.
+
+    As long as the triangle count is unchanged, update() refits the previous frame's BVH
+    (milliseconds, see BVH.refit) and only rebuilds once the refit tree's SAH cost has grown
+    by more than rebuild_threshold relative to the cost right after the last build.
+    """
+    def __init__(self, rebuild_threshold: float = 0.5, profiler: Profiler = None, **bvh_settings):
+        self.rebuild_threshold = rebuild_threshold
+        self.profiler = profiler or Profiler(enabled=False)
+        self.bvh_settings = bvh_settings
+        self.bvh = None
+        self.built_cost = None
+        self.cost = None
+        self.refits = 0
+        self.rebuilds = 0
+
+    def update(self, geos: list, norms: list, mats: list, lights: list) -> CompiledScene:
+        profiler = self.profiler
+        with profiler.stage("concatenate"):
+            all_geos = _concatenate(geos, 3, np.float32)
+            all_norms = _concatenate(norms, 3, np.float32)
+            all_mats = _concatenate(mats, 1, np.int32)
+
+        start_time = time.time()
+        rebuild = self.bvh is None or len(self.bvh.polygon_indices) != len(all_mats)
+        if not rebuild:
+            with profiler.stage("bvh_refit", triangles=len(all_mats)):
+                self.bvh.refit(all_geos)
+                self.cost = self.bvh.sah_cost()
+            self.refits += 1
+            growth = self.cost / max(self.built_cost, 1e-12) - 1.0
+            if growth > self.rebuild_threshold:
+                print(f"Refit SAH cost grew {growth:.0%} since the last build, rebuilding")
+                rebuild = True
+        if rebuild:
+            with profiler.stage("bvh_build", triangles=len(all_mats)):
+                self.bvh = BVH(all_geos, **self.bvh_settings)
+                self.cost = self.built_cost = self.bvh.sah_cost()
+            self.rebuilds += 1
+        print(f"BVH {'build' if rebuild else 'refit'} time: {time.time() - start_time:.3f} seconds (SAH cost {self.cost:.1f})")
+
+        with profiler.stage("leaf_reorder"):
+            return pack_scene(self.bvh, all_geos, all_norms, all_mats, lights)
+
+
+def _concatenate(arrays: list, columns: int, dtype) -> np.ndarray:
+    return np.concatenate(arrays, axis=0).astype(dtype) if arrays else np.empty((0, columns), dtype=dtype)
+
+def compile_instances(geos: list, norms: list, mats: list, lights: list, prototypes: list, instances: list,
+                      profiler: Profiler, **bvh_settings) -> CompiledScene:
+    """Build one bottom-level BVH per prototype and a top-level BVH over the instance bounds.
+
+    Memory and build time scale with the unique triangles; each instance costs one
+    INSTANCE_DTYPE record. Non-instanced world space geometry becomes one more prototype
+    with an identity instance. object_to_world matrices are 4x4 and act on row vectors.
+    """
+    prototypes = list(prototypes)
+    instances = list(instances)
+    if geos:
+        prototypes.append((_concatenate(geos, 3, np.float32), _concatenate(norms, 3, np.float32), _concatenate(mats, 1, np.int32)))
+        instances.append((len(prototypes) - 1, np.eye(4)))
+
+    print(f"Building bottom-level BVHs for {len(prototypes)} prototypes")
+    bvh_start_time = time.time()
+    blas_nodes, blas_geos, blas_norms, blas_mats = [], [], [], []
+    roots, proto_min, proto_max = [], [], []
+    node_count, triangle_count = 0, 0
+    for index, (proto_geos, proto_norms, proto_mats) in enumerate(prototypes):
+        num_triangles = len(proto_mats)
+        if num_triangles == 0:
+            roots.append(-1)
+            proto_min.append(np.zeros(3))
+            proto_max.append(np.zeros(3))
+            continue
+        with profiler.stage("bvh_build", prototype=index, triangles=num_triangles):
+            bvh = BVH(np.asarray(proto_geos, dtype=np.float32), **bvh_settings)
+        nodes = bvh.pack_nodes()
+        # Rebase child indices onto the shared node array and leaf offsets onto the shared triangles
+        inner = (nodes['count'] == 0) & (nodes['child_or_offset'] > 0)
+        nodes['child_or_offset'][inner] += node_count
+        nodes['child_or_offset'][nodes['count'] > 0] += triangle_count
+        roots.append(node_count)
+        proto_min.append(nodes['box_min'][0])
+        proto_max.append(nodes['box_max'][0])
+        blas_nodes.append(nodes)
+        blas_geos.append(bvh.to_leaf_order(np.asarray(proto_geos, dtype=np.float32)))
+        blas_norms.append(bvh.to_leaf_order(np.asarray(proto_norms, dtype=np.float32)))
+        blas_mats.append(bvh.to_leaf_order(np.asarray(proto_mats, dtype=np.int32).reshape(-1, 1)))
+        node_count += len(nodes)
+        triangle_count += num_triangles
+
+    prototype_ids = np.array([prototype for prototype, _ in instances], dtype=np.int32).reshape(-1)
+    object_to_world = np.array([xform for _, xform in instances], dtype=np.float64).reshape(-1, 4, 4)
+    keep = np.asarray(roots, dtype=np.int32)[prototype_ids] >= 0
+    prototype_ids, object_to_world = prototype_ids[keep], object_to_world[keep]
+
+    # World bounds of every instance from the eight transformed corners of its prototype's bounds
+    corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+    box_min, box_max = np.asarray(proto_min)[prototype_ids], np.asarray(proto_max)[prototype_ids]
+    box = box_min[:, None] + corners[None] * (box_max - box_min)[:, None]
+    world = np.concatenate((box, np.ones(box.shape[:2] + (1,))), axis=2) @ object_to_world
+    world = world[..., :3] / world[..., 3:]
+
+    records = np.zeros(len(prototype_ids), dtype=INSTANCE_DTYPE)
+    records['world_to_object'] = np.linalg.inv(object_to_world)[..., :3] if len(records) else 0.0
+    records['root'] = np.asarray(roots, dtype=np.int32)[prototype_ids]
+    records['prototype'] = prototype_ids
+    world_min, world_max = world.min(axis=1), world.max(axis=1)
+
+    print("Building top-level BVH")
+    with profiler.stage("tlas_build", instances=len(records)):
+        tlas = BVH.over_boxes(world_min, world_max, **bvh_settings)
+    bvh_end_time = time.time()
+    print(f"BVH construction time: {bvh_end_time - bvh_start_time:.2f} seconds")
+
+    with profiler.stage("leaf_reorder"):
+        tlas_nodes = tlas.pack_nodes()
+        blas_nodes = np.concatenate(blas_nodes) if blas_nodes else np.empty(0, dtype=tlas_nodes.dtype)
+        # The top-level tree goes first so both levels start at node 0 of their own tree
+        inner = (blas_nodes['count'] == 0) & (blas_nodes['child_or_offset'] > 0)
+        blas_nodes['child_or_offset'][inner] += len(tlas_nodes)
+        records['root'] += len(tlas_nodes)
+        records = tlas.to_leaf_order(records)
+
+        instanced_triangles = sum(len(prototypes[p][2]) for p in records['prototype'])
+        print(f"Two-level BVH: {len(records)} instances of {len(blas_geos)} prototypes, "
+              f"{triangle_count} unique of {instanced_triangles} instanced triangles")
+        return CompiledScene(
+            geos=_concatenate(blas_geos, 3, np.float32),
+            norms=_concatenate(blas_norms, 3, np.float32),
+            mats=_concatenate(blas_mats, 1, np.int32),
+            bboxes=np.empty((0, 6), dtype=np.float32),
+            indices=np.empty((0, 5), dtype=np.int32),
+            nodes=np.concatenate([tlas_nodes, blas_nodes]),
+            lights=pack_lights(lights),
+            instances=records,
+        )
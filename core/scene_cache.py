@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from .scene import CompiledScene
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mlxray", "scenes")
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+
+class SceneCache:
+    """On-disk cache of compiled scenes.
+
+    Every entry is a directory of .npy files (see CompiledScene.save) named after its key,
+    loaded memory-mapped on a hit. Entries are evicted least recently used first once the
+    total size exceeds max_bytes; a hit refreshes the entry's modification time.
+    """
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or os.environ.get("MLXRAY_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get("MLXRAY_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, *parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, (str, bytes)):
+                part = json.dumps(part, sort_keys=True, default=str)
+            digest.update(part if isinstance(part, bytes) else part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self, key: str):
+        entry = self._entry(key)
+        if not os.path.isfile(os.path.join(entry, "meta.json")):
+            return None
+        try:
+            scene = CompiledScene.load(entry)
+        except (OSError, ValueError) as e:
+            print(f"Discarding unreadable scene cache entry {key}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        os.utime(entry)
+        print(f"Loaded compiled scene from cache: {entry}")
+        return scene
+
+    def store(self, key: str, scene: CompiledScene):
+        # Write next to the final location and rename, so readers never see a partial entry
+        staging = tempfile.mkdtemp(prefix=f".{key}.", dir=self.directory)
+        try:
+            scene.save(staging)
+            entry = self._entry(key)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        print(f"Stored compiled scene in cache: {entry}")
+        self.evict(keep=key)
+
+    def entries(self) -> list:
+        """Return (last_used, size_in_bytes, key) for every entry, least recently used first."""
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = self._entry(key)
+            if key.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, key))
+        return sorted(entries)
+
+    def evict(self, keep: str = None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            print(f"Evicting scene cache entry {key} ({size / 1024 ** 2:.1f} MB)")
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
@@ -0,0 +1,141 @@
+import os
+import uuid
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+from kernels.cpu.structures import CpuScene
+from .scene import CompiledScene
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block with the resource
+        # tracker, which then unlinks it behind the owner's back. Skip the registration.
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+class SharedArrays:
+    """NumPy arrays placed once in named shared memory blocks.
+
+    The creating process owns the blocks and unlinks them in close(). Other processes
+    pass handle to SharedArrays.attach and get read-only views of the same pages, so
+    each additional process costs no copy of the data.
+    """
+    def __init__(self, blocks: dict, specs: dict, owner: bool):
+        self.blocks = blocks
+        self.specs = specs
+        self.owner = owner
+        self.arrays = {}
+        for name, (block_name, shape, dtype) in specs.items():
+            array = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+            if not owner:
+                array.flags.writeable = False
+            self.arrays[name] = array
+
+    def create(arrays: dict, prefix: str = "mlxray"):
+        token = f"{prefix}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        blocks, specs = {}, {}
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                # Zero sized blocks are not allowed
+                block = shared_memory.SharedMemory(name=f"{token}_{name}", create=True, size=max(array.nbytes, 1))
+                blocks[name] = block
+                specs[name] = (block.name, array.shape, array.dtype)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        except Exception:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        return SharedArrays(blocks, specs, owner=True)
+
+    def attach(handle: dict):
+        blocks = {}
+        for name, (block_name, shape, dtype) in handle.items():
+            blocks[name] = _attach_block(block_name)
+        return SharedArrays(blocks, handle, owner=False)
+
+    @property
+    def handle(self) -> dict:
+        """Picklable description of the blocks: {name: (block_name, shape, dtype)}."""
+        return dict(self.specs)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self):
+        """Release the views and mappings; the owner also removes the blocks."""
+        self.arrays = {}
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # A view is still referenced elsewhere, its mapping goes away with it
+                pass
+            if self.owner:
+                try:
+                    block.unlink()
+                except FileNotFoundError:
+                    pass
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SharedScene:
+    """The arrays the CPU tracer reads, scene traversal arrays and blue noise, in shared memory.
+
+    Create it once in the parent, pass handle to workers and attach there:
+        with SharedScene.create(scene, blue_noise_texture) as shared:
+            pool = Pool(initializer=init, initargs=(shared.handle,))
+        # in init: scene = SharedScene.attach(handle).cpu_scene()
+    """
+    def __init__(self, arrays: SharedArrays):
+        self.arrays = arrays
+
+    def create(scene: CompiledScene, blue_noise_texture: np.ndarray, bvh_format: str = "compact"):
+        nodes, instances = scene.traversal_nodes(bvh_format)
+        cpu_scene = CpuScene(scene.geos, scene.norms, scene.mats, nodes, instances, scene.lights)
+        arrays = {f"cpu_{name}": array for name, array in cpu_scene.arrays().items()}
+        arrays["blue_noise_texture"] = np.asarray(blue_noise_texture, dtype=np.float32)
+        return SharedScene(SharedArrays.create(arrays))
+
+    def attach(handle: dict):
+        return SharedScene(SharedArrays.attach(handle))
+
+    @property
+    def handle(self) -> dict:
+        return self.arrays.handle
+
+    @property
+    def nbytes(self) -> int:
+        return self.arrays.nbytes
+
+    @property
+    def blue_noise_texture(self) -> np.ndarray:
+        return self.arrays["blue_noise_texture"]
+
+    def cpu_scene(self) -> CpuScene:
+        return CpuScene.from_arrays({name: self.arrays[f"cpu_{name}"] for name in CpuScene.ARRAYS})
+
+    def close(self):
+        self.arrays.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
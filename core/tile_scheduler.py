@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import signal
+import time
+import numpy as np
+from tqdm import tqdm
+
+from kernels.aov import AOV_CHANNELS
+from kernels.cpu_render_kernel import cpu_render_pixels
+from .accumulator import LATEST_AOVS, Accumulator
+from .render import Render, load_blue_noise
+from .shared_scene import SharedScene
+
+# Per-process state, set once by _init_worker so jobs only carry tile coordinates
+_worker = {}
+
+def _init_worker(scene_handle, camera, width, height, sampler, next_event, roulette_depth, aovs):
+    # The parent handles Ctrl-C and tears the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Read-only views of the parent's shared memory, nothing is copied per worker
+    shared = SharedScene.attach(scene_handle)
+    _worker["shared"] = shared
+    _worker["scene"] = shared.cpu_scene()
+    _worker["camera"] = camera
+    _worker["blue_noise_texture"] = shared.blue_noise_texture
+    _worker["width"] = width
+    _worker["height"] = height
+    _worker["sampler"] = sampler
+    _worker["next_event"] = next_event
+    _worker["roulette_depth"] = roulette_depth
+    _worker["aovs"] = aovs
+
+def _render_tile(job):
+    """Trace a range of samples for one tile and return their sums, and its AOVs as Accumulator keeps them."""
+    tile, first_sample, seeds = job
+    x0, y0, x1, y1 = tile
+    width = _worker["width"]
+    start_time = time.time()
+
+    ys, xs = np.mgrid[y0:y1, x0:x1]
+    pixels = (xs + ys * width).reshape(-1)
+    shape = (y1 - y0, x1 - x0, 3)
+
+    tile_sum = np.zeros(shape, dtype=np.float32)
+    tile_sum_sq = np.zeros_like(tile_sum)
+    aovs = {name: np.empty((len(pixels), AOV_CHANNELS[name]), dtype=np.float32) for name in _worker["aovs"]}
+    tile_aovs = {name: np.zeros((*shape[:2], AOV_CHANNELS[name]), dtype=np.float32) for name in aovs}
+    for sample, seed in enumerate(seeds, first_sample):
+        colors = cpu_render_pixels(pixels, width, *_worker["camera"], _worker["scene"], _worker["blue_noise_texture"], int(seed),
+                                   sample=sample, sampler=_worker["sampler"], next_event=_worker["next_event"],
+                                   roulette_depth=_worker["roulette_depth"], aovs=aovs)
+        sample = colors.reshape(shape)
+        tile_sum += sample
+        tile_sum_sq += sample * sample
+        for name, values in aovs.items():
+            values = values.reshape(tile_aovs[name].shape)
+            tile_aovs[name] = values.copy() if name in LATEST_AOVS else tile_aovs[name] + values
+    return tile, len(seeds), tile_sum, tile_sum_sq, tile_aovs, time.time() - start_time
+
+class TileScheduler:
+    """Renders a frame with the CPU tracer as (tile, sample range) jobs on a pool of processes.
+
+    Jobs go out one at a time as workers free up, so slow tiles (the light, dense
+    geometry) do not hold the others back. Jobs are ordered sample range first, so the
+    whole frame refines evenly. Results are merged into render.accumulator as they
+    complete; render.samples, time_budget and stop() are honoured.
+    """
+    def __init__(self, render: Render, workers: int = None, tile_size: int = 64, samples_per_job: int = 4):
+        self.render = render
+        self.workers = workers or os.cpu_count()
+        self.tile_size = tile_size
+        self.samples_per_job = samples_per_job
+        width, height = render.image_buffer.width, render.image_buffer.height
+        self.tiles = [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+                      for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+        self.tile_seconds = {}
+
+    def jobs(self, seeds: np.ndarray):
+        for start in range(0, len(seeds), self.samples_per_job):
+            for tile in self.tiles:
+                yield tile, start, seeds[start:start + self.samples_per_job]
+
+    def run(self, on_sample = None):
+        """Render until done or stopped, calling on_sample(samples_done, accumulator) whenever
+        every pixel has received another sample. Returns the samples every pixel received."""
+        render = self.render
+        render.running = True
+        width, height = render.image_buffer.width, render.image_buffer.height
+        render.accumulator = Accumulator(width, height, render.aovs)
+
+        blue_noise_texture = load_blue_noise(render.sampler, render.blue_noise_path)
+        camera = tuple(np.array(v, dtype=np.float32) for v in (render.camera.center, render.pixel00_loc, render.pixel_delta_u, render.pixel_delta_v))
+        # One seed per sample shared by all tiles, as in a full-frame pass; the sequences keep one per frame
+        if render.sampler == "blue_noise":
+            seeds = np.random.default_rng().integers(0, 2**20, render.samples)
+        else:
+            seeds = np.full(render.samples, render.seed)
+
+        tile_samples = {tile: 0 for tile in self.tiles}
+        self.tile_seconds = {tile: 0.0 for tile in self.tiles}
+        samples_done = 0
+        num_jobs = len(self.tiles) * -(-render.samples // self.samples_per_job)
+        render.stop_reason = "samples"
+        start_time = time.time()
+
+        # spawn rather than fork, MLX state is not safe to share with forked children
+        context = multiprocessing.get_context("spawn")
+        with SharedScene.create(render.scene, blue_noise_texture, bvh_format=render.bvh_format) as shared, \
+             context.Pool(self.workers, initializer=_init_worker, initargs=(shared.handle, camera, width, height, render.sampler, render.next_event,
+                                                                           render.roulette_depth, tuple(render.accumulator.aovs))) as pool:
+            results = pool.imap_unordered(_render_tile, self.jobs(seeds), chunksize=1)
+            for tile, count, tile_sum, tile_sum_sq, tile_aovs, seconds in tqdm(results, total=num_jobs, desc="Rendering", unit="job"):
+                render.accumulator.add_region(tile[0], tile[1], tile_sum, tile_sum_sq, count, tile_aovs)
+                tile_samples[tile] += count
+                self.tile_seconds[tile] += seconds
+
+                completed = min(tile_samples.values())
+                if completed > samples_done:
+                    samples_done = completed
+                    if on_sample is not None:
+                        on_sample(samples_done, render.accumulator)
+
+                if not render.running:
+                    render.stop_reason = "stopped"
+                    break
+                if render.time_budget is not None and time.time() - start_time >= render.time_budget:
+                    render.stop_reason = "time_budget"
+                    break
+            # Leaving the block terminates workers still busy with discarded jobs
+
+        elapsed_time = time.time() - start_time
+        tile_seconds = np.array(list(self.tile_seconds.values()))
+        print(f"Total rendering time: {elapsed_time:.2f} seconds on {self.workers} workers, {len(self.tiles)} tiles")
+        print(f"Seconds per tile: min {tile_seconds.min():.2f}, median {np.median(tile_seconds):.2f}, max {tile_seconds.max():.2f}")
+        return samples_done
+
+    def stop(self):
+        self.render.stop()
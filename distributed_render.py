@@ -0,0 +1,133 @@
+"""Render one frame across several machines.
+
+On the coordinator, which loads the scene and writes the image:
+    python distributed_render.py coordinator scene.usda --spp 1024 --res 1920x1080 -o out.exr --port 5555
+On every render node:
+    python distributed_render.py worker coordinator-host:5555 --backend metal
+
+Each worker gets the compiled scene over the connection and renders disjoint sample
+ranges; the coordinator merges their sums. --local-workers N also starts N workers on
+this machine, which is handy for testing.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from batch_render import parse_resolution
+from core.bvh import BVH_FORMATS
+from core.distributed import Coordinator, RenderWorker
+from core.accumulator import AOVS
+from core.image_io import aov_path, save_image
+from core.postprocess import POSTPROCESS_STAGES
+from core.render import BACKENDS, SAMPLERS, load_blue_noise
+from core.scene_cache import SceneCache
+from usd.loader import UsdLoader
+from usd.camera import UsdCamera
+from usd.scene import UsdScene
+
+
+def parse_address(value: str):
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"Address must look like host:port, got {value}")
+    return host, int(port)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed rendering over TCP.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="serve sample ranges and merge the results")
+    coordinator.add_argument("scene", help="USD file to render")
+    coordinator.add_argument("-o", "--output", required=True, help="output image (.exr, .pfm, .npy, .png or .ppm)")
+    coordinator.add_argument("--spp", type=int, default=1024, help="samples per pixel")
+    coordinator.add_argument("--res", type=parse_resolution, default=(1024, 1024), help="resolution as WIDTHxHEIGHT")
+    coordinator.add_argument("--host", default="0.0.0.0")
+    coordinator.add_argument("--port", type=int, default=5555)
+    coordinator.add_argument("--samples-per-job", type=int, default=16, help="samples in each range handed to a worker")
+    coordinator.add_argument("--job-timeout", type=float, default=600.0, help="seconds before a silent worker's range is reassigned")
+    coordinator.add_argument("--seed", type=int, default=None, help="base seed, fixes every sample's noise")
+    coordinator.add_argument("--sampler", choices=SAMPLERS, default="sobol", help="sample streams of every worker")
+    coordinator.add_argument("--no-nee", action="store_true", help="disable next-event estimation of the lights")
+    coordinator.add_argument("--roulette-depth", type=int, default=3, help="first bounce of Russian roulette (0 disables it)")
+    coordinator.add_argument("--post", nargs="*", choices=POSTPROCESS_STAGES, default=["denoise"],
+                             help="filters of the merged image before it is written, in order (none without stages)")
+    coordinator.add_argument("--aovs", nargs="+", choices=AOVS, default=[],
+                             help="also write these per-pixel outputs, e.g. out.exr gets out.depth.exr (.pfm next to 8-bit images)")
+    coordinator.add_argument("--blue-noise", default="512x512x4_3d_blue_noise.npy", help="blue noise texture (.npy) of --sampler blue_noise")
+    coordinator.add_argument("--cache-dir", default=None, help="compiled scene cache directory")
+    coordinator.add_argument("--idle-timeout", type=float, default=None,
+                             help="seconds without a connected worker before writing a partial image (default waits)")
+    coordinator.add_argument("--local-workers", type=int, default=0, help="also start this many workers on this machine")
+    coordinator.add_argument("--backend", choices=BACKENDS, default="metal", help="backend of the local workers")
+    coordinator.add_argument("--bvh-format", choices=BVH_FORMATS, default="compact", help="BVH format of the local workers")
+
+    worker = subparsers.add_parser("worker", help="render sample ranges for a coordinator")
+    worker.add_argument("address", type=parse_address, help="coordinator as host:port")
+    worker.add_argument("--backend", choices=BACKENDS, default="metal")
+    worker.add_argument("--bvh-format", choices=BVH_FORMATS, default="compact")
+    worker.add_argument("--connect-timeout", type=float, default=30.0, help="seconds to keep retrying the connection")
+    return parser.parse_args(argv)
+
+
+def run_coordinator(args):
+    width, height = args.res
+    usd_loader = UsdLoader(args.scene)
+    camera = UsdCamera.load_camera(usd_loader)
+    scene = UsdScene.load_scene(usd_loader, cache=SceneCache(args.cache_dir))
+    blue_noise_texture = load_blue_noise(args.sampler, args.blue_noise)
+
+    coordinator = Coordinator(scene, camera, width, height, args.spp, blue_noise_texture,
+                              samples_per_job=args.samples_per_job, host=args.host, port=args.port,
+                              job_timeout=args.job_timeout, seed=args.seed, sampler=args.sampler, next_event=not args.no_nee,
+                              roulette_depth=args.roulette_depth, postprocess=args.post, backend=args.backend,
+                              aovs=args.aovs)
+
+    local_workers = [
+        subprocess.Popen([sys.executable, __file__, "worker", f"127.0.0.1:{args.port}",
+                          "--backend", args.backend, "--bvh-format", args.bvh_format])
+        for _ in range(args.local_workers)
+    ]
+    start_time = time.time()
+    try:
+        accumulator = coordinator.run(worker_processes=local_workers, idle_timeout=args.idle_timeout)
+    except KeyboardInterrupt:
+        print("Interrupted, writing the samples merged so far")
+        accumulator = coordinator.accumulator
+    finally:
+        coordinator.stop()
+        for process in local_workers:
+            try:
+                process.wait(timeout=10.0)
+            except subprocess.TimeoutExpired:
+                process.terminate()
+    render_time = time.time() - start_time
+
+    if coordinator.samples_done == 0:
+        print("No samples were rendered")
+        return 1
+    save_image(args.output, accumulator.read(coordinator.postprocess))
+    for name in args.aovs:
+        save_image(aov_path(args.output, name), accumulator.read_aov(name))
+    print(f"Wrote {args.output}")
+    print(f"Render time:           {render_time:.2f} seconds ({coordinator.samples_done}/{args.spp} samples)")
+    print(f"Workers:               {coordinator.workers_seen} connected, {coordinator.jobs_reassigned} ranges reassigned")
+    return 0 if coordinator.samples_done == args.spp else 2
+
+
+def run_worker(args):
+    host, port = args.address
+    worker = RenderWorker(host, port, backend=args.backend, bvh_format=args.bvh_format, connect_timeout=args.connect_timeout)
+    samples_rendered = worker.run()
+    print(f"Rendered {samples_rendered} samples")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return run_coordinator(args) if args.mode == "coordinator" else run_worker(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
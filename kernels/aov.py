@@ -0,0 +1,6 @@
+# Arbitrary output variables the kernels can write next to the color, with their channels (see Aovs
+# in structures.metal). All come from the camera ray's first hit except bounces, the number of
+# rays the path traced after it; misses and lights leave 0 and material -1.
+AOV_CHANNELS = {"depth": 1, "normal": 3, "albedo": 3, "position": 3, "material": 1, "bounces": 1}
+# The ones that stay within [0, 1] and survive an 8-bit image
+UNIT_AOVS = ("albedo",)
@@ -0,0 +1,35 @@
+import numpy as np
+from .structures import dot, normalize
+
+TEXTURE_SIZE = 512
+
+def _texel(sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    flat = blue_noise_texture.reshape(-1, 4)
+    x = sample % TEXTURE_SIZE
+    y = (sample // TEXTURE_SIZE) % TEXTURE_SIZE
+    return flat[x + y * TEXTURE_SIZE]
+
+def get_blue_noise_sample(sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    return _texel(sample, blue_noise_texture)[:, :2]
+
+def get_blue_noise_sample_3d(sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    return _texel(sample, blue_noise_texture)[:, :3]
+
+def get_blue_noise_in_unit_sphere(sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    # Same rejection loop as the Metal version, run until every lane has accepted a point
+    p = np.empty((sample.shape[0], 3), dtype=np.float32)
+    k = sample.copy()
+    pending = np.arange(sample.shape[0])
+    while pending.shape[0] > 0:
+        candidate = 2.0 * get_blue_noise_sample_3d(k[pending], blue_noise_texture) - 1.0
+        p[pending] = candidate
+        k[pending] += 1
+        pending = pending[dot(candidate, candidate) >= 1.0]
+    return p
+
+def get_blue_noise_unit_vector(sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    return normalize(get_blue_noise_in_unit_sphere(sample, blue_noise_texture))
+
+def get_blue_noise_on_hemisphere(normal: np.ndarray, sample: np.ndarray, blue_noise_texture: np.ndarray) -> np.ndarray:
+    blue_noise = get_blue_noise_unit_vector(sample, blue_noise_texture)
+    return np.where((dot(blue_noise, normal) > 0.0)[:, None], blue_noise, -blue_noise)
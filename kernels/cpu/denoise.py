@@ -0,0 +1,70 @@
+import numpy as np
+
+# B3 spline weights of the 5x5 a-trous kernel, one axis
+ATROUS_TAPS = np.array([1.0 / 16.0, 1.0 / 4.0, 3.0 / 8.0, 1.0 / 4.0, 1.0 / 16.0], dtype=np.float32)
+GAUSSIAN_TAPS = np.array([0.25, 0.5, 0.25], dtype=np.float32)
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+def _blur_variance(variance: np.ndarray) -> np.ndarray:
+    """3x3 Gaussian of a (height, width) array, clamping at the edges."""
+    height, width = variance.shape
+    padded = np.pad(variance, 1, mode='edge')
+    result = np.zeros_like(variance)
+    for ky in range(3):
+        for kx in range(3):
+            result += GAUSSIAN_TAPS[ky] * GAUSSIAN_TAPS[kx] * padded[ky:ky + height, kx:kx + width]
+    return result
+
+def atrous_step(color, variance, normal, albedo, step: int, sigma_color: float, sigma_normal: float, sigma_albedo: float):
+    """One pass of denoise() with taps step pixels apart, the CPU counterpart of atrous_kernel.
+
+    Taps outside the image are skipped. Returns the filtered (height, width, 3) color and
+    the (height, width) variance of the filtered values.
+    """
+    height, width = variance.shape
+    radius = 2 * step
+
+    def pad(a):
+        return np.pad(a, ((radius, radius), (radius, radius)) + ((0, 0),) * (a.ndim - 2))
+    padded_color, padded_variance, padded_normal, padded_albedo = pad(color), pad(variance), pad(normal), pad(albedo)
+    inside = pad(np.ones((height, width), dtype=np.float32))
+    padded_luma = padded_color @ LUMINANCE
+
+    luma = color @ LUMINANCE
+    color_scale = sigma_color * np.sqrt(np.maximum(_blur_variance(variance), 0.0)) + 1e-6
+    sum_color = np.zeros_like(color)
+    sum_variance = np.zeros_like(variance)
+    sum_weight = np.zeros_like(variance)
+    for j in range(5):
+        for i in range(5):
+            dy, dx = (j - 2) * step, (i - 2) * step
+            window = (slice(radius + dy, radius + dy + height), slice(radius + dx, radius + dx + width))
+            weight = np.full_like(variance, ATROUS_TAPS[j] * ATROUS_TAPS[i])
+            if dx != 0 or dy != 0:
+                cos_normal = np.maximum((normal * padded_normal[window]).sum(axis=-1), 0.0)
+                weight *= inside[window] * np.exp(-np.abs(luma - padded_luma[window]) / color_scale) \
+                    * cos_normal ** sigma_normal * np.exp(-np.abs(albedo - padded_albedo[window]).sum(axis=-1) / sigma_albedo)
+            sum_color += weight[..., None] * padded_color[window]
+            sum_variance += weight * weight * padded_variance[window]
+            sum_weight += weight
+    return sum_color / sum_weight[..., None], sum_variance / (sum_weight * sum_weight)
+
+def denoise(color: np.ndarray, variance: np.ndarray, normal: np.ndarray, albedo: np.ndarray, iterations: int = 4,
+            sigma_color: float = 2.0, sigma_normal: float = 128.0, sigma_albedo: float = 0.1) -> np.ndarray:
+    """Edge-aware a-trous wavelet filter of an accumulated (height, width, 3) image, the CPU counterpart of denoise_kernel.
+
+    variance (height, width) is the variance of each pixel's mean; normal and albedo are
+    the averaged first-hit guides. The albedo is divided out and the irradiance filtered
+    with iterations 5x5 passes of doubling spacing. Normals and albedo stop the filter at
+    geometry and material edges, the variance at edges in the lighting, so it smooths
+    less as the samples converge.
+    """
+    length = np.linalg.norm(normal, axis=-1, keepdims=True)
+    normal = np.where(length > 0.0, normal / np.maximum(length, 1e-30), 0.0).astype(np.float32)
+    demodulator = np.where(albedo > 1e-3, albedo, 1.0).astype(np.float32)
+    irradiance = color / demodulator
+    variance = variance / (demodulator @ LUMINANCE) ** 2
+    for iteration in range(iterations):
+        irradiance, variance = atrous_step(irradiance, variance, normal, albedo, 1 << iteration,
+                                           sigma_color, sigma_normal, sigma_albedo)
+    return (irradiance * demodulator).astype(np.float32)
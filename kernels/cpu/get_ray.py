@@ -0,0 +1,16 @@
+import numpy as np
+from .sampler import Sampler, SAMPLE_CAMERA
+
+def get_ray(uv: np.ndarray,
+            camera_center: np.ndarray,
+            pixel00_loc: np.ndarray,
+            pixel_delta_u: np.ndarray,
+            pixel_delta_v: np.ndarray,
+            sampler: Sampler):
+    """Return (origins, directions) for a batch of pixel coordinates."""
+    jitter = sampler.sample_2d(SAMPLE_CAMERA)
+    uv = uv + (jitter - 0.5)
+    pixel_sample = pixel00_loc + uv[:, 0:1] * pixel_delta_u + uv[:, 1:2] * pixel_delta_v
+    origins = np.broadcast_to(camera_center, pixel_sample.shape).astype(np.float32)
+    directions = (pixel_sample - origins).astype(np.float32)
+    return origins, directions
@@ -0,0 +1,64 @@
+import numpy as np
+from .structures import LIGHT_STRIDE, dot
+
+class RectLights:
+    """Rect lights of a packed light table (see pack_lights), the NumPy version of light.metal.
+
+    Lights emit on the side of cross(u, v) only and are tested apart from the BVH.
+    """
+    def __init__(self, table: np.ndarray):
+        table = np.asarray(table, dtype=np.float32).reshape(-1, LIGHT_STRIDE)
+        self.q = table[:, 0:3]
+        self.u = table[:, 3:6]
+        self.v = table[:, 6:9]
+        n = np.cross(self.u, self.v)
+        self.area = np.linalg.norm(n, axis=1)
+        self.normal = n / np.maximum(self.area, 1e-30)[:, None]
+        self.radiance = table[:, 9:12] * table[:, 12:13]
+
+    def __len__(self) -> int:
+        return len(self.q)
+
+    def hit(self, origins: np.ndarray, directions: np.ndarray, t_min: float, t_max: np.ndarray):
+        """Radiance of the closest light each ray sees within (t_min, t_max), the solid angle pdf
+        sample() would have picked the direction with (0 for rays that miss every light) and the
+        ray parameter of that light (t_max for those rays)."""
+        num_rays = origins.shape[0]
+        radiance = np.zeros((num_rays, 3), dtype=np.float32)
+        light_pdf = np.zeros(num_rays, dtype=np.float32)
+        closest_t = np.array(t_max, dtype=np.float32)
+        length = np.linalg.norm(directions, axis=1)
+        for i in range(len(self)):
+            denominator = directions @ self.normal[i]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = ((self.q[i] - origins) @ self.normal[i]) / denominator
+                offset = origins + t[:, None] * directions - self.q[i]
+                a = offset @ self.u[i] / np.dot(self.u[i], self.u[i])
+                b = offset @ self.v[i] / np.dot(self.v[i], self.v[i])
+            hits = (denominator < 0.0) & (t > t_min) & (t < closest_t) & (a >= 0.0) & (a <= 1.0) & (b >= 0.0) & (b <= 1.0)
+            closest_t[hits] = t[hits]
+            distance = t[hits] * length[hits]
+            cos_light = -denominator[hits] / length[hits]
+            light_pdf[hits] = distance * distance / (cos_light * self.area[i] * len(self))
+            radiance[hits] = self.radiance[i]
+        return radiance, light_pdf, closest_t
+
+    def sample(self, points: np.ndarray, u: np.ndarray):
+        """Uniform point on a uniformly picked light for every point, u.x picks the light and is
+        reused. Returns (radiance, unit directions, distances, solid angle pdfs); the pdf is 0
+        where the point is behind the light."""
+        scaled = u[:, 0] * len(self)
+        index = np.minimum(scaled.astype(np.int64), len(self) - 1)
+        s = scaled - index
+        to_light = self.q[index] + s[:, None] * self.u[index] + u[:, 1:2] * self.v[index] - points
+        distance = np.linalg.norm(to_light, axis=1)
+        directions = (to_light / distance[:, None]).astype(np.float32)
+        cos_light = -dot(self.normal[index], directions)
+        front = cos_light > 0.0
+        light_pdf = np.zeros(len(points), dtype=np.float32)
+        light_pdf[front] = distance[front] ** 2 / (cos_light[front] * self.area[index[front]] * len(self))
+        radiance = np.where(front[:, None], self.radiance[index], 0.0).astype(np.float32)
+        return radiance, directions, distance.astype(np.float32), light_pdf
+
+def power_heuristic(pdf: np.ndarray, other_pdf: np.ndarray) -> np.ndarray:
+    return pdf * pdf / (pdf * pdf + other_pdf * other_pdf)
@@ -0,0 +1,114 @@
+import numpy as np
+from .light import RectLights, power_heuristic
+from .sampler import Sampler, SAMPLE_DIRECTION, SAMPLE_LIGHT, SAMPLE_ROULETTE, bounce_dimension
+from .structures import CpuScene, dot
+from .triangle_hit import hit, occluded
+
+MAX_DEPTH = 20
+ALBEDO = np.float32(0.8)
+
+def _trace(origins, directions, t_min, t_max, scene: CpuScene, stats: np.ndarray, paths: np.ndarray, query=hit):
+    """query (hit or occluded) adding the traversal counters to the rows of stats given by paths."""
+    path_stats = np.zeros((paths.shape[0], 3), dtype=np.int64) if stats is not None else None
+    result = query(origins, directions, t_min, t_max, scene, path_stats)
+    if stats is not None:
+        stats[paths, :2] += path_stats[:, :2]
+        stats[paths, 2] = np.maximum(stats[paths, 2], path_stats[:, 2])
+    return result
+
+def _first_hit_aovs(aovs: dict, origins, directions, hit_record, seen, light_t):
+    """Fill aovs from the camera rays' hits: lights seen first get albedo 1 and no normal or
+    material, misses 0 and material -1."""
+    surface = (hit_record.hit & ~seen)[:, None]
+    visible = surface | seen[:, None]
+    t = np.where(seen, light_t, hit_record.t)[:, None]
+    if "depth" in aovs:
+        aovs["depth"][:] = np.where(visible, t * np.linalg.norm(directions, axis=1, keepdims=True), 0.0)
+    if "normal" in aovs:
+        normal = np.where(hit_record.front_face[:, None], hit_record.normal, -hit_record.normal)
+        aovs["normal"][:] = np.where(surface, normal, 0.0)
+    if "albedo" in aovs:
+        aovs["albedo"][:] = np.where(seen[:, None], 1.0, np.where(surface, ALBEDO, 0.0))
+    if "position" in aovs:
+        aovs["position"][:] = np.where(visible, origins + t * directions, 0.0)
+    if "material" in aovs:
+        aovs["material"][:] = np.where(surface, hit_record.mat[:, None], -1)
+    if "bounces" in aovs:
+        aovs["bounces"][:] = 0.0
+
+def ray_color(origins: np.ndarray, directions: np.ndarray, scene: CpuScene, sampler: Sampler,
+              stats: np.ndarray = None, next_event: bool = True, roulette_depth: int = 3, aovs: dict = None) -> np.ndarray:
+    """Wavefront version of ray_color in ray_color.metal.
+
+    Each depth runs the extend stage (closest hit for every live path, then the lights in
+    front of it), compacts the live paths so misses leave the batch instead of idling like
+    inactive SIMD lanes, and shades: a light sample with its shadow ray (next_event) and
+    the next direction, then drops paths that lose Russian roulette from bounce
+    roulette_depth on (0 never does). stats (num_paths, 3) collects the traversal counters
+    of every ray, see hit(). aovs maps AOV names (see kernels/aov.py) to (num_paths, channels)
+    arrays that receive them, as Aovs in ray_color.metal.
+    """
+    num_paths = origins.shape[0]
+    lights = RectLights(scene.lights)
+    radiance = np.zeros((num_paths, 3), dtype=np.float32)
+    throughput = np.ones(num_paths, dtype=np.float32)
+    bsdf_pdf = None
+
+    live = np.arange(num_paths)
+    for depth in range(MAX_DEPTH):
+        # Extend
+        t_min = 0.1 if depth == 0 else 0.0001
+        hit_record = _trace(origins, directions, t_min, 10000.0, scene, stats, live)
+        emitted, light_pdf, light_t = lights.hit(origins, directions, t_min, np.where(hit_record.hit, hit_record.t, 10000.0))
+        seen = light_pdf > 0.0
+        weight = power_heuristic(bsdf_pdf[seen], light_pdf[seen]) if next_event and depth > 0 else 1.0
+        radiance[live[seen]] += (throughput[live[seen]] * weight)[:, None] * emitted[seen]
+        if depth > 0 and len(lights) == 0:
+            # Without lights the first bounce onwards sees a white sky
+            escaped = live[~hit_record.hit]
+            radiance[escaped] += throughput[escaped][:, None]
+        if aovs:
+            if depth == 0:
+                _first_hit_aovs(aovs, origins, directions, hit_record, seen, light_t)
+            elif "bounces" in aovs:
+                aovs["bounces"][live, 0] += 1.0
+
+        # Compact
+        hits = np.nonzero(hit_record.hit & ~seen)[0]
+        live = live[hits]
+        if live.shape[0] == 0 or depth == MAX_DEPTH - 1:
+            break
+        points = hit_record.p[hits]
+        normals = np.where(hit_record.front_face[hits, None], hit_record.normal[hits], -hit_record.normal[hits])
+        bounce = depth + 1
+
+        # Shade: next-event estimation
+        if next_event and len(lights) > 0:
+            light_radiance, to_light, light_distance, light_pdf = lights.sample(
+                points, sampler.sample_2d(bounce_dimension(bounce, SAMPLE_LIGHT), live))
+            cos_surface = dot(normals, to_light)
+            candidates = np.nonzero((light_pdf > 0.0) & (cos_surface > 0.0))[0]
+            blocked = _trace(points[candidates], to_light[candidates], 0.0001, light_distance[candidates] - 0.0001,
+                             scene, stats, live[candidates], occluded)
+            visible = candidates[~blocked]
+            pdf = light_pdf[visible]
+            contribution = ALBEDO / np.pi * cos_surface[visible] / pdf * power_heuristic(pdf, cos_surface[visible] / np.pi)
+            radiance[live[visible]] += (throughput[live[visible]] * contribution)[:, None] * light_radiance[visible]
+
+        # Shade: cosine sampling cancels the BSDF and cosine against the pdf, leaving the albedo
+        origins = points
+        directions = sampler.on_cosine_hemisphere(normals, bounce_dimension(bounce, SAMPLE_DIRECTION), live)
+        bsdf_pdf = np.maximum(dot(normals, directions), 0.0) / np.float32(np.pi)
+        throughput[live] *= ALBEDO
+
+        # Shade: Russian roulette
+        if roulette_depth and bounce >= roulette_depth:
+            survival = np.minimum(throughput[live], np.float32(1.0))
+            survivors = np.nonzero(sampler.sample_2d(bounce_dimension(bounce, SAMPLE_ROULETTE), live)[:, 0] < survival)[0]
+            live = live[survivors]
+            throughput[live] /= survival[survivors]
+            origins, directions, bsdf_pdf = origins[survivors], directions[survivors], bsdf_pdf[survivors]
+            if live.shape[0] == 0:
+                break
+
+    return radiance
@@ -0,0 +1,115 @@
+import numpy as np
+from .blue_noise import get_blue_noise_sample, get_blue_noise_unit_vector
+from .structures import normalize
+
+# Same dimension layout as sampler.metal
+SAMPLE_CAMERA = 0
+SAMPLE_DIMENSIONS_PER_BOUNCE = 3
+SAMPLE_DIRECTION = 0
+SAMPLE_LIGHT = 1
+SAMPLE_ROULETTE = 2
+
+def _sobol_second_directions() -> np.ndarray:
+    directions = [1 << 31]
+    for _ in range(31):
+        directions.append(directions[-1] ^ (directions[-1] >> 1))
+    return np.array(directions, dtype=np.uint32)
+
+SOBOL_SECOND = _sobol_second_directions()
+
+def hash_uint(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.uint32)
+    x = x ^ (x >> 16)
+    x = x * np.uint32(0x7feb352d)
+    x = x ^ (x >> 15)
+    x = x * np.uint32(0x846ca68b)
+    return x ^ (x >> 16)
+
+def hash_combine(seed: np.ndarray, value) -> np.ndarray:
+    return hash_uint(seed ^ hash_uint(np.full(np.shape(seed), value, dtype=np.uint32)))
+
+def reverse_bits(x: np.ndarray) -> np.ndarray:
+    x = ((x >> 1) & 0x55555555) | ((x & 0x55555555) << 1)
+    x = ((x >> 2) & 0x33333333) | ((x & 0x33333333) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F) | ((x & 0x0F0F0F0F) << 4)
+    x = ((x >> 8) & 0x00FF00FF) | ((x & 0x00FF00FF) << 8)
+    return (x >> 16) | (x << 16)
+
+def nested_uniform_scramble(x: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    x = reverse_bits(x)
+    x = x + seed
+    x = x ^ (x * np.uint32(0x6c50b47c))
+    x = x ^ (x * np.uint32(0xb82f1e52))
+    x = x ^ (x * np.uint32(0xc7afe638))
+    x = x ^ (x * np.uint32(0x8d22f6e6))
+    return reverse_bits(x)
+
+def sobol_second(index: np.ndarray) -> np.ndarray:
+    result = np.zeros_like(index)
+    for bit in range(32):
+        result ^= np.where((index >> bit) & 1, SOBOL_SECOND[bit], np.uint32(0))
+    return result
+
+def _unit_float(x: np.ndarray) -> np.ndarray:
+    return (x >> 8).astype(np.float32) * np.float32(2.0 ** -24)
+
+def sobol_owen(index: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    index = nested_uniform_scramble(index, seed)
+    x = nested_uniform_scramble(reverse_bits(index), hash_combine(seed, 0))
+    y = nested_uniform_scramble(sobol_second(index), hash_combine(seed, 1))
+    return np.stack([_unit_float(x), _unit_float(y)], axis=1)
+
+def r2(index: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    index = nested_uniform_scramble(index, seed)
+    x = index * np.uint32(3242174889) + hash_combine(seed, 0)
+    y = index * np.uint32(2447445413) + hash_combine(seed, 1)
+    return np.stack([_unit_float(x), _unit_float(y)], axis=1)
+
+def bounce_dimension(bounce: int, slot: int) -> int:
+    return 1 + (bounce - 1) * SAMPLE_DIMENSIONS_PER_BOUNCE + slot
+
+class Sampler:
+    """Structure-of-arrays counterpart of Sampler in sampler.metal, one sample stream per path.
+
+    sampler is "blue_noise", "sobol" or "r2". The texture streams are offset by
+    pixel * 3 + random_seed as before; the sequences are indexed by sample and scrambled
+    per pixel from random_seed, which should then stay the same for a whole frame.
+    """
+    def __init__(self, sampler: str, pixel: np.ndarray, sample: int, random_seed: int, blue_noise_texture: np.ndarray = None):
+        self.sampler = sampler
+        self.blue_noise_texture = blue_noise_texture
+        if sampler == "blue_noise":
+            self.index = pixel * 3 + random_seed
+            self.seed = np.zeros(len(pixel), dtype=np.uint32)
+        else:
+            self.index = np.full(len(pixel), sample, dtype=np.uint32)
+            frame_seed = hash_uint(np.full(len(pixel), random_seed & 0xFFFFFFFF, dtype=np.uint32))
+            self.seed = hash_uint(frame_seed ^ hash_uint(pixel.astype(np.uint32)))
+
+    def sample_2d(self, dimension: int, paths: np.ndarray = None) -> np.ndarray:
+        """(n, 2) floats in [0, 1) of one dimension pair, for every path or the given ones."""
+        index = self.index if paths is None else self.index[paths]
+        if self.sampler == "blue_noise":
+            return get_blue_noise_sample(index + dimension, self.blue_noise_texture)
+        seed = hash_combine(self.seed if paths is None else self.seed[paths], dimension)
+        if self.sampler == "sobol":
+            return sobol_owen(index, seed)
+        return r2(index, seed)
+
+    def on_cosine_hemisphere(self, normal: np.ndarray, dimension: int, paths: np.ndarray = None) -> np.ndarray:
+        """Cosine weighted directions around each (unit) normal."""
+        if self.sampler == "blue_noise":
+            index = self.index if paths is None else self.index[paths]
+            return normalize(normal + get_blue_noise_unit_vector(index + dimension, self.blue_noise_texture))
+        u = self.sample_2d(dimension, paths)
+        r = np.sqrt(u[:, 0])
+        z = np.sqrt(np.maximum(np.float32(0.0), 1.0 - u[:, 0]))
+        phi = np.float32(2.0 * np.pi) * u[:, 1]
+        nx, ny, nz = normal[:, 0], normal[:, 1], normal[:, 2]
+        sign = np.copysign(np.float32(1.0), nz)
+        a = -1.0 / (sign + nz)
+        b = nx * ny * a
+        tangent = np.stack([1.0 + sign * nx * nx * a, sign * b, -sign * nx], axis=1)
+        bitangent = np.stack([b, sign + ny * ny * a, -ny], axis=1)
+        direction = (r * np.cos(phi))[:, None] * tangent + (r * np.sin(phi))[:, None] * bitangent + z[:, None] * normal
+        return direction.astype(np.float32)
@@ -0,0 +1,19 @@
+import numpy as np
+
+SHARPENING_KERNEL = np.array([
+    [ 0.0, -0.2,  0.0],
+    [-0.2,  1.8, -0.2],
+    [ 0.0, -0.2,  0.0],
+], dtype=np.float32)
+
+def sharpen(image: np.ndarray) -> np.ndarray:
+    """CPU counterpart of sharpen_kernel on a (height, width, 3) image, clamping at the edges."""
+    height, width, _ = image.shape
+    padded = np.pad(image, ((1, 1), (1, 1), (0, 0)), mode='edge')
+    result = np.zeros_like(image)
+    for ky in range(3):
+        for kx in range(3):
+            weight = SHARPENING_KERNEL[ky, kx]
+            if weight != 0.0:
+                result += weight * padded[ky:ky + height, kx:kx + width]
+    return np.maximum(result, 0.0)
@@ -0,0 +1,79 @@
+import numpy as np
+
+# Floats per light in the packed light table, see core.light.pack_lights and light.metal
+LIGHT_STRIDE = 16
+
+class CpuScene:
+    """Compiled scene buffers rearranged for batched CPU traversal.
+
+    Uses the compact node records and leaf-ordered triangles of a CompiledScene
+    (see BVH_NODE_DTYPE), or wide records (see wide_node_dtype) whose box arrays are then
+    (num_nodes, 3, width), with per-triangle edges precomputed once. Instanced scenes
+    also carry the instance transforms and bottom-level roots (see INSTANCE_DTYPE),
+    and lights is the packed light table (see pack_lights).
+    """
+    ARRAYS = ("v0", "edge1", "edge2", "norms", "mats", "box_min", "box_max", "child_or_offset", "count",
+              "world_to_object", "instance_root", "lights")
+
+    def __init__(self, geos: np.ndarray, norms: np.ndarray, mats: np.ndarray, nodes: np.ndarray, instances: np.ndarray = None,
+                 lights: np.ndarray = None):
+        triangles = np.asarray(geos, dtype=np.float32).reshape(-1, 3, 3)
+        self.v0 = np.ascontiguousarray(triangles[:, 0])
+        self.edge1 = np.ascontiguousarray(triangles[:, 1] - triangles[:, 0])
+        self.edge2 = np.ascontiguousarray(triangles[:, 2] - triangles[:, 0])
+        self.norms = np.asarray(norms, dtype=np.float32).reshape(-1, 3, 3)
+        self.mats = np.asarray(mats, dtype=np.int32).reshape(-1)
+
+        self.box_min = np.ascontiguousarray(nodes['box_min'])
+        self.box_max = np.ascontiguousarray(nodes['box_max'])
+        self.child_or_offset = np.ascontiguousarray(nodes['child' if 'child' in nodes.dtype.names else 'child_or_offset'])
+        self.count = np.ascontiguousarray(nodes['count'])
+
+        if instances is None:
+            self.world_to_object = np.empty((0, 4, 3), dtype=np.float32)
+            self.instance_root = np.empty(0, dtype=np.int32)
+        else:
+            self.world_to_object = np.ascontiguousarray(instances['world_to_object'])
+            self.instance_root = np.ascontiguousarray(instances['root'])
+        self.lights = np.empty((0, LIGHT_STRIDE), dtype=np.float32) if lights is None else np.asarray(lights, dtype=np.float32)
+
+    @property
+    def instanced(self) -> bool:
+        return len(self.instance_root) > 0
+
+    @property
+    def wide(self) -> bool:
+        return self.count.ndim == 2
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in CpuScene.ARRAYS}
+
+    def from_arrays(arrays: dict):
+        """Wrap precomputed arrays (e.g. views into shared memory) without copying them."""
+        scene = CpuScene.__new__(CpuScene)
+        for name in CpuScene.ARRAYS:
+            setattr(scene, name, arrays[name])
+        return scene
+
+class HitRecord:
+    """Structure-of-arrays counterpart of HitRecord in structures.metal."""
+    def __init__(self, num_rays: int):
+        self.hit = np.zeros(num_rays, dtype=bool)
+        self.t = np.zeros(num_rays, dtype=np.float32)
+        self.p = np.zeros((num_rays, 3), dtype=np.float32)
+        self.normal = np.zeros((num_rays, 3), dtype=np.float32)
+        self.front_face = np.zeros(num_rays, dtype=bool)
+        self.mat = np.full(num_rays, -1, dtype=np.int32)
+
+def dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.einsum('ij,ij->i', a, b)
+
+def cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    result = np.empty_like(a)
+    result[:, 0] = a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1]
+    result[:, 1] = a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2]
+    result[:, 2] = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    return result
+
+def normalize(a: np.ndarray) -> np.ndarray:
+    return a / np.sqrt(dot(a, a))[:, None]
@@ -0,0 +1,327 @@
+import numpy as np
+from .structures import CpuScene, HitRecord, dot, cross, normalize
+
+STACK_SIZE = 64
+# A wide node pushes up to width - 1 more entries than it pops
+WIDE_STACK_SIZE = 128
+EPSILON = 1e-9
+
+def triangle_hit(origins: np.ndarray, directions: np.ndarray, scene: CpuScene, tri: np.ndarray,
+                 t_min: np.ndarray, t_max: np.ndarray):
+    """Moller-Trumbore test of one triangle per ray. Returns (hit, t, u, v)."""
+    edge1 = scene.edge1[tri]
+    edge2 = scene.edge2[tri]
+    h = cross(directions, edge2)
+    a = dot(edge1, h)
+
+    hit = ~((a > -EPSILON) & (a < EPSILON))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = 1.0 / a
+    s = origins - scene.v0[tri]
+    u = f * dot(s, h)
+    hit &= (u >= 0.0) & (u <= 1.0)
+    q = cross(s, edge1)
+    v = f * dot(directions, q)
+    hit &= (v >= 0.0) & (u + v <= 1.0)
+    t = f * dot(edge2, q)
+    hit &= (t > t_min) & (t < t_max)
+    return hit, t, u, v
+
+def hit(origins: np.ndarray, directions: np.ndarray, t_min: float, t_max: float, scene: CpuScene,
+        stats: np.ndarray = None) -> HitRecord:
+    """Closest-hit traversal of the compact BVH for a batch of rays.
+
+    Every ray keeps its own node stack, as in the Metal hit(); each iteration pops one
+    node for every ray that still has work and drops finished rays from the batch.
+    Instanced scenes walk the top-level tree and descend into the prototype of every
+    instance a ray reaches, see closest_instances.
+    If stats (num_rays, 3) is given, AABB tests and triangle tests are added to columns
+    0 and 1 and column 2 keeps the deepest stack, as TRAVERSAL_STATS does in Metal.
+    """
+    num_rays = origins.shape[0]
+    ray_t_min = np.full(num_rays, t_min, dtype=np.float32)
+    closest_t = np.full(num_rays, t_max, dtype=np.float32)
+    roots = np.zeros(num_rays, dtype=np.int32)
+    if scene.instanced:
+        hit_tri, hit_u, hit_v, hit_instance = closest_instances(origins, directions, roots, ray_t_min, closest_t, scene, stats)
+    else:
+        hit_tri, hit_u, hit_v = closest_triangles(origins, directions, roots, ray_t_min, closest_t, scene, stats)
+        hit_instance = None
+    return _hit_record(origins, directions, scene, closest_t, hit_tri, hit_u, hit_v, hit_instance)
+
+def occluded(origins: np.ndarray, directions: np.ndarray, t_min: float, t_max, scene: CpuScene,
+             stats: np.ndarray = None) -> np.ndarray:
+    """Any-hit counterpart of hit() for shadow and ambient occlusion rays: True for every ray
+    with some triangle within (t_min, t_max). A ray leaves the traversal at the first triangle
+    it hits, without the closest hit search or a HitRecord. t_max may be one value per ray.
+    """
+    num_rays = origins.shape[0]
+    ray_t_min = np.full(num_rays, t_min, dtype=np.float32)
+    ray_t_max = np.full(num_rays, t_max, dtype=np.float32)
+    roots = np.zeros(num_rays, dtype=np.int32)
+    if scene.instanced:
+        return any_instances(origins, directions, roots, ray_t_min, ray_t_max, scene, stats)
+    return any_triangles(origins, directions, roots, ray_t_min, ray_t_max, scene, stats)
+
+def aabb_entry(origins: np.ndarray, inv_directions: np.ndarray, negative: np.ndarray, box_min: np.ndarray,
+               box_max: np.ndarray, t_min: np.ndarray, t_max: np.ndarray) -> np.ndarray:
+    """Distance at which each ray enters its box within (t_min, t_max), inf on a miss. The sign
+    bits in negative pick every axis' near and far slab, so there is no division or min/max."""
+    with np.errstate(invalid='ignore'):
+        t_near = (np.where(negative, box_max, box_min) - origins) * inv_directions
+        t_far = (np.where(negative, box_min, box_max) - origins) * inv_directions
+    # fmin/fmax ignore the NaNs of rays parallel to and on a slab, like Metal's min/max
+    t_near = np.fmax(np.fmax.reduce(t_near, axis=1), t_min)
+    t_far = np.fmin(np.fmin.reduce(t_far, axis=1), t_max)
+    return np.where(t_near <= t_far, t_near, np.float32(np.inf)).astype(np.float32)
+
+def traverse(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+             closest_t: np.ndarray, scene: CpuScene, stats: np.ndarray, test_leaf):
+    """Walk the nodes below each ray's root front to back, calling test_leaf(rays, offsets, counts)
+    for the leaves the rays overlap.
+
+    Both children of an inner node are tested when it is popped and pushed far one first with
+    their entry distances. test_leaf lowers closest_t in place, and nodes entered beyond it
+    are dropped when popped; it may also return rays that are done, which leave at once.
+    """
+    if scene.wide:
+        return traverse_wide(origins, directions, roots, ray_t_min, closest_t, scene, stats, test_leaf)
+    num_rays = origins.shape[0]
+    with np.errstate(divide='ignore'):
+        inv_directions = (1.0 / directions).astype(np.float32)
+    negative = inv_directions < 0.0
+    stack = np.zeros((num_rays, STACK_SIZE), dtype=np.int32)
+    stack_t = np.zeros((num_rays, STACK_SIZE), dtype=np.float32)
+    stack[:, 0] = roots
+    stack_t[:, 0] = aabb_entry(origins, inv_directions, negative, scene.box_min[roots], scene.box_max[roots],
+                               ray_t_min, closest_t)
+    stack_ptr = np.isfinite(stack_t[:, 0]).astype(np.int64)
+    if stats is not None:
+        stats[:, 0] += 1
+    active = np.nonzero(stack_ptr)[0]
+
+    while active.shape[0] > 0:
+        stack_ptr[active] -= 1
+        ptr = stack_ptr[active]
+        node = stack[active, ptr]
+        # The closest hit may have moved in front of the node since it was pushed
+        live = stack_t[active, ptr] <= closest_t[active]
+        count = scene.count[node]
+        child = scene.child_or_offset[node]
+
+        inner = live & (count == 0) & (child > 0)
+        rays = active[inner]
+        if rays.shape[0] > 0:
+            left = child[inner]
+            ray_args = (origins[rays], inv_directions[rays], negative[rays])
+            t_left = aabb_entry(*ray_args, scene.box_min[left], scene.box_max[left], ray_t_min[rays], closest_t[rays])
+            t_right = aabb_entry(*ray_args, scene.box_min[left + 1], scene.box_max[left + 1], ray_t_min[rays], closest_t[rays])
+            left_first = t_left <= t_right
+            ptr = stack_ptr[rays]
+            stack[rays, ptr] = np.where(left_first, left + 1, left)
+            stack_t[rays, ptr] = np.maximum(t_left, t_right)
+            ptr = ptr + np.isfinite(stack_t[rays, ptr])
+            stack[rays, ptr] = np.where(left_first, left, left + 1)
+            stack_t[rays, ptr] = np.minimum(t_left, t_right)
+            ptr = ptr + np.isfinite(stack_t[rays, ptr])
+            stack_ptr[rays] = ptr
+            if stats is not None:
+                stats[rays, 0] += 2
+                stats[rays, 2] = np.maximum(stats[rays, 2], ptr)
+
+        leaf = live & (count > 0)
+        if np.any(leaf):
+            done = test_leaf(active[leaf], child[leaf], count[leaf])
+            if done is not None:
+                stack_ptr[done] = 0
+
+        active = active[stack_ptr[active] > 0]
+
+def traverse_wide(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+                  closest_t: np.ndarray, scene: CpuScene, stats: np.ndarray, test_leaf):
+    """traverse() over wide nodes. A popped node tests all its children's boxes in one step and
+    pushes the ones the ray enters far to near; leaf children are pushed as -(node * width +
+    slot) - 1 and handed to test_leaf when popped, so they are culled by distance too."""
+    num_rays = origins.shape[0]
+    width = scene.count.shape[1]
+    with np.errstate(divide='ignore'):
+        inv_directions = (1.0 / directions).astype(np.float32)
+    negative = inv_directions < 0.0
+    stack = np.zeros((num_rays, WIDE_STACK_SIZE), dtype=np.int64)
+    stack_t = np.zeros((num_rays, WIDE_STACK_SIZE), dtype=np.float32)
+    stack[:, 0] = roots
+    stack_t[:, 0] = ray_t_min
+    stack_ptr = np.ones(num_rays, dtype=np.int64)
+    slots = np.arange(width)
+    active = np.arange(num_rays)
+
+    while active.shape[0] > 0:
+        stack_ptr[active] -= 1
+        ptr = stack_ptr[active]
+        item = stack[active, ptr]
+        live = stack_t[active, ptr] <= closest_t[active]
+
+        inner = live & (item >= 0)
+        rays = active[inner]
+        if rays.shape[0] > 0:
+            node = item[inner]
+            origin = origins[rays, :, None]
+            inv_direction = inv_directions[rays, :, None]
+            ray_negative = negative[rays, :, None]
+            box_min, box_max = scene.box_min[node], scene.box_max[node]
+            with np.errstate(invalid='ignore'):
+                t_near = (np.where(ray_negative, box_max, box_min) - origin) * inv_direction
+                t_far = (np.where(ray_negative, box_min, box_max) - origin) * inv_direction
+            t_near = np.fmax(np.fmax.reduce(t_near, axis=1), ray_t_min[rays, None])
+            t_far = np.fmin(np.fmin.reduce(t_far, axis=1), closest_t[rays, None])
+            entry = np.where(t_near <= t_far, t_near, np.float32(np.inf))
+            children = np.where(scene.count[node] > 0, -(node[:, None] * width + slots) - 1, scene.child_or_offset[node])
+
+            # Far to near, so the nearest child is popped next
+            order = np.argsort(-entry, axis=1)
+            entry = np.take_along_axis(entry, order, axis=1)
+            children = np.take_along_axis(children, order, axis=1)
+            ptr = stack_ptr[rays]
+            for slot in range(width):
+                stack[rays, ptr] = children[:, slot]
+                stack_t[rays, ptr] = entry[:, slot]
+                ptr = ptr + np.isfinite(entry[:, slot])
+            stack_ptr[rays] = ptr
+            if stats is not None:
+                stats[rays, 0] += width
+                stats[rays, 2] = np.maximum(stats[rays, 2], ptr)
+
+        leaf = live & (item < 0)
+        if np.any(leaf):
+            slot = -item[leaf] - 1
+            node, slot = slot // width, slot % width
+            done = test_leaf(active[leaf], scene.child_or_offset[node, slot], scene.count[node, slot])
+            if done is not None:
+                stack_ptr[done] = 0
+
+        active = active[stack_ptr[active] > 0]
+
+def closest_triangles(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+                      closest_t: np.ndarray, scene: CpuScene, stats: np.ndarray = None):
+    """Closest triangle below roots, lowering closest_t in place. Returns (tri, u, v), tri is -1 on a miss."""
+    num_rays = origins.shape[0]
+    hit_tri = np.full(num_rays, -1, dtype=np.int64)
+    hit_u = np.zeros(num_rays, dtype=np.float32)
+    hit_v = np.zeros(num_rays, dtype=np.float32)
+
+    def test_leaf(leaf_rays, leaf_offset, leaf_count):
+        if stats is not None:
+            stats[leaf_rays, 1] += leaf_count
+        for i in range(int(leaf_count.max())):
+            lane = leaf_count > i
+            rays = leaf_rays[lane]
+            tri = leaf_offset[lane] + i
+            is_hit, t, u, v = triangle_hit(origins[rays], directions[rays], scene, tri, ray_t_min[rays], closest_t[rays])
+            rays = rays[is_hit]
+            closest_t[rays] = t[is_hit]
+            hit_tri[rays] = tri[is_hit]
+            hit_u[rays] = u[is_hit]
+            hit_v[rays] = v[is_hit]
+
+    traverse(origins, directions, roots, ray_t_min, closest_t, scene, stats, test_leaf)
+    return hit_tri, hit_u, hit_v
+
+def any_triangles(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+                  ray_t_max: np.ndarray, scene: CpuScene, stats: np.ndarray = None) -> np.ndarray:
+    """True for the rays hitting any triangle below roots within their interval."""
+    found = np.zeros(origins.shape[0], dtype=bool)
+
+    def test_leaf(leaf_rays, leaf_offset, leaf_count):
+        for i in range(int(leaf_count.max())):
+            lane = (leaf_count > i) & ~found[leaf_rays]
+            rays = leaf_rays[lane]
+            if stats is not None:
+                stats[rays, 1] += 1
+            is_hit, _, _, _ = triangle_hit(origins[rays], directions[rays], scene, leaf_offset[lane] + i,
+                                           ray_t_min[rays], ray_t_max[rays])
+            found[rays[is_hit]] = True
+        return leaf_rays[found[leaf_rays]]
+
+    traverse(origins, directions, roots, ray_t_min, ray_t_max, scene, stats, test_leaf)
+    return found
+
+def closest_instances(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+                      closest_t: np.ndarray, scene: CpuScene, stats: np.ndarray = None):
+    """Two-level closest hit. Top-level leaves hold instances; the rays reaching one are moved
+    into its object space and traced through its prototype's tree. The transformed directions
+    are not normalized, so t means the same in both spaces. Returns (tri, u, v, instance)."""
+    num_rays = origins.shape[0]
+    hit_tri = np.full(num_rays, -1, dtype=np.int64)
+    hit_u = np.zeros(num_rays, dtype=np.float32)
+    hit_v = np.zeros(num_rays, dtype=np.float32)
+    hit_instance = np.full(num_rays, -1, dtype=np.int64)
+
+    def test_leaf(leaf_rays, leaf_offset, leaf_count):
+        for i in range(int(leaf_count.max())):
+            lane = leaf_count > i
+            rays = leaf_rays[lane]
+            instance = leaf_offset[lane] + i
+            xform = scene.world_to_object[instance]
+            local_origins = np.einsum('ri,rij->rj', origins[rays], xform[:, :3]) + xform[:, 3]
+            local_directions = np.einsum('ri,rij->rj', directions[rays], xform[:, :3])
+            local_t = closest_t[rays]
+            local_stats = np.zeros((rays.shape[0], 3), dtype=np.int64) if stats is not None else None
+            tri, u, v = closest_triangles(local_origins.astype(np.float32), local_directions.astype(np.float32),
+                                          scene.instance_root[instance], ray_t_min[rays], local_t, scene, local_stats)
+            if stats is not None:
+                stats[rays, :2] += local_stats[:, :2]
+                stats[rays, 2] = np.maximum(stats[rays, 2], local_stats[:, 2])
+            found = tri >= 0
+            rays = rays[found]
+            closest_t[rays] = local_t[found]
+            hit_tri[rays] = tri[found]
+            hit_u[rays] = u[found]
+            hit_v[rays] = v[found]
+            hit_instance[rays] = instance[found]
+
+    traverse(origins, directions, roots, ray_t_min, closest_t, scene, stats, test_leaf)
+    return hit_tri, hit_u, hit_v, hit_instance
+
+def any_instances(origins: np.ndarray, directions: np.ndarray, roots: np.ndarray, ray_t_min: np.ndarray,
+                  ray_t_max: np.ndarray, scene: CpuScene, stats: np.ndarray = None) -> np.ndarray:
+    """Two-level any_triangles, each instance a ray reaches is tested in its object space."""
+    found = np.zeros(origins.shape[0], dtype=bool)
+
+    def test_leaf(leaf_rays, leaf_offset, leaf_count):
+        for i in range(int(leaf_count.max())):
+            lane = (leaf_count > i) & ~found[leaf_rays]
+            rays = leaf_rays[lane]
+            instance = leaf_offset[lane] + i
+            xform = scene.world_to_object[instance]
+            local_origins = np.einsum('ri,rij->rj', origins[rays], xform[:, :3]) + xform[:, 3]
+            local_directions = np.einsum('ri,rij->rj', directions[rays], xform[:, :3])
+            local_stats = np.zeros((rays.shape[0], 3), dtype=np.int64) if stats is not None else None
+            local_found = any_triangles(local_origins.astype(np.float32), local_directions.astype(np.float32),
+                                        scene.instance_root[instance], ray_t_min[rays], ray_t_max[rays], scene, local_stats)
+            if stats is not None:
+                stats[rays, :2] += local_stats[:, :2]
+                stats[rays, 2] = np.maximum(stats[rays, 2], local_stats[:, 2])
+            found[rays[local_found]] = True
+        return leaf_rays[found[leaf_rays]]
+
+    traverse(origins, directions, roots, ray_t_min, ray_t_max, scene, stats, test_leaf)
+    return found
+
+def _hit_record(origins, directions, scene, closest_t, hit_tri, hit_u, hit_v, hit_instance=None) -> HitRecord:
+    hit_record = HitRecord(origins.shape[0])
+    rays = np.nonzero(hit_tri >= 0)[0]
+    tri = hit_tri[rays]
+    u = hit_u[rays, None]
+    v = hit_v[rays, None]
+    n = scene.norms[tri]
+    normal = (1.0 - u - v) * n[:, 0] + u * n[:, 1] + v * n[:, 2]
+    if hit_instance is not None:
+        # Normals go back to world space with the transpose of the world to object matrix
+        normal = np.einsum('ri,rji->rj', normal, scene.world_to_object[hit_instance[rays], :3])
+    hit_record.hit[rays] = True
+    hit_record.t[rays] = closest_t[rays]
+    hit_record.p[rays] = origins[rays] + closest_t[rays, None] * directions[rays]
+    hit_record.normal[rays] = normalize(normal)
+    hit_record.front_face[rays] = dot(directions[rays], hit_record.normal[rays]) < 0.0
+    hit_record.mat[rays] = scene.mats[tri]
+    return hit_record
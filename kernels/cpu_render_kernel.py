@@ -0,0 +1,102 @@
+import mlx.core as mx
+import numpy as np
+from kernels.aov import AOV_CHANNELS
+from kernels.cpu.structures import CpuScene
+from kernels.cpu.get_ray import get_ray
+from kernels.cpu.ray_color import ray_color
+from kernels.cpu.sampler import Sampler
+
+# Rays traced per batch, bounds the per-ray traversal stacks to a few tens of MB
+CHUNK_SIZE = 1 << 16
+
+def cpu_render_kernel(image_buffer: mx.array,
+                      camera_center: mx.array,
+                      pixel00_loc: mx.array,
+                      pixel_delta_u: mx.array,
+                      pixel_delta_v: mx.array,
+                      sample: int,
+                      samples: int,
+                      scene: CpuScene,
+                      blue_noise_texture: np.ndarray,
+                      random_seed: int = None,
+                      active: np.ndarray = None,
+                      traversal_stats: bool = False,
+                      sampler: str = "blue_noise",
+                      next_event: bool = True,
+                      roulette_depth: int = 3,
+                      aovs: tuple = ()):
+    """CPU counterpart of render_kernel, returning one sample as a float32 array shaped like image_buffer.
+
+    Pixels are laid out as in the Metal kernel: elem = (x + y * width) * 3. If active is
+    given (one value per pixel in that order), only nonzero pixels are traced, the rest are 0.
+    With traversal_stats or aovs returns (colors, extras) like render_kernel.
+    """
+    width, height = image_buffer.shape[0], image_buffer.shape[1]
+    if random_seed is None:
+        random_seed = mx.random.randint(0, 2**20).item()
+
+    if active is None:
+        pixels = np.arange(width * height)
+        out = np.empty((width * height, 3), dtype=np.float32)
+    else:
+        pixels = np.flatnonzero(np.asarray(active).reshape(-1))
+        out = np.zeros((width * height, 3), dtype=np.float32)
+
+    stats = np.zeros((width * height, 3), dtype=np.int64) if traversal_stats else None
+    pixel_stats = np.zeros((len(pixels), 3), dtype=np.int64) if traversal_stats else None
+    pixel_aovs = {name: np.empty((len(pixels), AOV_CHANNELS[name]), dtype=np.float32) for name in aovs}
+    out[pixels] = cpu_render_pixels(pixels, width, camera_center, pixel00_loc, pixel_delta_u, pixel_delta_v,
+                                    scene, blue_noise_texture, random_seed, pixel_stats, sample, sampler, next_event, roulette_depth,
+                                    pixel_aovs)
+    if traversal_stats or aovs:
+        extras = {}
+        for name, values in pixel_aovs.items():
+            extras[name] = np.zeros((width * height, values.shape[1]), dtype=np.float32)
+            extras[name][pixels] = values
+            extras[name] = extras[name].reshape(width, height, values.shape[1])
+        if traversal_stats:
+            stats[pixels] = pixel_stats
+            extras["stats"] = stats.astype(np.uint32).reshape(image_buffer.shape)
+        return out.reshape(image_buffer.shape), extras
+    return out.reshape(image_buffer.shape)
+
+def cpu_render_pixels(pixels: np.ndarray,
+                      width: int,
+                      camera_center,
+                      pixel00_loc,
+                      pixel_delta_u,
+                      pixel_delta_v,
+                      scene: CpuScene,
+                      blue_noise_texture: np.ndarray,
+                      random_seed: int,
+                      stats: np.ndarray = None,
+                      sample: int = 0,
+                      sampler: str = "blue_noise",
+                      next_event: bool = True,
+                      roulette_depth: int = 3,
+                      aovs: dict = None) -> np.ndarray:
+    """Trace one sample for a list of pixel indices (x + y * width), returning (len(pixels), 3) colors.
+
+    Sample streams depend only on the pixel index, sample and random_seed (see Sampler), so
+    tracing a frame in pieces gives the same sample as tracing it whole. stats (len(pixels), 3)
+    collects traversal counters, aovs (name to (len(pixels), channels) array) the AOVs.
+    """
+    camera_center = np.array(camera_center, dtype=np.float32)
+    pixel00_loc = np.array(pixel00_loc, dtype=np.float32)
+    pixel_delta_u = np.array(pixel_delta_u, dtype=np.float32)
+    pixel_delta_v = np.array(pixel_delta_v, dtype=np.float32)
+    blue_noise_texture = np.asarray(blue_noise_texture, dtype=np.float32)
+
+    out = np.empty((len(pixels), 3), dtype=np.float32)
+    for start in range(0, len(pixels), CHUNK_SIZE):
+        pixel = pixels[start:start + CHUNK_SIZE]
+        uv = np.stack([pixel % width, pixel // width], axis=1).astype(np.float32)
+        pixel_sampler = Sampler(sampler, pixel, sample, random_seed, blue_noise_texture)
+
+        # Ray generation
+        origins, directions = get_ray(uv, camera_center, pixel00_loc, pixel_delta_u, pixel_delta_v, pixel_sampler)
+        chunk_stats = stats[start:start + len(pixel)] if stats is not None else None
+        chunk_aovs = {name: values[start:start + len(pixel)] for name, values in aovs.items()} if aovs else None
+        out[start:start + len(pixel)] = ray_color(origins, directions, scene, pixel_sampler, chunk_stats, next_event, roulette_depth,
+                                                  chunk_aovs)
+    return out
@@ -0,0 +1,105 @@
+import mlx.core as mx
+from kernels.registry import registry
+
+LUMINANCE = (0.2126, 0.7152, 0.0722)
+
+def atrous_kernel(color: mx.array, variance: mx.array, normal: mx.array, albedo: mx.array, step: int,
+                  sigma_color: float, sigma_normal: float, sigma_albedo: float):
+    """One pass of denoise_kernel with taps step pixels apart; returns (color, variance)."""
+    source = """
+    const float atrous_taps[5] = {1.0f / 16.0f, 1.0f / 4.0f, 3.0f / 8.0f, 1.0f / 4.0f, 1.0f / 16.0f};
+    const float gaussian_taps[3] = {0.25f, 0.5f, 0.25f};
+    const float3 luminance = float3(0.2126f, 0.7152f, 0.0722f);
+
+    uint x = thread_position_in_grid.x;
+    uint y = thread_position_in_grid.y;
+    uint width = threads_per_grid.x;
+    uint height = threads_per_grid.y;
+
+    if (x < width && y < height) {
+        uint p = x + y * width;
+        // Color differences are weighed against the noise, the 3x3 blurred standard deviation
+        float blurred = 0.0f;
+        for (int ky = -1; ky <= 1; ky++) {
+            for (int kx = -1; kx <= 1; kx++) {
+                int px = clamp(int(x) + kx, 0, int(width) - 1);
+                int py = clamp(int(y) + ky, 0, int(height) - 1);
+                blurred += gaussian_taps[ky + 1] * gaussian_taps[kx + 1] * variance[px + py * width];
+            }
+        }
+        float3 color_p = float3(color[p * 3], color[p * 3 + 1], color[p * 3 + 2]);
+        float3 normal_p = float3(normal[p * 3], normal[p * 3 + 1], normal[p * 3 + 2]);
+        float3 albedo_p = float3(albedo[p * 3], albedo[p * 3 + 1], albedo[p * 3 + 2]);
+        float luma_p = dot(color_p, luminance);
+        float color_scale = sigma_color * sqrt(max(blurred, 0.0f)) + 1e-6f;
+
+        float3 sum_color = float3(0.0f);
+        float sum_variance = 0.0f;
+        float sum_weight = 0.0f;
+        for (int j = 0; j < 5; j++) {
+            for (int i = 0; i < 5; i++) {
+                int qx = int(x) + (i - 2) * step;
+                int qy = int(y) + (j - 2) * step;
+                if (qx < 0 || qy < 0 || qx >= int(width) || qy >= int(height)) {
+                    continue;
+                }
+                uint q = uint(qx) + uint(qy) * width;
+                float3 color_q = float3(color[q * 3], color[q * 3 + 1], color[q * 3 + 2]);
+                float weight = atrous_taps[j] * atrous_taps[i];
+                if (q != p) {
+                    float3 normal_q = float3(normal[q * 3], normal[q * 3 + 1], normal[q * 3 + 2]);
+                    float3 albedo_q = float3(albedo[q * 3], albedo[q * 3 + 1], albedo[q * 3 + 2]);
+                    weight *= exp(-abs(luma_p - dot(color_q, luminance)) / color_scale)
+                            * pow(max(dot(normal_p, normal_q), 0.0f), sigma_normal)
+                            * exp(-dot(abs(albedo_p - albedo_q), float3(1.0f)) / sigma_albedo);
+                }
+                sum_color += weight * color_q;
+                sum_variance += weight * weight * variance[q];
+                sum_weight += weight;
+            }
+        }
+        color_out[p * 3]     = sum_color.r / sum_weight;
+        color_out[p * 3 + 1] = sum_color.g / sum_weight;
+        color_out[p * 3 + 2] = sum_color.b / sum_weight;
+        variance_out[p] = sum_variance / (sum_weight * sum_weight);
+    }
+    """
+    kernel = registry.kernel("atrous_kernel", source)
+
+    outputs = kernel(
+        inputs={
+                "color": color,
+                "variance": variance,
+                "normal": normal,
+                "albedo": albedo,
+                "step": mx.array(step, dtype=mx.int32),
+                "sigma_color": mx.array(sigma_color, dtype=mx.float32),
+                "sigma_normal": mx.array(sigma_normal, dtype=mx.float32),
+                "sigma_albedo": mx.array(sigma_albedo, dtype=mx.float32),
+                },
+        template={"T": mx.float32},
+        grid=(color.shape[0], color.shape[1], 1),
+        threadgroup=(256, 1, 1),
+        output_shapes={"color_out": color.shape, "variance_out": variance.shape},
+        output_dtypes={"color_out": mx.float32, "variance_out": mx.float32},
+    )
+    return outputs["color_out"], outputs["variance_out"]
+
+def denoise_kernel(color: mx.array, variance: mx.array, normal: mx.array, albedo: mx.array, iterations: int = 4,
+                   sigma_color: float = 2.0, sigma_normal: float = 128.0, sigma_albedo: float = 0.1) -> mx.array:
+    """Edge-aware a-trous wavelet filter of an accumulated image in the kernel layout (width, height, 3).
+
+    variance (width, height, 1) is the variance of each pixel's mean; normal and albedo are
+    the averaged first-hit guides. The albedo is divided out and the irradiance filtered with
+    iterations 5x5 passes of doubling spacing, stopped at edges by the normals, the albedo
+    and the color difference relative to the noise, see kernels/cpu/denoise.py.
+    """
+    length = mx.linalg.norm(normal, axis=-1, keepdims=True)
+    normal = mx.where(length > 0.0, normal / mx.maximum(length, 1e-30), 0.0)
+    demodulator = mx.where(albedo > 1e-3, albedo, 1.0)
+    irradiance = color / demodulator
+    variance = variance / mx.square(demodulator @ mx.array(LUMINANCE))[..., None]
+    for iteration in range(iterations):
+        irradiance, variance = atrous_kernel(irradiance, variance, normal, albedo, 1 << iteration,
+                                             sigma_color, sigma_normal, sigma_albedo)
+    return irradiance * demodulator
@@ -1,4 +1,5 @@
 import mlx.core as mx
+from kernels.registry import registry
 
 def gaussian_blur(a: mx.array, r: float):
     source = """
@@ -39,10 +40,7 @@ def gaussian_blur(a: mx.array, r: float):
         out[elem + 2]  = max( min(out[elem + 2], 1.0), 0.0);
 
     """
-    kernel = mx.fast.metal_kernel(
-        name="gaussian_blur",
-        source=source
-    )
+    kernel = registry.kernel("gaussian_blur", source)
     outputs = kernel(
         inputs={"inp": a, "sigma": r}, 
         template={"T": mx.float32}, 
@@ -88,10 +86,7 @@ def blur(a: mx.array, r: float):
         out[elem + 2]  = max( min(out[elem + 2], 1.0), 0.0);
 
     """
-    kernel = mx.fast.metal_kernel(
-        name="blur",
-        source=source
-    )
+    kernel = registry.kernel("blur", source)
     outputs = kernel(
         inputs={"inp": a, "r": r}, 
         template={"T": mx.float32}, 
@@ -122,10 +117,7 @@ def reaction_diffusion(a: mx.array, b1: mx.array, b2: mx.array):
         out[elem + 2]  = max( min(out[elem + 2], 1.0), 0.0);
 
     """
-    kernel = mx.fast.metal_kernel(
-        name="reaction_diffusion",
-        source=source
-    )
+    kernel = registry.kernel("reaction_diffusion", source)
     outputs = kernel(
         inputs={"inp": a, "b1": b1, "b2": b2}, 
         template={"T": mx.float32}, 
@@ -195,11 +187,7 @@ def noise(a: mx.array, p:float):
             out[elem + 2] = inp[elem + 2];
         }
     """
-    kernel = mx.fast.metal_kernel(
-        name="noise",
-        source=source,
-        header=header,
-    )
+    kernel = registry.kernel("noise", source, header)
     outputs = kernel(
         inputs={"inp": a, "p": p}, 
         template={"T": mx.float32}, 
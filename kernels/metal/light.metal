@@ -0,0 +1,86 @@
+// Rect lights packed by core.light.pack_lights, LIGHT_STRIDE floats per light:
+// Q, u, v, color, intensity, width, height. Lights emit on the side of cross(u, v) only
+// and are not in the BVH: rays test them separately and shadow rays ignore them.
+#define LIGHT_STRIDE 16
+
+struct RectLight {
+    float3 q;
+    float3 u;
+    float3 v;
+    float3 normal;
+    float area;
+    float3 radiance;
+};
+
+RectLight load_light(const device float* lights, uint index) {
+    const device float* row = lights + index * LIGHT_STRIDE;
+    RectLight light;
+    light.q = float3(row[0], row[1], row[2]);
+    light.u = float3(row[3], row[4], row[5]);
+    light.v = float3(row[6], row[7], row[8]);
+    float3 n = cross(light.u, light.v);
+    light.area = length(n);
+    light.normal = n / light.area;
+    light.radiance = float3(row[9], row[10], row[11]) * row[12];
+    return light;
+}
+
+// Ray parameter of the light's emitting side, or -1 if the ray misses it within ray_t
+float intersect_light(thread const RectLight& light, Ray ray, Interval ray_t) {
+    float denominator = dot(light.normal, ray.direction);
+    if (denominator >= 0.0f) {
+        return -1.0f;
+    }
+    float t = dot(light.q - ray.origin, light.normal) / denominator;
+    if (t <= ray_t.min || t >= ray_t.max) {
+        return -1.0f;
+    }
+    float3 offset = ray.origin + t * ray.direction - light.q;
+    float a = dot(offset, light.u) / dot(light.u, light.u);
+    float b = dot(offset, light.v) / dot(light.v, light.v);
+    return (a >= 0.0f && a <= 1.0f && b >= 0.0f && b <= 1.0f) ? t : -1.0f;
+}
+
+// Radiance of the closest light the ray sees within ray_t, narrowing ray_t.max to it.
+// light_pdf is the solid angle density sample_light() would have picked that direction with.
+float3 hit_lights(Ray ray, thread Interval& ray_t, const device float* lights, uint light_count, thread float& light_pdf) {
+    float3 radiance = float3(0.0f);
+    light_pdf = 0.0f;
+    for (uint i = 0; i < light_count; i++) {
+        RectLight light = load_light(lights, i);
+        float t = intersect_light(light, ray, ray_t);
+        if (t > 0.0f) {
+            ray_t.max = t;
+            float light_distance = t * length(ray.direction);
+            float cos_light = -dot(light.normal, ray.direction) / length(ray.direction);
+            light_pdf = light_distance * light_distance / (cos_light * light.area * float(light_count));
+            radiance = light.radiance;
+        }
+    }
+    return radiance;
+}
+
+// Uniform point on a uniformly picked light. u.x picks the light and is reused for the point.
+// Returns the light's radiance towards p, with the unit direction, distance and solid angle pdf.
+float3 sample_light(float3 p, float2 u, const device float* lights, uint light_count,
+                    thread float3& direction, thread float& light_distance, thread float& light_pdf) {
+    float scaled = u.x * float(light_count);
+    uint index = min(uint(scaled), light_count - 1);
+    u.x = scaled - float(index);
+    RectLight light = load_light(lights, index);
+
+    float3 to_light = light.q + u.x * light.u + u.y * light.v - p;
+    light_distance = length(to_light);
+    direction = to_light / light_distance;
+    float cos_light = -dot(light.normal, direction);
+    if (cos_light <= 0.0f) {
+        light_pdf = 0.0f;
+        return float3(0.0f);
+    }
+    light_pdf = light_distance * light_distance / (cos_light * light.area * float(light_count));
+    return light.radiance;
+}
+
+float power_heuristic(float pdf, float other_pdf) {
+    return pdf * pdf / (pdf * pdf + other_pdf * other_pdf);
+}
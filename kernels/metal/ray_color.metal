@@ -1,43 +1,105 @@
-
 #define MAX_DEPTH 20
-struct HitRecordStack {
-    HitRecord hit_records[MAX_DEPTH];
-    uint count;
-};
+// Every surface is a grey Lambertian reflector
+#define ALBEDO 0.8f
 
-float3 ray_color(Ray ray, 
-                const device float* geos, 
-                const device float* norms, 
+// Path tracing with next-event estimation (NEXT_EVENT 1): at every diffuse vertex one light
+// sample with a shadow ray, combined with the BSDF sample hitting a light by the power
+// heuristic. Scenes without lights keep the white sky of radiance 1 behind the first bounce.
+// From bounce ROULETTE_DEPTH on (0 disables it) paths survive Russian roulette with their
+// throughput as probability, MAX_DEPTH only caps the rare long path.
+// aovs receives the camera ray's first hit: lights get albedo 1 and no normal or material.
+float3 ray_color(Ray ray,
+                const device float* geos,
+                const device float* norms,
                 const device int* mats,
-                const device float* bboxes, 
-                const device int* indices, 
-                const device int* polygon_indices,
-                uint sample, 
-                const device float* blue_noise_texture) { 
-    HitRecordStack hit_record_stack;
-    hit_record_stack.count = 0;
-
+                BVH_PARAMS,
+                thread const Sampler& stream,
+                const device float* lights,
+                uint light_count,
+                thread Aovs& aovs
+                STATS_PARAM) {
+    float3 radiance = float3(0.0f);
+    float throughput = 1.0f;
+    float light_pdf;
+    aovs = Aovs{0.0f, float3(0.0f), float3(0.0f), float3(0.0f), -1.0f, 0.0f};
 
-    HitRecord hit_record = hit(ray, Interval{0.1, 10000.0}, geos, norms, mats, bboxes, indices, polygon_indices);
+    Interval ray_t = Interval{0.1, 10000.0};
+    HitRecord hit_record = hit(ray, ray_t, geos, norms, mats, BVH_ARGS STATS_ARG);
+    if (hit_record.hit) {
+        ray_t.max = hit_record.t;
+    }
+    float3 emitted = hit_lights(ray, ray_t, lights, light_count, light_pdf);
+    if (light_pdf > 0.0f) {
+        aovs.depth = ray_t.max * length(ray.direction);
+        aovs.position = ray.origin + ray_t.max * ray.direction;
+        aovs.albedo = float3(1.0f);
+        return emitted;
+    }
     if (!hit_record.hit) {
-        return float3(0.0, 0.0, 0.0);
+        return radiance;
     }
+    aovs.depth = hit_record.t * length(ray.direction);
+    aovs.position = hit_record.p;
+    aovs.normal = hit_record.front_face ? hit_record.normal : -hit_record.normal;
+    aovs.albedo = float3(ALBEDO);
+    aovs.material = float(hit_record.mat);
 
-    hit_record_stack.hit_records[hit_record_stack.count++] = hit_record;
+    for (uint bounce = 1; bounce < MAX_DEPTH; bounce++) {
+        float3 normal = hit_record.front_face ? hit_record.normal : -hit_record.normal;
 
-    for (uint i = 1; i < MAX_DEPTH; i++) {
-        float3 direction = get_blue_noise_on_hemisphere(-hit_record.normal, sample + i, blue_noise_texture);
-        hit_record = hit(Ray{hit_record.p, direction}, Interval{0.0001, 10000.0}, geos, norms, mats, bboxes, indices, polygon_indices);
+#if NEXT_EVENT
+        if (light_count > 0) {
+            float3 to_light;
+            float light_distance;
+            float3 light_radiance = sample_light(hit_record.p, sample_2d(stream, bounce_dimension(bounce, SAMPLE_LIGHT)),
+                                                 lights, light_count, to_light, light_distance, light_pdf);
+            float cos_surface = dot(normal, to_light);
+            if (light_pdf > 0.0f && cos_surface > 0.0f) {
+                if (!occluded(Ray{hit_record.p, to_light, bounce}, Interval{0.0001, light_distance - 0.0001},
+                              geos, BVH_ARGS STATS_ARG)) {
+                    float weight = power_heuristic(light_pdf, cos_surface / M_PI_F);
+                    radiance += throughput * (ALBEDO / M_PI_F) * cos_surface / light_pdf * weight * light_radiance;
+                }
+            }
+        }
+#endif
+
+        // Cosine sampling cancels the BSDF and cosine against the pdf, leaving the albedo
+        float3 direction = sample_cosine_hemisphere(stream, bounce_dimension(bounce, SAMPLE_DIRECTION), normal);
+        float bsdf_pdf = max(dot(normal, direction), 0.0f) / M_PI_F;
+        throughput *= ALBEDO;
+#if ROULETTE_DEPTH
+        if (bounce >= ROULETTE_DEPTH) {
+            float survival = min(throughput, 1.0f);
+            if (sample_2d(stream, bounce_dimension(bounce, SAMPLE_ROULETTE)).x >= survival) {
+                break;
+            }
+            throughput /= survival;
+        }
+#endif
+
+        Ray bounce_ray = Ray{hit_record.p, direction, bounce};
+        ray_t = Interval{0.0001, 10000.0};
+        hit_record = hit(bounce_ray, ray_t, geos, norms, mats, BVH_ARGS STATS_ARG);
+        aovs.bounces += 1.0f;
         if (hit_record.hit) {
-            hit_record_stack.hit_records[hit_record_stack.count++] = hit_record;
-        } else {
+            ray_t.max = hit_record.t;
+        }
+        emitted = hit_lights(bounce_ray, ray_t, lights, light_count, light_pdf);
+        if (light_pdf > 0.0f) {
+#if NEXT_EVENT
+            radiance += throughput * power_heuristic(bsdf_pdf, light_pdf) * emitted;
+#else
+            radiance += throughput * emitted;
+#endif
+            break;
+        }
+        if (!hit_record.hit) {
+            if (light_count == 0) {
+                radiance += throughput;
+            }
             break;
         }
     }
-
-    float3 color = float3(1.0, 1.0, 1.0);
-    for (uint i = hit_record_stack.count; i > 0; i--) {
-        color *= 0.8;
-    }
-    return color;
-}
\ No newline at end of file
+    return radiance;
+}
@@ -0,0 +1,110 @@
+// Sample streams selected by SAMPLER. SAMPLER_BLUE_NOISE reads the texture in blue_noise.metal,
+// SAMPLER_SOBOL is Owen-scrambled Sobol (Burley 2020) and SAMPLER_R2 the R2 sequence (Roberts 2018)
+// with a per-pixel rotation. A path draws 2D dimensions: SAMPLE_CAMERA for the pixel jitter,
+// then SAMPLE_DIMENSIONS_PER_BOUNCE per bounce, see bounce_dimension().
+#define SAMPLER_BLUE_NOISE 0
+#define SAMPLER_SOBOL 1
+#define SAMPLER_R2 2
+
+#define SAMPLE_CAMERA 0
+#define SAMPLE_DIMENSIONS_PER_BOUNCE 3
+#define SAMPLE_DIRECTION 0
+#define SAMPLE_LIGHT 1
+#define SAMPLE_ROULETTE 2
+
+struct Sampler {
+    uint index;     // Sample index, the texture offset with SAMPLER_BLUE_NOISE
+    uint seed;      // Per-pixel scramble
+    const device float* blue_noise_texture;
+};
+
+uint hash_uint(uint x) {
+    x ^= x >> 16;
+    x *= 0x7feb352du;
+    x ^= x >> 15;
+    x *= 0x846ca68bu;
+    x ^= x >> 16;
+    return x;
+}
+
+uint hash_combine(uint seed, uint value) {
+    return hash_uint(seed ^ hash_uint(value));
+}
+
+Sampler make_sampler(uint pixel, uint sample, uint random_seed, const device float* blue_noise_texture) {
+#if SAMPLER == SAMPLER_BLUE_NOISE
+    return Sampler{pixel * 3 + random_seed, 0, blue_noise_texture};
+#else
+    return Sampler{sample, hash_combine(hash_uint(random_seed), pixel), blue_noise_texture};
+#endif
+}
+
+uint bounce_dimension(uint bounce, uint slot) {
+    return 1 + (bounce - 1) * SAMPLE_DIMENSIONS_PER_BOUNCE + slot;
+}
+
+uint nested_uniform_scramble(uint x, uint seed) {
+    // Laine-Karras permutation on the reversed bits
+    x = reverse_bits(x);
+    x += seed;
+    x ^= x * 0x6c50b47cu;
+    x ^= x * 0xb82f1e52u;
+    x ^= x * 0xc7afe638u;
+    x ^= x * 0x8d22f6e6u;
+    return reverse_bits(x);
+}
+
+uint sobol_second(uint index) {
+    uint result = 0;
+    for (uint v = 1u << 31; index != 0; index >>= 1, v ^= v >> 1) {
+        if (index & 1) {
+            result ^= v;
+        }
+    }
+    return result;
+}
+
+float2 sobol_owen(uint index, uint seed) {
+    // Shuffle the sequence per pixel, then scramble both dimensions
+    index = nested_uniform_scramble(index, seed);
+    uint x = nested_uniform_scramble(reverse_bits(index), hash_combine(seed, 0));
+    uint y = nested_uniform_scramble(sobol_second(index), hash_combine(seed, 1));
+    return float2(float(x >> 8), float(y >> 8)) * 0x1p-24f;
+}
+
+float2 r2(uint index, uint seed) {
+    // Shuffled per dimension like sobol_owen, otherwise every dimension is a shifted copy of the others
+    index = nested_uniform_scramble(index, seed);
+    // 0.7548776662 and 0.5698402910 in 0.32 fixed point, wrapping is the fract
+    uint x = index * 3242174889u + hash_combine(seed, 0);
+    uint y = index * 2447445413u + hash_combine(seed, 1);
+    return float2(float(x >> 8), float(y >> 8)) * 0x1p-24f;
+}
+
+float2 sample_2d(thread const Sampler& stream, uint dimension) {
+#if SAMPLER == SAMPLER_SOBOL
+    return sobol_owen(stream.index, hash_combine(stream.seed, dimension));
+#elif SAMPLER == SAMPLER_R2
+    return r2(stream.index, hash_combine(stream.seed, dimension));
+#else
+    return get_blue_noise_sample(stream.index + dimension, stream.blue_noise_texture);
+#endif
+}
+
+float3 sample_cosine_hemisphere(thread const Sampler& stream, uint dimension, float3 normal) {
+#if SAMPLER == SAMPLER_BLUE_NOISE
+    return normalize(normal + get_blue_noise_unit_vector(stream.index + dimension, stream.blue_noise_texture));
+#else
+    // Cosine weighted around the normal, in an orthonormal basis (Duff et al. 2017)
+    float2 u = sample_2d(stream, dimension);
+    float r = sqrt(u.x);
+    float z = sqrt(max(0.0f, 1.0f - u.x));
+    float phi = 2.0f * M_PI_F * u.y;
+    float sign = copysign(1.0f, normal.z);
+    float a = -1.0f / (sign + normal.z);
+    float b = normal.x * normal.y * a;
+    float3 tangent = float3(1.0f + sign * normal.x * normal.x * a, sign * b, -sign * normal.x);
+    float3 bitangent = float3(b, sign + normal.y * normal.y * a, -normal.y);
+    return r * cos(phi) * tangent + r * sin(phi) * bitangent + z * normal;
+#endif
+}
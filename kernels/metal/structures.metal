@@ -9,6 +9,26 @@ struct Interval {
     float min;
     float max;
 };
+// Per-ray traversal counters, only compiled in with TRAVERSAL_STATS 1 (debug builds)
+struct TraversalStats {
+    uint aabb_tests;
+    uint triangle_tests;
+    uint max_stack_depth;
+};
+#ifndef TRAVERSAL_STATS
+#define TRAVERSAL_STATS 0
+#endif
+#if TRAVERSAL_STATS
+#define STATS_PARAM , thread TraversalStats& stats
+#define STATS_ARG   , stats
+#define STATS_ADD(field, n) stats.field += (n)
+#define STATS_MAX(field, n) stats.field = max(stats.field, uint(n))
+#else
+#define STATS_PARAM
+#define STATS_ARG
+#define STATS_ADD(field, n)
+#define STATS_MAX(field, n)
+#endif
 struct HitRecord{
     bool hit;
     float t;
@@ -18,6 +38,16 @@ struct HitRecord{
     int mat;
     float debug;
 };
+// Arbitrary output variables of the camera ray's first hit and the path's bounce count;
+// render_kernel only writes out the ones it was asked for, see kernels/aov.py
+struct Aovs {
+    float depth;
+    float3 normal;
+    float3 albedo;
+    float3 position;
+    float material;
+    float bounces;
+};
 class MetalRandom {
 private:
     thread uint state;
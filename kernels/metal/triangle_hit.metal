@@ -5,7 +5,66 @@
   [2] - parent index
   [3] - depth
   [4] - is_leaf
+
+ COMPACT BVH NODE LAYOUT (BVH_COMPACT, 32 bytes, see BVH_NODE_DTYPE)
+  minimum, maximum - node bounds
+  child_or_offset  - left child (right child is left + 1) or first triangle of a leaf
+  count            - 0 for internal nodes, triangle count for leaves
+  Triangles are stored in leaf order, there is no polygon_indices indirection.
+
+ WIDE BVH NODE LAYOUT (BVH_WIDE, 32 * BVH_WIDTH bytes, see wide_node_dtype)
+  box_min, box_max - child bounds as structure of arrays, [axis][child]
+  child            - wide node of an inner child, first triangle of a leaf child, -1 if empty
+  count            - 0 for inner (and empty) children, triangle count for leaf children
+  Empty children have inverted bounds, so no ray enters them.
+
+ INSTANCE LAYOUT (INSTANCING, compact or wide only, 64 bytes, see INSTANCE_DTYPE)
+  world_to_object - rows of the 4x3 matrix taking world points to object space (row vectors)
+  root            - root of the instance's bottom-level tree in bvh_nodes
+  Node 0 is the root of the top-level tree, whose leaves index instances instead of triangles.
 */
+#ifndef BVH_COMPACT
+#define BVH_COMPACT 0
+#endif
+#ifndef INSTANCING
+#define INSTANCING 0
+#endif
+#ifndef BVH_WIDE
+#define BVH_WIDE 0
+#endif
+#ifndef BVH_WIDTH
+#define BVH_WIDTH 4
+#endif
+
+#if BVH_COMPACT && INSTANCING
+#define BVH_PARAMS const device float* bvh_nodes, const device float* instances
+#define BVH_ARGS   bvh_nodes, instances
+#elif BVH_COMPACT
+#define BVH_PARAMS const device float* bvh_nodes
+#define BVH_ARGS   bvh_nodes
+#else
+#define BVH_PARAMS const device float* bboxes, const device int* indices, const device int* polygon_indices
+#define BVH_ARGS   bboxes, indices, polygon_indices
+#endif
+
+struct CompactBVHNode {
+    packed_float3 minimum;
+    packed_float3 maximum;
+    int child_or_offset;
+    int count;
+};
+struct WideBVHNode {
+    float box_min[3][BVH_WIDTH];
+    float box_max[3][BVH_WIDTH];
+    int child[BVH_WIDTH];
+    int count[BVH_WIDTH];
+};
+struct Instance {
+    packed_float3 world_to_object[4];
+    int root;
+    int prototype;
+    int pad[2];
+};
 class AABB {
 public:
     AABB() {}
@@ -99,10 +158,8 @@ private:
     const device int* polygon_indices;
 };
 
-HitRecord triangle_hit(Ray ray, Interval ray_t, float3 v0, float3 v1, float3 v2, float3 n0, float3 n1, float3 n2) {
-    HitRecord hit_record;
-    hit_record.hit = false;
-
+// Moller-Trumbore, true with the ray parameter and barycentrics if the ray hits within ray_t
+bool triangle_intersect(Ray ray, Interval ray_t, float3 v0, float3 v1, float3 v2, thread float& t, thread float& u, thread float& v) {
     float EPSILON = 1e-9;
     float3 edge1 = v1 - v0;
     float3 edge2 = v2 - v0;
@@ -110,38 +167,395 @@ HitRecord triangle_hit(Ray ray, Interval ray_t, float3 v0, float3 v1, float3 v2,
     float a = dot(edge1, h);
 
     if (a > -EPSILON && a < EPSILON){
-        return hit_record;
+        return false;
     }
     
     float f = 1.0 / a;
     float3 s = ray.origin - v0;
-    float u = f * dot(s, h);
+    u = f * dot(s, h);
 
     if (u < 0.0 || u > 1.0) {
-        return hit_record;
+        return false;
     }
     float3 q = cross(s, edge1);
-    float v = f * dot(ray.direction, q);
+    v = f * dot(ray.direction, q);
 
     if (v < 0.0 || u + v > 1.0){
-        return hit_record;
+        return false;
     }
 
-    float t = f * dot(edge2, q);
-    if(t > ray_t.min && t < ray_t.max) {
-        
+    t = f * dot(edge2, q);
+    return t > ray_t.min && t < ray_t.max;
+}
+
+HitRecord triangle_hit(Ray ray, Interval ray_t, float3 v0, float3 v1, float3 v2, float3 n0, float3 n1, float3 n2) {
+    HitRecord hit_record;
+    hit_record.hit = false;
+
+    float t, u, v;
+    if (triangle_intersect(ray, ray_t, v0, v1, v2, t, u, v)) {
         hit_record.hit = true;
         hit_record.t = t;
         hit_record.p = ray.origin + t * ray.direction;
         float w = 1.0 - u - v;
         hit_record.normal = normalize(w * n0 + u * n1 + v * n2);
         hit_record.front_face = dot(ray.direction, hit_record.normal) < 0.0;
-        return hit_record;
     }
-
     return hit_record;
 }
 
+HitRecord triangle_hit_at(Ray ray, Interval ray_t, const device float* geos, const device float* norms, int idx) {
+    float3 v0 = float3(geos[idx * 9],     geos[idx * 9 + 1],  geos[idx * 9 + 2]);
+    float3 v1 = float3(geos[idx * 9 + 3], geos[idx * 9 + 4],  geos[idx * 9 + 5]);
+    float3 v2 = float3(geos[idx * 9 + 6], geos[idx * 9 + 7],  geos[idx * 9 + 8]);
+    float3 n0 = float3(norms[idx * 9],     norms[idx * 9 + 1],  norms[idx * 9 + 2]);
+    float3 n1 = float3(norms[idx * 9 + 3], norms[idx * 9 + 4],  norms[idx * 9 + 5]);
+    float3 n2 = float3(norms[idx * 9 + 6], norms[idx * 9 + 7],  norms[idx * 9 + 8]);
+    return triangle_hit(ray, ray_t, v0, v1, v2, n0, n1, n2);
+}
+
+bool triangle_occludes(Ray ray, Interval ray_t, const device float* geos, int idx) {
+    float3 v0 = float3(geos[idx * 9],     geos[idx * 9 + 1],  geos[idx * 9 + 2]);
+    float3 v1 = float3(geos[idx * 9 + 3], geos[idx * 9 + 4],  geos[idx * 9 + 5]);
+    float3 v2 = float3(geos[idx * 9 + 6], geos[idx * 9 + 7],  geos[idx * 9 + 8]);
+    float t, u, v;
+    return triangle_intersect(ray, ray_t, v0, v1, v2, t, u, v);
+}
+
+#if BVH_COMPACT
+// Reciprocal direction and its sign bits, computed once per ray for every box test
+struct RayInverse {
+    float3 origin;
+    float3 inv_direction;
+    bool3 negative;
+};
+
+RayInverse ray_inverse(Ray ray) {
+    RayInverse inv;
+    inv.origin = ray.origin;
+    inv.inv_direction = 1.0f / ray.direction;
+    inv.negative = inv.inv_direction < 0.0f;
+    return inv;
+}
+
+// Distance at which the ray enters the box within ray_t, INFINITY on a miss. The sign bits
+// pick each axis' near and far slab, so there is no division or per-axis min/max.
+float box_entry(thread const RayInverse& inv, float3 box_min, float3 box_max, Interval ray_t) {
+    float3 t_near = (select(box_min, box_max, inv.negative) - inv.origin) * inv.inv_direction;
+    float3 t_far = (select(box_max, box_min, inv.negative) - inv.origin) * inv.inv_direction;
+    float entry = max(max(max(t_near.x, t_near.y), t_near.z), ray_t.min);
+    float leave = min(min(min(t_far.x, t_far.y), t_far.z), ray_t.max);
+    return entry <= leave ? entry : INFINITY;
+}
+
+// The traversal loops below work on stack entries and their entry distances; push_root and
+// open_node hide whether the entries are binary or wide nodes.
+#if BVH_WIDE
+typedef WideBVHNode BVHNode;
+#define TRAVERSAL_STACK_SIZE 128
+
+// The root's bounds are in no parent, its children are tested when it is opened
+void push_root(thread const RayInverse& inv, const device BVHNode* nodes, int root, Interval ray_t,
+               thread int* stack, thread float* stack_t, thread int& stack_ptr STATS_PARAM) {
+    stack[stack_ptr] = root;
+    stack_t[stack_ptr++] = ray_t.min;
+}
+
+// Returns true with the triangle range of a leaf entry. A wide node instead tests all its
+// children and pushes the ones the ray enters far to near, leaf children as
+// -(node * BVH_WIDTH + slot) - 1 so they are culled by distance too.
+bool open_node(thread const RayInverse& inv, const device BVHNode* nodes, int entry, Interval ray_t,
+               thread int* stack, thread float* stack_t, thread int& stack_ptr,
+               thread int& offset, thread int& count STATS_PARAM) {
+    if (entry < 0) {
+        int slot = -entry - 1;
+        const device WideBVHNode& node = nodes[slot / BVH_WIDTH];
+        offset = node.child[slot % BVH_WIDTH];
+        count = node.count[slot % BVH_WIDTH];
+        return true;
+    }
+    const device WideBVHNode& node = nodes[entry];
+    STATS_ADD(aabb_tests, BVH_WIDTH);
+    float hit_t[BVH_WIDTH];
+    int hit_entry[BVH_WIDTH];
+    int hits = 0;
+    for (int i = 0; i < BVH_WIDTH; i++) {
+        float t = box_entry(inv, float3(node.box_min[0][i], node.box_min[1][i], node.box_min[2][i]),
+                            float3(node.box_max[0][i], node.box_max[1][i], node.box_max[2][i]), ray_t);
+        if (t < INFINITY) {
+            // Insertion sort, far to near
+            int j = hits++;
+            while (j > 0 && hit_t[j - 1] < t) {
+                hit_t[j] = hit_t[j - 1];
+                hit_entry[j] = hit_entry[j - 1];
+                j--;
+            }
+            hit_t[j] = t;
+            hit_entry[j] = node.count[i] > 0 ? -(entry * BVH_WIDTH + i) - 1 : node.child[i];
+        }
+    }
+    for (int j = 0; j < hits; j++) {
+        stack[stack_ptr] = hit_entry[j];
+        stack_t[stack_ptr++] = hit_t[j];
+    }
+    STATS_MAX(max_stack_depth, stack_ptr);
+    return false;
+}
+#else
+typedef CompactBVHNode BVHNode;
+#define TRAVERSAL_STACK_SIZE 64
+
+float node_entry(thread const RayInverse& inv, const device CompactBVHNode& node, Interval ray_t) {
+    return box_entry(inv, float3(node.minimum), float3(node.maximum), ray_t);
+}
+
+void push_root(thread const RayInverse& inv, const device BVHNode* nodes, int root, Interval ray_t,
+               thread int* stack, thread float* stack_t, thread int& stack_ptr STATS_PARAM) {
+    STATS_ADD(aabb_tests, 1);
+    float entry = node_entry(inv, nodes[root], ray_t);
+    if (entry < INFINITY) {
+        stack[stack_ptr] = root;
+        stack_t[stack_ptr++] = entry;
+    }
+}
+
+// Returns true with the triangle range of a leaf. An inner node instead tests both children
+// and pushes the ones the ray enters, the far one first so the near one is popped next.
+bool open_node(thread const RayInverse& inv, const device BVHNode* nodes, int entry, Interval ray_t,
+               thread int* stack, thread float* stack_t, thread int& stack_ptr,
+               thread int& offset, thread int& count STATS_PARAM) {
+    const device CompactBVHNode& node = nodes[entry];
+    if (node.count > 0) {
+        offset = node.child_or_offset;
+        count = node.count;
+        return true;
+    }
+    if (node.child_or_offset <= 0) {
+        return false;
+    }
+    int left = node.child_or_offset;
+    STATS_ADD(aabb_tests, 2);
+    float t_left = node_entry(inv, nodes[left], ray_t);
+    float t_right = node_entry(inv, nodes[left + 1], ray_t);
+    bool left_first = t_left <= t_right;
+    float t_far = max(t_left, t_right);
+    float t_near = min(t_left, t_right);
+    if (t_far < INFINITY) {
+        stack[stack_ptr] = left_first ? left + 1 : left;
+        stack_t[stack_ptr++] = t_far;
+    }
+    if (t_near < INFINITY) {
+        stack[stack_ptr] = left_first ? left : left + 1;
+        stack_t[stack_ptr++] = t_near;
+    }
+    STATS_MAX(max_stack_depth, stack_ptr);
+    return false;
+}
+#endif
+
+// Closest hit below root for a ray in the tree's space, lowers ray_t.max and fills closest on a hit
+bool closest_triangle(Ray ray,
+                      thread Interval& ray_t,
+                      const device float* geos,
+                      const device float* norms,
+                      const device int* mats,
+                      const device BVHNode* nodes,
+                      int root,
+                      thread HitRecord& closest
+                      STATS_PARAM) {
+    bool found = false;
+
+    // Front-to-back stack traversal over node indices and their entry distances
+    RayInverse inv = ray_inverse(ray);
+    int stack[TRAVERSAL_STACK_SIZE];
+    float stack_t[TRAVERSAL_STACK_SIZE];
+    int stack_ptr = 0;
+    push_root(inv, nodes, root, ray_t, stack, stack_t, stack_ptr STATS_ARG);
+
+    while (stack_ptr > 0) {
+        stack_ptr--;
+        // The closest hit may have moved in front of the node since it was pushed
+        if (stack_t[stack_ptr] > ray_t.max) {
+            continue;
+        }
+        int offset, count;
+        if (!open_node(inv, nodes, stack[stack_ptr], ray_t, stack, stack_t, stack_ptr, offset, count STATS_ARG)) {
+            continue;
+        }
+
+        int end = offset + count;
+        STATS_ADD(triangle_tests, count);
+        for (int idx = offset; idx < end; idx++) {
+            HitRecord hit_record = triangle_hit_at(ray, ray_t, geos, norms, idx);
+            if (hit_record.hit && hit_record.t < ray_t.max) {
+                ray_t.max = hit_record.t;
+                closest = hit_record;
+                closest.mat = mats[idx];
+                found = true;
+            }
+        }
+    }
+
+    return found;
+}
+
+// Any hit below root within ray_t, returns at the first triangle found
+bool any_triangle(Ray ray,
+                  Interval ray_t,
+                  const device float* geos,
+                  const device BVHNode* nodes,
+                  int root
+                  STATS_PARAM) {
+    RayInverse inv = ray_inverse(ray);
+    int stack[TRAVERSAL_STACK_SIZE];
+    float stack_t[TRAVERSAL_STACK_SIZE];
+    int stack_ptr = 0;
+    push_root(inv, nodes, root, ray_t, stack, stack_t, stack_ptr STATS_ARG);
+
+    while (stack_ptr > 0) {
+        // ray_t never shrinks, so every pushed node is still entered
+        int offset, count;
+        stack_ptr--;
+        if (!open_node(inv, nodes, stack[stack_ptr], ray_t, stack, stack_t, stack_ptr, offset, count STATS_ARG)) {
+            continue;
+        }
+
+        int end = offset + count;
+        for (int idx = offset; idx < end; idx++) {
+            STATS_ADD(triangle_tests, 1);
+            if (triangle_occludes(ray, ray_t, geos, idx)) {
+                return true;
+            }
+        }
+    }
+
+    return false;
+}
+
+#if INSTANCING
+HitRecord hit(  Ray ray,
+                Interval ray_t,
+                const device float* geos,
+                const device float* norms,
+                const device int* mats,
+                const device float* bvh_nodes,
+                const device float* instances
+                STATS_PARAM) {
+    const device BVHNode* nodes = reinterpret_cast<const device BVHNode*>(bvh_nodes);
+    const device Instance* records = reinterpret_cast<const device Instance*>(instances);
+    HitRecord global_hit_record;
+    global_hit_record.hit = false;
+
+    // Top-level traversal, leaves hold instances
+    RayInverse inv = ray_inverse(ray);
+    int stack[TRAVERSAL_STACK_SIZE];
+    float stack_t[TRAVERSAL_STACK_SIZE];
+    int stack_ptr = 0;
+    push_root(inv, nodes, 0, ray_t, stack, stack_t, stack_ptr STATS_ARG);
+
+    while (stack_ptr > 0) {
+        stack_ptr--;
+        // The closest hit may have moved in front of the node since it was pushed
+        if (stack_t[stack_ptr] > ray_t.max) {
+            continue;
+        }
+        int offset, count;
+        if (!open_node(inv, nodes, stack[stack_ptr], ray_t, stack, stack_t, stack_ptr, offset, count STATS_ARG)) {
+            continue;
+        }
+
+        int end = offset + count;
+        for (int i = offset; i < end; i++) {
+            const device Instance& instance = records[i];
+            float3 r0 = float3(instance.world_to_object[0]);
+            float3 r1 = float3(instance.world_to_object[1]);
+            float3 r2 = float3(instance.world_to_object[2]);
+            // The direction is not normalized, so t is the same in both spaces
+            Ray local_ray;
+            local_ray.origin = ray.origin.x * r0 + ray.origin.y * r1 + ray.origin.z * r2 + float3(instance.world_to_object[3]);
+            local_ray.direction = ray.direction.x * r0 + ray.direction.y * r1 + ray.direction.z * r2;
+            local_ray.depth = ray.depth;
+
+            HitRecord hit_record;
+            if (closest_triangle(local_ray, ray_t, geos, norms, mats, nodes, instance.root, hit_record STATS_ARG)) {
+                global_hit_record = hit_record;
+                global_hit_record.p = ray.origin + hit_record.t * ray.direction;
+                // Back to world space with the transpose of world_to_object
+                global_hit_record.normal = normalize(float3(dot(hit_record.normal, r0), dot(hit_record.normal, r1), dot(hit_record.normal, r2)));
+                global_hit_record.front_face = dot(ray.direction, global_hit_record.normal) < 0.0;
+            }
+        }
+    }
+
+    return global_hit_record;
+}
+
+// Shadow ray query: true if anything lies within ray_t, without looking for the closest hit
+bool occluded(Ray ray,
+              Interval ray_t,
+              const device float* geos,
+              const device float* bvh_nodes,
+              const device float* instances
+              STATS_PARAM) {
+    const device BVHNode* nodes = reinterpret_cast<const device BVHNode*>(bvh_nodes);
+    const device Instance* records = reinterpret_cast<const device Instance*>(instances);
+
+    RayInverse inv = ray_inverse(ray);
+    int stack[TRAVERSAL_STACK_SIZE];
+    float stack_t[TRAVERSAL_STACK_SIZE];
+    int stack_ptr = 0;
+    push_root(inv, nodes, 0, ray_t, stack, stack_t, stack_ptr STATS_ARG);
+
+    while (stack_ptr > 0) {
+        // ray_t never shrinks, so every pushed node is still entered
+        int offset, count;
+        stack_ptr--;
+        if (!open_node(inv, nodes, stack[stack_ptr], ray_t, stack, stack_t, stack_ptr, offset, count STATS_ARG)) {
+            continue;
+        }
+
+        int end = offset + count;
+        for (int i = offset; i < end; i++) {
+            const device Instance& instance = records[i];
+            float3 r0 = float3(instance.world_to_object[0]);
+            float3 r1 = float3(instance.world_to_object[1]);
+            float3 r2 = float3(instance.world_to_object[2]);
+            Ray local_ray;
+            local_ray.origin = ray.origin.x * r0 + ray.origin.y * r1 + ray.origin.z * r2 + float3(instance.world_to_object[3]);
+            local_ray.direction = ray.direction.x * r0 + ray.direction.y * r1 + ray.direction.z * r2;
+            local_ray.depth = ray.depth;
+            if (any_triangle(local_ray, ray_t, geos, nodes, instance.root STATS_ARG)) {
+                return true;
+            }
+        }
+    }
+
+    return false;
+}
+#else
+HitRecord hit(  Ray ray, 
+                Interval ray_t, 
+                const device float* geos, 
+                const device float* norms, 
+                const device int* mats, 
+                const device float* bvh_nodes
+                STATS_PARAM) {
+    const device BVHNode* nodes = reinterpret_cast<const device BVHNode*>(bvh_nodes);
+    HitRecord global_hit_record;
+    global_hit_record.hit = false;
+    closest_triangle(ray, ray_t, geos, norms, mats, nodes, 0, global_hit_record STATS_ARG);
+    return global_hit_record;
+}
+
+bool occluded(Ray ray,
+              Interval ray_t,
+              const device float* geos,
+              const device float* bvh_nodes
+              STATS_PARAM) {
+    return any_triangle(ray, ray_t, geos, reinterpret_cast<const device BVHNode*>(bvh_nodes), 0 STATS_ARG);
+}
+#endif
+#else
 HitRecord hit(  Ray ray, 
                 Interval ray_t, 
                 const device float* geos, 
@@ -149,7 +563,8 @@ HitRecord hit(  Ray ray,
                 const device int* mats, 
                 const device float* bboxes, 
                 const device int* indices, 
-                const device int* polygon_indices) {
+                const device int* polygon_indices
+                STATS_PARAM) {
     BVH root;
     root.init(0, geos, bboxes, indices, polygon_indices);
     HitRecord global_hit_record;
@@ -162,6 +577,7 @@ HitRecord hit(  Ray ray,
 
     while (stack_ptr > 0) {
         BVH node = stack[--stack_ptr];
+        STATS_ADD(aabb_tests, 1);
         
         if (!intersect_aabb(ray, node.get_bbox(), ray_t)) {
             continue;
@@ -170,17 +586,11 @@ HitRecord hit(  Ray ray,
         if (node.is_leaf()) {
             int polygon_index_start = node.get_polygon_index_start();
             int polygon_count = node.get_polygon_count();
+            STATS_ADD(triangle_tests, polygon_count);
 
             for (int i = 0; i < polygon_count; i++) {
                 int idx = polygon_indices[polygon_index_start + i];
-                float3 v0 = float3(geos[idx * 9],     geos[idx * 9 + 1],  geos[idx * 9 + 2]);
-                float3 v1 = float3(geos[idx * 9 + 3], geos[idx * 9 + 4],  geos[idx * 9 + 5]);
-                float3 v2 = float3(geos[idx * 9 + 6], geos[idx * 9 + 7],  geos[idx * 9 + 8]);
-                float3 n0 = float3(norms[idx * 9],     norms[idx * 9 + 1],  norms[idx * 9 + 2]);
-                float3 n1 = float3(norms[idx * 9 + 3], norms[idx * 9 + 4],  norms[idx * 9 + 5]);
-                float3 n2 = float3(norms[idx * 9 + 6], norms[idx * 9 + 7],  norms[idx * 9 + 8]);
-
-                HitRecord hit_record = triangle_hit(ray, ray_t, v0, v1, v2, n0, n1, n2);
+                HitRecord hit_record = triangle_hit_at(ray, ray_t, geos, norms, idx);
                 if (hit_record.hit && hit_record.t < ray_t.max) {
                     ray_t.max = hit_record.t;
                     global_hit_record = hit_record;
@@ -190,8 +600,51 @@ HitRecord hit(  Ray ray,
         } else {
             stack[stack_ptr++] = node.right();
             stack[stack_ptr++] = node.left();
+            STATS_MAX(max_stack_depth, stack_ptr);
         }
     }
 
     return global_hit_record;
-}
\ No newline at end of file
+}
+
+bool occluded(Ray ray,
+              Interval ray_t,
+              const device float* geos,
+              const device float* bboxes,
+              const device int* indices,
+              const device int* polygon_indices
+              STATS_PARAM) {
+    BVH root;
+    root.init(0, geos, bboxes, indices, polygon_indices);
+
+    BVH stack[64];
+    int stack_ptr = 0;
+    stack[stack_ptr++] = root;
+
+    while (stack_ptr > 0) {
+        BVH node = stack[--stack_ptr];
+        STATS_ADD(aabb_tests, 1);
+
+        if (!intersect_aabb(ray, node.get_bbox(), ray_t)) {
+            continue;
+        }
+
+        if (node.is_leaf()) {
+            int polygon_index_start = node.get_polygon_index_start();
+            int polygon_count = node.get_polygon_count();
+            for (int i = 0; i < polygon_count; i++) {
+                STATS_ADD(triangle_tests, 1);
+                if (triangle_occludes(ray, ray_t, geos, polygon_indices[polygon_index_start + i])) {
+                    return true;
+                }
+            }
+        } else {
+            stack[stack_ptr++] = node.right();
+            stack[stack_ptr++] = node.left();
+            STATS_MAX(max_stack_depth, stack_ptr);
+        }
+    }
+
+    return false;
+}
+#endif
\ No newline at end of file
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import mlx.core as mx
+
+METAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metal")
+
+class KernelRegistry:
+    """Loads shader sources once and caches built mx.fast.metal_kernel objects.
+
+    Kernels are keyed by name and a hash of header + source, so kernels generated from
+    different sources (e.g. BVH formats) never collide. In dev mode (MLXRAY_KERNEL_DEV=1)
+    every source lookup checks the file's modification time and reloads edited files;
+    the changed hash then builds a fresh kernel.
+    """
+    def __init__(self, source_dir: str = METAL_DIR, dev_mode: bool = None):
+        self.source_dir = source_dir
+        self.dev_mode = dev_mode if dev_mode is not None else os.environ.get("MLXRAY_KERNEL_DEV", "0") == "1"
+        self._sources = {}
+        self._kernels = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.compiles = 0
+        self.cache_hits = 0
+        self.source_loads = 0
+        self.source_reloads = 0
+
+    def stats(self) -> dict:
+        return {
+            "compiles": self.compiles,
+            "cache_hits": self.cache_hits,
+            "source_loads": self.source_loads,
+            "source_reloads": self.source_reloads,
+            "cached_kernels": len(self._kernels),
+        }
+
+    def source(self, filename: str) -> str:
+        """Return the contents of a shader file in source_dir."""
+        path = os.path.join(self.source_dir, filename)
+        cached = self._sources.get(filename)
+        if cached is not None and not self.dev_mode:
+            return cached[1]
+
+        mtime = os.path.getmtime(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "r") as f:
+            text = f.read()
+        if cached is None:
+            self.source_loads += 1
+        else:
+            self.source_reloads += 1
+            print(f"Reloaded shader source: {filename}")
+        self._sources[filename] = (mtime, text)
+        return text
+
+    def kernel(self, name: str, source: str, header: str = ""):
+        digest = hashlib.sha1((header + "\0" + source).encode()).hexdigest()[:16]
+        key = (name, digest)
+        kernel = self._kernels.get(key)
+        if kernel is not None:
+            self.cache_hits += 1
+            return kernel
+
+        self.compiles += 1
+        kernel = mx.fast.metal_kernel(
+            name=f"{name}_{digest}",
+            source=source,
+            header=header,
+        )
+        self._kernels[key] = kernel
+        return kernel
+
+    def clear(self):
+        self._sources.clear()
+        self._kernels.clear()
+
+registry = KernelRegistry()
@@ -1,4 +1,12 @@
 import mlx.core as mx
+from kernels.registry import registry
+from kernels.aov import AOV_CHANNELS
+from kernels.cpu.light import LIGHT_STRIDE
+
+# Values of the SAMPLER define, see sampler.metal
+SAMPLER_DEFINES = {"blue_noise": 0, "sobol": 1, "r2": 2}
+# BVH_WIDTH of the wide formats, as in core.bvh.BVH_WIDTHS
+WIDTH_DEFINES = {"wide4": 4, "wide8": 8}
 
 def render_kernel(image_buffer: mx.array, 
                   camera_center: mx.array, 
@@ -14,49 +22,117 @@ def render_kernel(image_buffer: mx.array,
                   indices: mx.array,
                   polygon_indices: mx.array,
                   blue_noise_texture: mx.array,
-                  blue_noise_texture_size: int):
-
-    structures_source = ""
-    get_ray_source = ""
-    ray_color_source = ""
-    triangle_hit_source = ""
+                  blue_noise_texture_size: int,
+                  bvh_nodes: mx.array = None,
+                  bvh_format: str = "flat",
+                  random_seed: int = None,
+                  active: mx.array = None,
+                  traversal_stats: bool = False,
+                  instances: mx.array = None,
+                  sampler: str = "blue_noise",
+                  lights: mx.array = None,
+                  light_count: int = 0,
+                  next_event: bool = True,
+                  roulette_depth: int = 3,
+                  aovs: tuple = ()):
+    """Trace one sample per pixel. Returns the color buffer, or (colors, extras) with traversal_stats
+    or aovs. extras["stats"] holds AABB tests, triangle tests and max stack depth per pixel as
+    uint32 (width, height, 3), extras[name] every AOV named in aovs as (width, height, channels)
+    float32, see kernels/aov.py.
+    instances (raw INSTANCE_DTYPE words) switches the compact and wide formats to the two-level BVH.
+    sampler picks the sample streams (see sampler.metal); the sequences index by sample and
+    scramble per pixel from random_seed, which should then stay fixed for the frame.
+    lights is the packed light table (see pack_lights) flattened, next_event samples it at
+    every bounce; without it only paths that happen to hit a light see it. Paths go through
+    Russian roulette from bounce roulette_depth on, 0 traces every path to MAX_DEPTH."""
 
-    with open("kernels/metal/structures.metal", "r") as f:
-        structures_source = f.read()
-    with open("kernels/metal/get_ray.metal", "r") as f:
-        get_ray_source = f.read()
-    with open("kernels/metal/blue_noise.metal", "r") as f:
-        blue_noise_source = f.read()
-    with open("kernels/metal/ray_color.metal", "r") as f:
-        ray_color_source = f.read()
-    with open("kernels/metal/triangle_hit.metal", "r") as f:    
-        triangle_hit_source = f.read()
-    header = "\n".join([structures_source, blue_noise_source, get_ray_source, triangle_hit_source, ray_color_source])
+    structures_source = registry.source("structures.metal")
+    get_ray_source = registry.source("get_ray.metal")
+    blue_noise_source = registry.source("blue_noise.metal")
+    sampler_source = registry.source("sampler.metal")
+    light_source = registry.source("light.metal")
+    ray_color_source = registry.source("ray_color.metal")
+    triangle_hit_source = registry.source("triangle_hit.metal")
+    # "compact" and the wide formats expect bvh_nodes (binary or wide records, see
+    # CompiledScene.traversal_nodes) and leaf-ordered geos/norms/mats, "flat" the bboxes/indices/polygon_indices arrays
+    compact = bvh_format != "flat"
+    instancing = compact and instances is not None
+    width = WIDTH_DEFINES.get(bvh_format)
+    bvh_define = (f"#define BVH_COMPACT {1 if compact else 0}\n#define INSTANCING {1 if instancing else 0}\n"
+                  f"#define BVH_WIDE {1 if width else 0}\n#define BVH_WIDTH {width or 2}")
+    stats_define = f"#define TRAVERSAL_STATS {1 if traversal_stats else 0}"
+    sampler_define = f"#define SAMPLER {SAMPLER_DEFINES[sampler]}"
+    next_event_define = f"#define NEXT_EVENT {1 if next_event else 0}\n#define ROULETTE_DEPTH {roulette_depth}"
+    header = "\n".join([bvh_define, stats_define, sampler_define, next_event_define, structures_source, blue_noise_source, sampler_source,
+                        light_source, get_ray_source, triangle_hit_source, ray_color_source])
+    bvh_args = ("bvh_nodes, instances" if instancing else "bvh_nodes") if compact else "bboxes, indices, polygon_indices"
+    # With an active mask (one float per pixel, 0 = converged) masked pixels skip tracing
+    extras_clear = "stats_out[elem] = stats_out[elem + 1] = stats_out[elem + 2] = 0;" if traversal_stats else ""
+    # AOV outputs are indexed like the color with elem = pixel * channels
+    aov_elems = {name: ["elem / 3"] if AOV_CHANNELS[name] == 1 else ["elem", "elem + 1", "elem + 2"] for name in aovs}
+    extras_clear += "".join(f"{name}_out[{index}] = 0.0f;" for name, indices in aov_elems.items() for index in indices)
+    active_check = f"""
+    if (active[elem / 3] == 0.0f) {{
+        out[elem] = out[elem + 1] = out[elem + 2] = 0.0f;
+        {extras_clear}
+        return;
+    }}""" if active is not None else ""
+    stats_declare = "TraversalStats stats = {0, 0, 0};" if traversal_stats else ""
+    stats_store = """
+    stats_out[elem]     = stats.aabb_tests;
+    stats_out[elem + 1] = stats.triangle_tests;
+    stats_out[elem + 2] = stats.max_stack_depth;""" if traversal_stats else ""
+    aovs_store = ""
+    for name, indices in aov_elems.items():
+        fields = [f"aovs.{name}"] if len(indices) == 1 else [f"aovs.{name}[{channel}]" for channel in range(3)]
+        aovs_store += "".join(f"\n    {name}_out[{index}] = {field};" for index, field in zip(indices, fields))
+    variant = bvh_format + f"_{sampler}" + ("_nee" if next_event else "") + (f"_rr{roulette_depth}" if roulette_depth else "") + ("_instanced" if instancing else "") + ("_masked" if active is not None else "") + ("_stats" if traversal_stats else "") + "".join(f"_{name}" for name in aovs)
 
-    source = """
+    source = f"""
     uint elem = (thread_position_in_grid.x + thread_position_in_grid.y * threads_per_grid.x) * 3;
     uint x = thread_position_in_grid.x;
     uint y = thread_position_in_grid.y;
+    {active_check}
+    Sampler stream = make_sampler(elem / 3, sample, random_seed, blue_noise_texture);
 
     Ray ray = get_ray(  float2(float(x), float(y)), 
                         float3(camera_center[0], camera_center[1], camera_center[2]), 
                         float3(pixel00_loc[0], pixel00_loc[1], pixel00_loc[2]), 
                         float3(pixel_delta_u[0], pixel_delta_u[1], pixel_delta_u[2]), 
-                        float3(pixel_delta_v[0], pixel_delta_v[1], pixel_delta_v[2]), elem + random_seed, blue_noise_texture);
+                        float3(pixel_delta_v[0], pixel_delta_v[1], pixel_delta_v[2]), stream);
 
-    float3 color = ray_color(ray, geos, norms, mats, bboxes, indices, polygon_indices, elem + random_seed, blue_noise_texture);
+    {stats_declare}
+    Aovs aovs;
+    float3 color = ray_color(ray, geos, norms, mats, {bvh_args}, stream, lights, light_count, aovs STATS_ARG);
 
     out[elem]     = color[0];
     out[elem + 1] = color[1];
     out[elem + 2] = color[2];
+    {stats_store}
+    {aovs_store}
     """
-    kernel = mx.fast.metal_kernel(
-        name="render_kernel",
-        source=source,
-        header=header,
-    )
-    # Generate a random uint variable
-    random_uint = mx.random.randint(0, 2**20)
+    kernel = registry.kernel(f"render_kernel_{variant}", source, header)
+    # Generate a random uint variable unless the caller fixed the sample's seed
+    random_uint = mx.random.randint(0, 2**20) if random_seed is None else mx.array(random_seed, dtype=mx.int32)
+
+    if compact:
+        bvh_inputs = {"bvh_nodes": bvh_nodes}
+        if instancing:
+            bvh_inputs["instances"] = instances
+    else:
+        bvh_inputs = {"bboxes": bboxes, "indices": indices, "polygon_indices": polygon_indices}
+    mask_inputs = {"active": active} if active is not None else {}
+    if lights is None:
+        # Metal needs a buffer even without lights, light_count keeps it unread
+        lights = mx.zeros(LIGHT_STRIDE, dtype=mx.float32)
+    output_shapes = {"out": image_buffer.shape}
+    output_dtypes = {"out": image_buffer.dtype}
+    if traversal_stats:
+        output_shapes["stats_out"] = image_buffer.shape
+        output_dtypes["stats_out"] = mx.uint32
+    for name in aovs:
+        output_shapes[f"{name}_out"] = (*image_buffer.shape[:2], AOV_CHANNELS[name])
+        output_dtypes[f"{name}_out"] = mx.float32
 
     outputs = kernel(
         inputs={
@@ -65,22 +141,28 @@ def render_kernel(image_buffer: mx.array,
                 "pixel00_loc"   : pixel00_loc,
                 "pixel_delta_u" : pixel_delta_u,
                 "pixel_delta_v" : pixel_delta_v,
-                "sample"        : sample,
+                "sample"        : mx.array(sample, dtype=mx.uint32),
                 "samples"       : samples,
                 "geos"          : geos,
                 "norms"         : norms,
                 "mats"          : mats,
-                "bboxes"        : bboxes,
-                "indices"       : indices,
-                "polygon_indices" : polygon_indices,  # Add this line
                 "random_seed"   : random_uint,
                 "blue_noise_texture" : blue_noise_texture,
-                "blue_noise_texture_size" : blue_noise_texture_size
+                "blue_noise_texture_size" : blue_noise_texture_size,
+                "lights"        : lights,
+                "light_count"   : mx.array(light_count, dtype=mx.uint32),
+                **bvh_inputs,
+                **mask_inputs,
                 }, 
         template={"T": mx.float32}, 
         grid=(image_buffer.shape[0], image_buffer.shape[1], 1), 
         threadgroup=(64,1, 1), 
-        output_shapes={"out": image_buffer.shape},
-        output_dtypes={"out": image_buffer.dtype},
+        output_shapes=output_shapes,
+        output_dtypes=output_dtypes,
     )
+    if traversal_stats or aovs:
+        extras = {name: outputs[f"{name}_out"] for name in aovs}
+        if traversal_stats:
+            extras["stats"] = outputs["stats_out"]
+        return outputs["out"], extras
     return outputs["out"]
@@ -1,4 +1,5 @@
 import mlx.core as mx
+from kernels.registry import registry
 
 def sharpen_kernel(image_buffer: mx.array):
     source = """
@@ -27,15 +28,13 @@ def sharpen_kernel(image_buffer: mx.array):
         }
         
         uint elem = (x + y * width) * 3;
-        out[elem]     = clamp(sum.r, 0.0f, 1.0f);
-        out[elem + 1] = clamp(sum.g, 0.0f, 1.0f);
-        out[elem + 2] = clamp(sum.b, 0.0f, 1.0f);
+        // The accumulated image is HDR, only the negative lobes' undershoot is cut
+        out[elem]     = max(sum.r, 0.0f);
+        out[elem + 1] = max(sum.g, 0.0f);
+        out[elem + 2] = max(sum.b, 0.0f);
     }
     """
-    kernel = mx.fast.metal_kernel(
-        name="sharpen_kernel",
-        source=source
-    )
+    kernel = registry.kernel("sharpen_kernel", source)
 
     outputs = kernel(
         inputs={
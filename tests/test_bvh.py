@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+
+from core.bvh import BVH
+from core.scene import DynamicScene, compile_scene
+from kernels.cpu.structures import CpuScene
+from kernels.cpu.triangle_hit import closest_triangles, hit, occluded
+
+NUM_TRIANGLES = 400
+
+def random_triangles(rng, num_triangles: int = NUM_TRIANGLES, spread: float = 5.0) -> np.ndarray:
+    """Small triangles scattered through a box, as (3 * num_triangles, 3) vertices."""
+    centers = rng.uniform(-spread, spread, (num_triangles, 1, 3))
+    return (centers + rng.uniform(-0.5, 0.5, (num_triangles, 3, 3))).astype(np.float32).reshape(-1, 3)
+
+def random_rays(rng, num_rays: int = 512):
+    origins = rng.normal(size=(num_rays, 3))
+    origins = 12.0 * origins / np.linalg.norm(origins, axis=1, keepdims=True)
+    directions = rng.uniform(-4.0, 4.0, (num_rays, 3)) - origins
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return origins.astype(np.float32), directions.astype(np.float32)
+
+def subtree_triangles(bvh: BVH, node: int) -> np.ndarray:
+    first, second, _, _, is_leaf = bvh.indices[node]
+    if is_leaf:
+        return bvh.polygon_indices[first:first + second]
+    return np.concatenate([subtree_triangles(bvh, first), subtree_triangles(bvh, second)])
+
+def fresh_bounds(bvh: BVH, geos: np.ndarray) -> np.ndarray:
+    """(num_nodes, 6) bounds of every node computed from scratch over the triangles below it."""
+    triangles = geos.reshape(-1, 3, 3)
+    bounds = np.empty_like(bvh.bboxes)
+    for node in range(len(bvh.indices)):
+        below = triangles[subtree_triangles(bvh, node)].reshape(-1, 3)
+        bounds[node] = np.concatenate([below.min(axis=0), below.max(axis=0)])
+    return bounds
+
+def test_bounds_contain_triangles_and_children():
+    geos = random_triangles(np.random.default_rng(1))
+    bvh = BVH(geos, max_leaf_size=4)
+    triangles = geos.reshape(-1, 3, 3)
+    box_min, box_max = bvh.bboxes[:, :3], bvh.bboxes[:, 3:]
+
+    is_leaf = bvh.indices[:, 4] == 1
+    assert sorted(bvh.polygon_indices) == list(range(NUM_TRIANGLES))
+    assert bvh.indices[is_leaf, 1].sum() == NUM_TRIANGLES
+    for node in np.nonzero(is_leaf)[0]:
+        start, count = bvh.indices[node, :2]
+        vertices = triangles[bvh.polygon_indices[start:start + count]].reshape(-1, 3)
+        assert np.all(vertices >= box_min[node]) and np.all(vertices <= box_max[node])
+    for node in np.nonzero(~is_leaf)[0]:
+        for child in bvh.indices[node, :2]:
+            assert np.all(box_min[child] >= box_min[node]) and np.all(box_max[child] <= box_max[node])
+
+def test_refit_matches_fresh_bounds():
+    rng = np.random.default_rng(2)
+    geos = random_triangles(rng)
+    bvh = BVH(geos, max_leaf_size=4)
+    moved = (geos + rng.normal(scale=0.3, size=geos.shape)).astype(np.float32)
+    bvh.refit(moved)
+    np.testing.assert_array_equal(bvh.bboxes, fresh_bounds(bvh, moved))
+
+    with pytest.raises(ValueError):
+        bvh.refit(moved[:-3])
+
+def test_dynamic_scene_refits_and_rebuilds():
+    rng = np.random.default_rng(3)
+    geos = random_triangles(rng)
+
+    def update(scene: DynamicScene, geos: np.ndarray):
+        num_triangles = geos.shape[0] // 3
+        return scene.update([geos], [np.zeros_like(geos)], [np.zeros((num_triangles, 1), dtype=np.int32)], [])
+
+    scene = DynamicScene(rebuild_threshold=0.5, max_leaf_size=4)
+    update(scene, geos)
+    assert (scene.rebuilds, scene.refits) == (1, 0)
+
+    moved = (geos + rng.normal(scale=0.05, size=geos.shape)).astype(np.float32)
+    compiled = update(scene, moved)
+    assert (scene.rebuilds, scene.refits) == (1, 1)
+    np.testing.assert_array_equal(compiled.bboxes, fresh_bounds(scene.bvh, moved))
+
+    # A different triangle count changes the topology
+    update(scene, moved[:-9])
+    assert (scene.rebuilds, scene.refits) == (2, 1)
+    assert len(scene.bvh.polygon_indices) == NUM_TRIANGLES - 3
+
+    # Scattering the triangles across the scene loosens the refit tree past the threshold
+    update(scene, random_triangles(rng, NUM_TRIANGLES - 3))
+    assert (scene.rebuilds, scene.refits) == (3, 2)
+
+@pytest.mark.parametrize("bvh_format", ["wide4", "wide8"])
+def test_wide_traversal_matches_compact(bvh_format):
+    rng = np.random.default_rng(4)
+    geos = random_triangles(rng)
+    compiled = compile_scene([geos], [np.zeros_like(geos)], [np.zeros((NUM_TRIANGLES, 1), dtype=np.int32)], [],
+                             max_leaf_size=4)
+    origins, directions = random_rays(rng)
+
+    def closest(bvh_format: str):
+        nodes, instances = compiled.traversal_nodes(bvh_format)
+        scene = CpuScene(compiled.geos, compiled.norms, compiled.mats, nodes)
+        closest_t = np.full(origins.shape[0], 10000.0, dtype=np.float32)
+        ray_t_min = np.full(origins.shape[0], 0.0001, dtype=np.float32)
+        tri, _, _ = closest_triangles(origins, directions, np.zeros(origins.shape[0], dtype=np.int32), ray_t_min,
+                                      closest_t, scene)
+        return tri, closest_t
+
+    compact_tri, compact_t = closest("compact")
+    wide_tri, wide_t = closest(bvh_format)
+    assert np.count_nonzero(compact_tri >= 0) > origins.shape[0] // 4
+    np.testing.assert_array_equal(wide_tri, compact_tri)
+    np.testing.assert_array_equal(wide_t, compact_t)
+
+@pytest.mark.parametrize("bvh_format", ["wide4", "wide8"])
+def test_wide_traversal_matches_compact_instanced(bvh_format):
+    rng = np.random.default_rng(5)
+    prototypes = []
+    for num_triangles in (60, 90):
+        geos = random_triangles(rng, num_triangles, spread=1.0)
+        prototypes.append((geos, np.ones_like(geos), np.full((num_triangles, 1), len(prototypes), dtype=np.int32)))
+    instances = []
+    for index in range(12):
+        object_to_world = np.eye(4)
+        object_to_world[3, :3] = rng.uniform(-5.0, 5.0, 3)
+        instances.append((index % 2, object_to_world))
+    compiled = compile_scene([], [], [], [], prototypes=prototypes, instances=instances, max_leaf_size=4)
+    origins, directions = random_rays(rng)
+
+    def closest(bvh_format: str):
+        nodes, instances = compiled.traversal_nodes(bvh_format)
+        return hit(origins, directions, 0.0001, 10000.0, CpuScene(compiled.geos, compiled.norms, compiled.mats, nodes, instances))
+
+    compact = closest("compact")
+    wide = closest(bvh_format)
+    assert np.count_nonzero(compact.hit) > origins.shape[0] // 4
+    np.testing.assert_array_equal(wide.hit, compact.hit)
+    np.testing.assert_array_equal(wide.t, compact.t)
+    np.testing.assert_array_equal(wide.mat, compact.mat)
+
+@pytest.mark.parametrize("bvh_format", ["compact", "wide4", "wide8"])
+def test_occluded_matches_hit(bvh_format):
+    rng = np.random.default_rng(6)
+    geos = random_triangles(rng)
+    compiled = compile_scene([geos], [np.ones_like(geos)], [np.zeros((NUM_TRIANGLES, 1), dtype=np.int32)], [],
+                             max_leaf_size=4)
+    scene = CpuScene(compiled.geos, compiled.norms, compiled.mats, *compiled.traversal_nodes(bvh_format))
+    origins, directions = random_rays(rng)
+    # Ray-dependent limits, so some rays stop short of the triangles they would hit
+    t_max = rng.uniform(2.0, 20.0, origins.shape[0]).astype(np.float32)
+
+    closest = hit(origins, directions, 0.0001, 10000.0, scene)
+    expected = closest.hit & (closest.t < t_max)
+    assert 0 < np.count_nonzero(expected) < np.count_nonzero(closest.hit)
+    np.testing.assert_array_equal(occluded(origins, directions, 0.0001, t_max, scene), expected)
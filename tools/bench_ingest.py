@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from pxr import Usd, UsdGeom, UsdShade, Sdf, Vt, Gf
+from core.material import Material
+from usd.loader import UsdLoader
+from usd.geo import UsdGeo
+
+
+def create_grid_stage(path, resolution):
+    """Write a resolution x resolution quad grid (with vertex normals) bound to a single material."""
+    stage = Usd.Stage.CreateNew(path)
+    UsdGeom.SetStageMetersPerUnit(stage, 1.0)
+    material = UsdShade.Material.Define(stage, "/materials/WHITE")
+    UsdShade.Shader.Define(stage, "/materials/WHITE/surface")
+
+    xform = UsdGeom.Xform.Define(stage, "/geo/grid")
+    xform.AddTransformOp().Set(Gf.Matrix4d().SetRotate(Gf.Rotation(Gf.Vec3d(1, 0, 0), 30.0)) * Gf.Matrix4d().SetTranslate(Gf.Vec3d(0, 1, 0)))
+    mesh = UsdGeom.Mesh.Define(stage, "/geo/grid/mesh")
+
+    u, v = np.meshgrid(np.linspace(-5.0, 5.0, resolution + 1), np.linspace(-5.0, 5.0, resolution + 1))
+    points = np.stack([u.ravel(), 0.1 * np.sin(u.ravel() * v.ravel()), v.ravel()], axis=1).astype(np.float32)
+    normals = np.tile(np.array([0.0, 1.0, 0.0], dtype=np.float32), (points.shape[0], 1))
+
+    row = np.arange(resolution)
+    x, y = np.meshgrid(row, row)
+    first = (y * (resolution + 1) + x).ravel()
+    quads = np.stack([first, first + 1, first + resolution + 2, first + resolution + 1], axis=1)
+
+    mesh.GetPointsAttr().Set(Vt.Vec3fArray.FromNumpy(points))
+    mesh.GetNormalsAttr().Set(Vt.Vec3fArray.FromNumpy(normals))
+    mesh.SetNormalsInterpolation(UsdGeom.Tokens.vertex)
+    mesh.GetFaceVertexCountsAttr().Set(Vt.IntArray.FromNumpy(np.full(quads.shape[0], 4, dtype=np.int32)))
+    mesh.GetFaceVertexIndicesAttr().Set(Vt.IntArray.FromNumpy(quads.ravel().astype(np.int32)))
+    UsdShade.MaterialBindingAPI.Apply(mesh.GetPrim()).Bind(material)
+    stage.GetRootLayer().Save()
+    return quads.shape[0]
+
+
+def bench_ingest(resolutions):
+    materials = [Material(
+        name=Sdf.Path("/materials/WHITE"),
+        base_weight=1.0,
+        base_color=None,
+        metalness=0.0,
+        transmission=0.0,
+        specular=0.0,
+        specular_roughness=0.0,
+        ior=1.0)]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for resolution in resolutions:
+            path = os.path.join(directory, f"grid_{resolution}.usda")
+            faces = create_grid_stage(path, resolution)
+            usd_loader = UsdLoader(path)
+            start_time = time.time()
+            geos, norms, mats = UsdGeo.load_geos(usd_loader, materials)
+            elapsed_time = time.time() - start_time
+            results.append((faces, geos[0].shape[0] // 3, elapsed_time))
+    return results
+
+
+# Run from the repository root: python -m tools.bench_ingest [resolution ...]
+if __name__ == "__main__":
+    resolutions = [int(arg) for arg in sys.argv[1:]] or [32, 100, 316, 1000]
+    results = bench_ingest(resolutions)
+
+    print(f"\n{'faces':>12} {'triangles':>12} {'seconds':>10} {'faces/s':>14}")
+    for faces, triangles, elapsed_time in results:
+        print(f"{faces:>12} {triangles:>12} {elapsed_time:>10.3f} {faces / max(elapsed_time, 1e-9):>14.0f}")
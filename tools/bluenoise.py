@@ -1,118 +1,145 @@
+"""Void-and-cluster blue noise (Ulichney 1993) on a torus of any dimension.
+
+    python -m tools.bluenoise 512 512 --channels 4 -o 512x512x4_3d_blue_noise.npy
+    python -m tools.bluenoise 128 128 32 -o 128x128x32_3d_blue_noise.npy --show
+
+Every texel gets a rank in placement order, written as (rank + 0.5) / texels so values
+are uniform in (0, 1). Extra channels are independent patterns stacked on the last axis.
+"""
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.ndimage import gaussian_filter
-import os
+from tqdm import tqdm
+
+class _BlockedMin:
+    """Minimum of a flat array kept as per-block minima; an update only rescans the blocks it touches."""
+    def __init__(self, size: int):
+        self.block = max(int(2 ** round(np.log2(np.sqrt(size)))), 1)
+        num_blocks = -(-size // self.block)
+        self.values = np.full((num_blocks, self.block), np.inf)
+        self.flat = self.values.reshape(-1)
+        self.minima = np.full(num_blocks, np.inf)
+
+    def update(self, indices: np.ndarray, values: np.ndarray):
+        self.flat[indices] = values
+        blocks = np.unique(indices // self.block)
+        self.minima[blocks] = self.values[blocks].min(axis=1)
+
+    def argmin(self) -> int:
+        block = int(self.minima.argmin())
+        return block * self.block + int(self.values[block].argmin())
+
+class _ToroidalEnergy:
+    """Gaussian energy of a binary pattern, updated with a precomputed footprint per placed or removed point.
+
+    The largest void is the empty texel of least energy, the tightest cluster the set
+    texel of most energy.
+    """
+    def __init__(self, shape: tuple, sigma: float, track_clusters: bool = True):
+        self.shape = tuple(shape)
+        self.size = int(np.prod(self.shape))
+        self.strides = np.array([int(np.prod(self.shape[i + 1:])) for i in range(len(self.shape))])
+        # Truncated at 3 sigma, and at half the period so the window never overlaps itself
+        radius = [min(int(np.ceil(3.0 * sigma)), (n - 1) // 2) for n in self.shape]
+        grids = np.meshgrid(*[np.arange(-r, r + 1) for r in radius], indexing="ij")
+        self.offsets = np.stack([grid.ravel() for grid in grids], axis=1)
+        self.weights = np.exp(-np.sum(self.offsets.astype(float) ** 2, axis=1) / (2.0 * sigma * sigma))
+        self.energy = np.zeros(self.size)
+        self.pattern = np.zeros(self.size, dtype=bool)
+        self.track_clusters = track_clusters
+        self.voids = _BlockedMin(self.size)
+        self.voids.update(np.arange(self.size), self.energy)
+        self.clusters = _BlockedMin(self.size)
+
+    def footprint(self, index: int) -> np.ndarray:
+        coords = np.array(np.unravel_index(index, self.shape))
+        return ((coords + self.offsets) % self.shape) @ self.strides
+
+    def set(self, index: int, value: bool):
+        self.pattern[index] = value
+        footprint = self.footprint(index)
+        self.energy[footprint] += self.weights if value else -self.weights
+        energy, pattern = self.energy[footprint], self.pattern[footprint]
+        self.voids.update(footprint, np.where(pattern, np.inf, energy))
+        if self.track_clusters:
+            self.clusters.update(footprint, np.where(pattern, -energy, np.inf))
+
+    def largest_void(self) -> int:
+        return self.voids.argmin()
+
+    def tightest_cluster(self) -> int:
+        return self.clusters.argmin()
+
+def void_and_cluster(shape: tuple, sigma: float = 1.5, initial: int = None, rng: np.random.Generator = None) -> np.ndarray:
+    """Placement rank of every texel of a toroidal blue noise pattern of the given shape."""
+    rng = rng or np.random.default_rng()
+    field = _ToroidalEnergy(shape, sigma)
+    size = field.size
+    initial = min(max(initial or size // 10, 1), size)
+    ranks = np.empty(size, dtype=np.int64)
+
+    # Initial binary pattern: random points relaxed by moving the tightest cluster into the largest void
+    for index in rng.choice(size, initial, replace=False):
+        field.set(int(index), True)
+    for _ in range(size):
+        cluster = field.tightest_cluster()
+        field.set(cluster, False)
+        void = field.largest_void()
+        field.set(void, True)
+        if void == cluster:
+            break
+    pattern = field.pattern.copy()
+
+    # Phase 1: rank the initial points by removing the tightest cluster
+    for rank in tqdm(range(initial - 1, -1, -1), desc="Clusters", leave=False):
+        cluster = field.tightest_cluster()
+        field.set(cluster, False)
+        ranks[cluster] = rank
+
+    # Phases 2 and 3: fill the largest void. The footprint sums to the same everywhere, so past
+    # half full the tightest cluster of empty texels is the largest void and one search serves both.
+    field = _ToroidalEnergy(shape, sigma, track_clusters=False)
+    for index in np.flatnonzero(pattern):
+        field.set(int(index), True)
+    for rank in tqdm(range(initial, size), desc="Voids", leave=False):
+        void = field.largest_void()
+        field.set(void, True)
+        ranks[void] = rank
+    return ranks.reshape(field.shape)
 
 class BlueNoiseGenerator:
-    def __init__(self, size, k, r):
+    """size is the texture side, k the number of initial points (a tenth of the texels when None)
+    and r the Gaussian footprint radius, sigma = r / 3."""
+    def __init__(self, size, k=None, r=4.5, seed=None):
         self.size = size
         self.k = k
         self.r = r
+        self.rng = np.random.default_rng(seed)
+
+    def create(self, shape, channels=None):
+        """Blue noise of the given shape, with a trailing axis of independent channels unless channels is None."""
+        layers = [void_and_cluster(shape, self.r / 3.0, self.k, self.rng) for _ in range(channels or 1)]
+        size = layers[0].size
+        noise = (np.stack(layers, axis=-1).astype(np.float32) + 0.5) / size
+        return noise if channels else noise[..., 0]
 
     def create_blue_noise(self):
-        texture = np.zeros((self.size, self.size), dtype=float)
-        values = np.linspace(0, 1, self.size * self.size)
-        mask = np.ones((self.size, self.size), dtype=bool)
-
-        print(f"Placing initial {self.k} points...")
-        for i in range(self.k):
-            while True:
-                x, y = np.random.randint(0, self.size, 2)
-                if mask[x, y]:
-                    texture[x, y] = values[i]
-                    mask[x, y] = False
-                    break
-            if (i + 1) % 100 == 0:
-                print(f"Placed {i + 1}/{self.k} initial points")
-
-        total_points = self.size * self.size
-        print(f"Placing remaining {total_points - self.k} points...")
-        for i in range(self.k, total_points):
-            blurred = gaussian_filter(texture, sigma=self.r/3)
-            blurred[~mask] = np.inf
-            x, y = np.unravel_index(np.argmin(blurred), blurred.shape)
-            texture[x, y] = values[i]
-            mask[x, y] = False
-            if (i + 1) % 100 == 0:
-                print(f"Placed {i + 1}/{total_points} points ({((i + 1) / total_points * 100):.2f}%)")
-
-        print("Blue noise generation complete!")
-        return texture
+        return self.create((self.size, self.size))
 
     def create_color_noise(self):
-        red = self.create_blue_noise()
-        green = self.create_blue_noise()
-        blue = self.create_blue_noise()
-        return np.stack([red, green, blue], axis=-1)
+        return self.create((self.size, self.size), channels=3)
+
     def create_color_noise_x(self, depth):
-        red = self.create_blue_noise_x(depth)
-        green = self.create_blue_noise_x(depth)
-        blue = self.create_blue_noise_x(depth)
-        return np.stack([red, green, blue], axis=-1)
+        return self.create((self.size, self.size, depth), channels=3)
+
     def create_color_noise_3d(self):
-        red = self.create_blue_noise_3d()
-        green = self.create_blue_noise_3d()
-        blue = self.create_blue_noise_3d()
-        return np.stack([red, green, blue], axis=-1)
+        return self.create((self.size, self.size, self.size), channels=3)
+
     def create_blue_noise_3d(self):
-        texture = np.zeros((self.size, self.size, self.size), dtype=float)
-        values = np.linspace(0, 1, self.size * self.size * self.size)
-        mask = np.ones((self.size, self.size, self.size), dtype=bool)
-
-        print(f"Placing initial {self.k} points in 3D...")
-        for i in range(self.k):
-            while True:
-                x, y, z = np.random.randint(0, self.size, 3)
-                if mask[x, y, z]:
-                    texture[x, y, z] = values[i]
-                    mask[x, y, z] = False
-                    break
-            if (i + 1) % 100 == 0:
-                print(f"Placed {i + 1}/{self.k} initial points")
-
-        total_points = self.size * self.size * self.size
-        print(f"Placing remaining {total_points - self.k} points...")
-        for i in range(self.k, total_points):
-            blurred = gaussian_filter(texture, sigma=self.r/3)
-            blurred[~mask] = np.inf
-            x, y, z = np.unravel_index(np.argmin(blurred), blurred.shape)
-            texture[x, y, z] = values[i]
-            mask[x, y, z] = False
-            if (i + 1) % 1000 == 0:
-                print(f"Placed {i + 1}/{total_points} points ({((i + 1) / total_points * 100):.2f}%)")
-
-        print("3D Blue noise generation complete!")
-        return texture
+        return self.create((self.size, self.size, self.size))
+
     def create_blue_noise_x(self, depth):
-        texture = np.zeros((self.size, self.size, depth), dtype=float)
-        values = np.linspace(0, 1, self.size * self.size * depth)
-        mask = np.ones((self.size, self.size, depth), dtype=bool)
-
-        print(f"Placing initial {self.k} points in 3D...")
-        for i in range(self.k):
-            while True:
-                x, y = np.random.randint(0, self.size, 2)
-                z = np.random.randint(0, depth)
-                if mask[x, y, z]:
-                    texture[x, y, z] = values[i]
-                    mask[x, y, z] = False
-                    break
-            if (i + 1) % 100 == 0:
-                print(f"Placed {i + 1}/{self.k} initial points")
-
-        total_points = self.size * self.size * depth
-        print(f"Placing remaining {total_points - self.k} points...")
-        for i in range(self.k, total_points):
-            blurred = gaussian_filter(texture, sigma=self.r/3)
-            blurred[~mask] = np.inf
-            x, y, z = np.unravel_index(np.argmin(blurred), blurred.shape)
-            texture[x, y, z] = values[i]
-            mask[x, y, z] = False
-            if (i + 1) % 1000 == 0:
-                print(f"Placed {i + 1}/{total_points} points ({((i + 1) / total_points * 100):.2f}%)")
-
-        print("3D Blue noise generation complete!")
-        return texture
+        return self.create((self.size, self.size, depth))
+
     def save_noise(self, noise, filename):
         np.save(filename, noise)
         print(f"Noise saved as {filename}")
@@ -121,6 +148,7 @@ class BlueNoiseGenerator:
         return np.load(filename)
 
     def display_noise(self, noise, title):
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(10, 10))
         if noise.ndim == 2:
             plt.imshow(noise, cmap='gray', vmin=0, vmax=1)
@@ -132,6 +160,7 @@ class BlueNoiseGenerator:
         plt.show()
 
     def display_noise_3d(self, noise, title):
+        import matplotlib.pyplot as plt
         if noise.ndim != 3:
             raise ValueError("Input noise must be 3D")
 
@@ -155,38 +184,28 @@ class BlueNoiseGenerator:
 
         plt.tight_layout()
         plt.show()
-        
-
-if __name__ == "__main__":
-    size = 256
-    depth = 30
-    k = 50000
-    r = 6
 
-    generator = BlueNoiseGenerator(size, k, r)
-
-    # Generate and save 3D blue noise
-    noise_3d = generator.create_blue_noise_x(depth)
-    generator.save_noise(noise_3d, f"{size}x{size}x{depth}_3d_blue_noise.npy")
-    print(f"3D Blue noise shape: {noise_3d.shape}")
-
-    # Display three cross-sections of the 3D noise
-    generator.display_noise_3d(noise_3d, "3D Blue Noise Cross-sections")
-
-    exit(0)
-
-    # Generate and display grayscale noise
-    gray_noise = generator.create_blue_noise()
-    generator.display_noise(gray_noise, "Grayscale Blue Noise")
-    generator.save_noise(gray_noise, f"{size}x{size}_grayscale_blue_noise.npy")
-
-    # Generate and display grayscale noise
-    color_noise = generator.create_color_noise()
-    generator.display_noise(color_noise, "Blue Noise")
-    generator.save_noise(color_noise, f"{size}x{size}x3_blue_noise.npy")
-
-    
-
-    # Display a slice of the 3D noise
-    generator.display_noise(noise_3d[:, :, size // 2], "3D Blue Noise (Middle Slice)")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a tileable void-and-cluster blue noise texture.")
+    parser.add_argument("shape", type=int, nargs="+", help="texture shape, e.g. 512 512 or 128 128 32")
+    parser.add_argument("--channels", type=int, default=None, help="independent patterns stacked on a last axis")
+    parser.add_argument("-r", "--radius", type=float, default=4.5, help="Gaussian footprint radius, sigma = radius / 3")
+    parser.add_argument("-k", "--initial", type=int, default=None, help="points of the initial pattern (default a tenth)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", default=None, help="output .npy (default named after the shape)")
+    parser.add_argument("--show", action="store_true", help="display the first channel with matplotlib")
+    args = parser.parse_args(argv)
+
+    generator = BlueNoiseGenerator(args.shape[0], args.initial, args.radius, args.seed)
+    noise = generator.create(tuple(args.shape), args.channels)
+    output = args.output or "x".join(str(n) for n in noise.shape) + "_blue_noise.npy"
+    generator.save_noise(noise, output)
+    if args.show:
+        first = noise[..., 0] if args.channels else noise
+        if first.ndim == 3:
+            generator.display_noise_3d(first, "Blue noise cross-sections")
+        else:
+            generator.display_noise(first, "Blue noise")
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import numpy as np
+from core.bvh import BVH_FORMATS
+from core.postprocess import POSTPROCESS_STAGES, PostProcess
+from core.render import Render, BACKENDS
+from kernels.aov import AOV_CHANNELS
+from core.image import ImageBuffer
+from usd.loader import UsdLoader
+from usd.camera import UsdCamera
+from usd.scene import UsdScene
+
+
+def render_moments(backend, scene, camera, width, height, samples, blue_noise_path, **settings):
+    """Render with one backend, settings are passed on to Render (e.g. bvh_format).
+
+    Returns per-pixel (mean, variance of the mean), the image means of the individual samples
+    and the (height, width, channels) AOVs named in settings["aovs"].
+    """
+    render = Render(ImageBuffer(width, height), camera, scene, samples=samples, blue_noise_path=blue_noise_path, backend=backend,
+                    **settings)
+    state = {"sum_sq": np.zeros((height, width, 3), dtype=np.float64), "image_means": []}
+
+    def on_sample(samples_done, accumulator):
+        # The image buffer still holds the sample that was just accumulated
+        sample = render.to_image(np.array(render.image_buffer.data)).astype(np.float64)
+        state["sum_sq"] += sample * sample
+        state["image_means"].append(sample.mean())
+
+    samples_done = render.run(on_sample=on_sample)
+    mean = render.accumulator.read().astype(np.float64)
+    variance = np.maximum(state["sum_sq"] / samples_done - mean * mean, 0.0)
+    aovs = {name: render.accumulator.read_aov(name) for name in settings.get("aovs", ())}
+    return mean, variance / max(samples_done - 1, 1), np.array(state["image_means"]), aovs
+
+
+def compare_postprocess(backend, scene, camera, width, height, samples, blue_noise_path, stages, **settings):
+    """Run the Metal and the CPU post-process over the same accumulator, rendered with backend.
+
+    Returns the largest absolute difference and the largest value of the CPU result.
+    """
+    render = Render(ImageBuffer(width, height), camera, scene, samples=samples, blue_noise_path=blue_noise_path, backend=backend,
+                    postprocess=stages, **settings)
+    render.run()
+    metal = render.accumulator.read(PostProcess(stages, "metal"))
+    cpu = render.accumulator.read(PostProcess(stages, "cpu"))
+    return float(np.abs(metal - cpu).max()), float(cpu.max())
+
+
+def compare_aovs(aovs_a: dict, aovs_b: dict) -> dict:
+    """Mean absolute difference of every averaged AOV. The material keeps one sample's value,
+    so it counts the fraction of pixels whose id differs instead."""
+    result = {}
+    for name, a in aovs_a.items():
+        b = aovs_b[name]
+        result[name] = float((a != b).mean()) if name == "material" else float(np.abs(a - b).mean())
+    return result
+
+
+def compare(mean_a, var_a, image_means_a, mean_b, var_b, image_means_b):
+    standard_error = np.sqrt(var_a + var_b)
+    z = np.abs(mean_a - mean_b) / np.maximum(standard_error, 1e-6)
+    # Neighbouring pixels are correlated (shared noise), so the image mean's
+    # error comes from the spread of per-sample image means rather than summed pixel variances
+    image_error = np.sqrt(image_means_a.var(ddof=1) / len(image_means_a) + image_means_b.var(ddof=1) / len(image_means_b))
+    image_z = abs(mean_a.mean() - mean_b.mean()) / max(image_error, 1e-12)
+    return {
+        "mean_a": float(mean_a.mean()),
+        "mean_b": float(mean_b.mean()),
+        "rmse": float(np.sqrt(((mean_a - mean_b) ** 2).mean())),
+        "pixels_over_3_sigma": float((z > 3.0).mean()),
+        "image_mean_z": float(image_z),
+    }
+
+
+# Run from the repository root: python -m tools.compare_backends cornell_box.usda
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that two render backends agree statistically.")
+    parser.add_argument("scene")
+    parser.add_argument("--backends", nargs=2, choices=BACKENDS, default=["metal", "cpu"])
+    parser.add_argument("--spp", type=int, default=64)
+    parser.add_argument("--res", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--bvh-format", choices=BVH_FORMATS, default="compact", help="node layout of both backends")
+    parser.add_argument("--no-nee", action="store_true", help="disable next-event estimation and its shadow rays")
+    parser.add_argument("--roulette-depth", type=int, default=3, help="first Russian roulette bounce (0 disables it)")
+    parser.add_argument("--aovs", nargs="+", choices=tuple(AOV_CHANNELS), default=[],
+                        help="also compare these AOVs of the two backends, best with --seed")
+    parser.add_argument("--seed", type=int, default=None, help="share the sample streams of both backends instead of independent ones")
+    parser.add_argument("--post", nargs="+", choices=POSTPROCESS_STAGES, default=None,
+                        help="also compare the Metal and CPU post-process of the first backend's render")
+    parser.add_argument("--blue-noise", default="512x512x4_3d_blue_noise.npy")
+    args = parser.parse_args()
+
+    usd_loader = UsdLoader(args.scene)
+    camera = UsdCamera.load_camera(usd_loader)
+    scene = UsdScene.load_scene(usd_loader)
+    width, height = args.res
+    settings = {"bvh_format": args.bvh_format, "next_event": not args.no_nee, "roulette_depth": args.roulette_depth,
+                "aovs": tuple(args.aovs), "seed": args.seed}
+    moments = [render_moments(backend, scene, camera, width, height, args.spp, args.blue_noise, **settings)
+               for backend in args.backends]
+    result = compare(*moments[0][:3], *moments[1][:3])
+
+    print(f"\n{args.backends[0]} vs {args.backends[1]} at {args.spp} spp, {width}x{height}, {args.bvh_format} BVH{', no NEE' if args.no_nee else ''}")
+    for key, value in result.items():
+        print(f"{key:>20}: {value:.5f}")
+    # With independent noise about 0.3% of pixels exceed 3 sigma by chance
+    print("MATCH" if result["image_mean_z"] < 4.0 and result["pixels_over_3_sigma"] < 0.01 else "MISMATCH")
+
+    if args.aovs:
+        # Without a shared --seed the pixels are jittered differently, so averaged AOVs differ at edges
+        print(f"\nAOVs, mean absolute difference (material: fraction of differing pixels)")
+        for name, value in compare_aovs(moments[0][3], moments[1][3]).items():
+            print(f"{name:>20}: {value:.5f}")
+
+    if args.post:
+        difference, peak = compare_postprocess(args.backends[0], scene, camera, width, height, args.spp, args.blue_noise,
+                                               args.post, **settings)
+        print(f"\npostprocess {' '.join(args.post)}, metal vs cpu on the same accumulator")
+        print(f"{'max_abs_difference':>20}: {difference:.6f} (image max {peak:.4f})")
+        print("MATCH" if difference <= 1e-3 * max(peak, 1.0) else "MISMATCH")
@@ -0,0 +1,112 @@
+"""Error of every sampler against a reference image at equal sample counts.
+
+    python -m tools.compare_samplers cornell_box.usda --backend cpu --spp 4 16 64 --reference-spp 1024
+    python -m tools.compare_samplers scene.usda --reference reference.npy -o samplers.json
+
+Each sampler renders max(--spp) samples and its running average is compared with the
+reference at every count in --spp, averaged over --trials seeds. The reference is rendered
+with --reference-sampler unless --reference names an existing .npy, which is written otherwise.
+"""
+import argparse
+import json
+import os
+import numpy as np
+from core.render import Render, BACKENDS, SAMPLERS
+from core.image import ImageBuffer
+from usd.loader import UsdLoader
+from usd.camera import UsdCamera
+from usd.scene import UsdScene
+
+
+def render_checkpoints(sampler, scene, camera, width, height, counts, backend, seed, blue_noise_path) -> dict:
+    """Render max(counts) samples, returning {count: (height, width, 3) average after count samples}."""
+    render = Render(ImageBuffer(width, height), camera, scene, samples=max(counts), backend=backend,
+                    sampler=sampler, seed=seed, blue_noise_path=blue_noise_path)
+    images = {}
+
+    def on_sample(samples_done, accumulator):
+        if samples_done in counts:
+            images[samples_done] = accumulator.read().astype(np.float64)
+
+    render.run(on_sample=on_sample)
+    return images
+
+
+def image_error(image: np.ndarray, reference: np.ndarray) -> dict:
+    squared = (image - reference) ** 2
+    return {
+        "rmse": float(np.sqrt(squared.mean())),
+        # Relative MSE, so dark regions count as much as bright ones
+        "relmse": float((squared / (reference * reference + 1e-2)).mean()),
+    }
+
+
+def convergence_rate(counts, rmse) -> float:
+    """Slope of log RMSE over log samples; -0.5 for independent samples, steeper is better."""
+    if len(counts) < 2:
+        return float("nan")
+    return float(np.polyfit(np.log(counts), np.log(rmse), 1)[0])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sampler error against a reference at equal sample counts.")
+    parser.add_argument("scene")
+    parser.add_argument("--samplers", nargs="+", choices=SAMPLERS, default=list(SAMPLERS))
+    parser.add_argument("--spp", type=int, nargs="+", default=[4, 16, 64], help="sample counts to measure at")
+    parser.add_argument("--res", type=int, nargs=2, default=[128, 128])
+    parser.add_argument("--backend", choices=BACKENDS, default="metal")
+    parser.add_argument("--trials", type=int, default=1, help="renders per sampler with different seeds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reference", default=None, help="reference .npy, rendered and written if missing")
+    parser.add_argument("--reference-spp", type=int, default=1024)
+    parser.add_argument("--reference-sampler", choices=SAMPLERS, default="sobol")
+    parser.add_argument("--blue-noise", default="512x512x4_3d_blue_noise.npy")
+    parser.add_argument("-o", "--output", default=None, help="write the errors as JSON")
+    args = parser.parse_args(argv)
+
+    usd_loader = UsdLoader(args.scene)
+    camera = UsdCamera.load_camera(usd_loader)
+    scene = UsdScene.load_scene(usd_loader)
+    width, height = args.res
+    counts = sorted(set(args.spp))
+
+    if args.reference and os.path.exists(args.reference):
+        reference = np.load(args.reference).astype(np.float64)
+        if reference.shape != (height, width, 3):
+            raise ValueError(f"Reference is {reference.shape}, expected {(height, width, 3)}")
+    else:
+        # A seed no trial uses, so the reference noise is independent of every measured render
+        reference = render_checkpoints(args.reference_sampler, scene, camera, width, height, [args.reference_spp],
+                                       args.backend, args.seed + args.trials, args.blue_noise)[args.reference_spp]
+        if args.reference:
+            np.save(args.reference, reference.astype(np.float32))
+            print(f"Wrote {args.reference}")
+
+    results = {}
+    for sampler in args.samplers:
+        trials = [render_checkpoints(sampler, scene, camera, width, height, counts, args.backend, args.seed + trial, args.blue_noise)
+                  for trial in range(args.trials)]
+        rows = []
+        for count in counts:
+            measured = [image_error(images[count], reference) for images in trials if count in images]
+            rows.append({"spp": count,
+                         "rmse": float(np.mean([error["rmse"] for error in measured])),
+                         "relmse": float(np.mean([error["relmse"] for error in measured]))})
+        results[sampler] = {"errors": rows, "rate": convergence_rate(counts, [row["rmse"] for row in rows])}
+
+    print(f"\n{args.scene} at {width}x{height}, reference {args.reference or f'{args.reference_sampler} {args.reference_spp} spp'}, {args.trials} trials")
+    print(f"{'sampler':>12} {'spp':>6} {'rmse':>10} {'relmse':>10}")
+    for sampler, result in results.items():
+        for row in result["errors"]:
+            print(f"{sampler:>12} {row['spp']:>6} {row['rmse']:>10.5f} {row['relmse']:>10.5f}")
+        print(f"{sampler:>12} {'rate':>6} {result['rate']:>10.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scene": args.scene, "res": args.res, "backend": args.backend, "trials": args.trials,
+                       "reference_spp": args.reference_spp, "samplers": results}, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+"""Build and run every render_kernel variant once, to catch shader compile errors.
+
+    python -m tools.compile_kernels
+    python -m tools.compile_kernels --backend cpu
+
+Each variant renders one sample of a small procedural scene, plain or instanced, and
+fails if the kernel does not build or produces non-finite values. Exits with 1 on any
+failure. Pair with tools.compare_backends to check the results against the CPU tracer.
+"""
+import argparse
+import itertools
+import sys
+import numpy as np
+
+from bench.run import ingest
+from bench.scenes import SCENES
+from core.bvh import BVH_FORMATS
+from core.image import ImageBuffer
+from core.render import Render, BACKENDS
+from core.scene import compile_scene
+from kernels.aov import AOV_CHANNELS
+
+# A plain scene with lights and an instanced one, see bench.scenes
+SCENE_NAMES = {False: "cornell_box", True: "instanced_clutter"}
+
+
+def variants():
+    """(label, instanced, Render settings) of every variant to build."""
+    for bvh_format, instanced, traversal_stats, next_event in itertools.product(BVH_FORMATS, (False, True), (False, True), (True, False)):
+        if instanced and bvh_format == "flat":
+            continue
+        label = f"{bvh_format}{' instanced' if instanced else ''}{' stats' if traversal_stats else ''}{'' if next_event else ' no-nee'}"
+        # Next-event estimation traces its shadow rays with the any-hit occluded()
+        yield label, instanced, {"bvh_format": bvh_format, "traversal_stats": traversal_stats, "next_event": next_event}
+    # ROULETTE_DEPTH 0 compiles the Russian roulette block out
+    yield "compact no-roulette", False, {"roulette_depth": 0}
+    # The a-trous denoiser runs on the same backend when the image is read
+    yield "compact denoise", False, {"postprocess": ("denoise",)}
+    # Every AOV, the second pass masked by adaptive sampling so converged pixels clear them
+    yield "compact aovs masked", False, {"aovs": tuple(AOV_CHANNELS), "samples": 2, "adaptive": True, "min_samples": 1,
+                                         "noise_threshold": 0.0, "tile_size": 4}
+
+
+def check_variant(scene, compiled, settings: dict, backend: str, width: int, height: int):
+    render = Render(ImageBuffer(width, height), scene.camera, compiled, backend=backend, seed=0, **{"samples": 1, **settings})
+    render.run()
+    image = render.accumulator.read(render.postprocess)
+    if not np.all(np.isfinite(image)):
+        raise ValueError("non-finite color")
+    for name in render.aovs:
+        if not np.all(np.isfinite(render.accumulator.read_aov(name))):
+            raise ValueError(f"non-finite {name} AOV")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and run every render kernel variant.")
+    parser.add_argument("--backend", choices=BACKENDS, default="metal")
+    parser.add_argument("--res", type=int, nargs=2, default=[16, 16])
+    parser.add_argument("--triangles", type=int, default=2000, help="size of the instanced scene")
+    args = parser.parse_args(argv)
+
+    scenes = {}
+    for instanced, name in SCENE_NAMES.items():
+        scene = SCENES[name](args.triangles)
+        geos, norms, mats, prototypes = ingest(scene)
+        scenes[instanced] = scene, compile_scene(geos, norms, mats, scene.lights, prototypes=prototypes, instances=scene.instances)
+
+    checks = list(variants())
+    failures = []
+    for label, instanced, settings in checks:
+        try:
+            check_variant(*scenes[instanced], settings, args.backend, *args.res)
+            print(f"OK    {label}")
+        except Exception as e:
+            failures.append(label)
+            print(f"FAIL  {label}: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}")
+
+    print(f"\n{len(failures)} of {len(checks)} variants failed on {args.backend}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
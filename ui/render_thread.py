@@ -0,0 +1,26 @@
+import numpy as np
+from PySide6.QtCore import QThread, Signal
+
+from core.render import Render
+
+class RenderThread(QThread):
+    image_ready = Signal(np.ndarray)
+
+    def __init__(self, render: Render):
+        super().__init__()
+        self.render = render
+        self.image_buffer = render.image_buffer
+
+    @property
+    def running(self):
+        return self.render.running
+
+    def run(self):
+        self.render.run(on_display=self.emit_image)
+
+    def emit_image(self, samples_done: int, image: np.ndarray):
+        # Already 8-bit and throttled to the render's display rate
+        self.image_ready.emit(image)
+
+    def stop(self):
+        self.render.stop()
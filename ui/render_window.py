@@ -2,10 +2,10 @@ from PySide6.QtWidgets import QMainWindow, QPushButton, QVBoxLayout, QWidget, QL
 from PySide6.QtGui import QImage, QPixmap
 from PySide6.QtCore import Qt
 
-from core.render import Render
+from ui.render_thread import RenderThread
 
 class RenderWindow(QMainWindow):
-    def __init__(self, render_engine: Render):
+    def __init__(self, render_engine: RenderThread):
         super().__init__()
         self.render_engine = render_engine
         self.setWindowTitle("MLX Render")
@@ -5,22 +5,22 @@ from usd.loader import UsdLoader
 import mlx.core as mx
 from math import atan
 class UsdCamera:
-    def load_camera(usd_loader: UsdLoader):
+    def load_camera(usd_loader: UsdLoader, time: Usd.TimeCode = Usd.TimeCode.Default()):
         camera = Camera()
         camera_prim = usd_loader.find_camera()
         usd_camera = UsdGeom.Camera(camera_prim)
-        horizontal_aperture = usd_camera.GetHorizontalApertureAttr().Get()
-        vertical_aperture = usd_camera.GetVerticalApertureAttr().Get()
+        horizontal_aperture = usd_camera.GetHorizontalApertureAttr().Get(time)
+        vertical_aperture = usd_camera.GetVerticalApertureAttr().Get(time)
 
         horizontal_aperture *= usd_loader.meters_per_unit * 100.0
         vertical_aperture *= usd_loader.meters_per_unit * 100.0
 
         if usd_camera.GetFocalLengthAttr().IsAuthored():
-            focal_length = usd_camera.GetFocalLengthAttr().Get()
+            focal_length = usd_camera.GetFocalLengthAttr().Get(time)
             focal_length *= usd_loader.meters_per_unit * 100.0
             camera.fov = 2.0 * atan((horizontal_aperture * 0.5) / focal_length)
             camera.fov = camera.fov * (180.0 / mx.pi)
-        local_to_world = usd_camera.ComputeLocalToWorldTransform(Usd.TimeCode.Default())
+        local_to_world = usd_camera.ComputeLocalToWorldTransform(time)
         camera.center = mx.array(local_to_world.ExtractTranslation())
         forward = Gf.Vec3f(0,0,-1)
         forward = forward * local_to_world.ExtractRotationMatrix()
@@ -5,82 +5,186 @@ from usd.loader import UsdLoader
 import mlx.core as mx
 import numpy as np
 class UsdGeo:
-    def load_geos(usd_loader: UsdLoader, materials: list):
+    LOADER_VERSION = 3
+
+    def load_geos(usd_loader: UsdLoader, materials: list, time: Usd.TimeCode = Usd.TimeCode.Default()):
         geos = []
         norms = []
         mats = []
         for geo_prim in usd_loader.find_geos():
-            print(f"\nLoaded Geo: {geo_prim.GetPath()}")
-            xform = UsdGeom.Xformable(geo_prim).ComputeLocalToWorldTransform(time=Usd.TimeCode.Default())
-            mesh_prim = UsdGeom.Mesh(geo_prim)
-            bound_material = UsdShade.MaterialBindingAPI(geo_prim).ComputeBoundMaterial()
-            if bound_material:
-                material_name = bound_material[0].GetPrim().GetPath()
-                print(f"Material name: {material_name}")
-            else:
-                material_name = "ERROR"
-
-            material_id = -1 
-            for i, material in enumerate(materials):
-                if material.name == material_name:
-                    material_id = i
-                    break
-            if material_id == -1:
-                raise Exception(f"Material not found: {material_name}")
-
-            pointsData = mesh_prim.GetPointsAttr().Get()
-            pointsData = mesh_prim.GetPointsAttr().Get()
-            faceVertexCounts = mesh_prim.GetFaceVertexCountsAttr().Get()
-            faceVertexIndices = mesh_prim.GetFaceVertexIndicesAttr().Get()
-            normalsAttr = mesh_prim.GetNormalsAttr()
-            normalsData = normalsAttr.Get() if normalsAttr else None
-            if normalsData is None:
-                print("No normals found, computing normals")
-
-            vertices = np.empty((0, 3), dtype=np.float32)
-            for point in pointsData:
-                transformedPoint = xform.Transform(point)
-                vertices = np.vstack((vertices, np.array([transformedPoint[0], transformedPoint[1], transformedPoint[2]])))
-
-            normals = np.empty((0, 3), dtype=np.float32)
-            normalXForm = xform.GetInverse().GetTranspose()
-            if normalsData is not None:
-                for normal in normalsData:
-                    transformedNormal = normalXForm.TransformDir(normal)
-                    normal = np.array([transformedNormal[0], transformedNormal[1], transformedNormal[2]])
-                    normal = normal / np.linalg.norm(normal)
-                    normals = np.vstack((normals, normal))
-
-            index = 0
-            triangles = np.empty((0, 3), dtype=np.float32)
-            vnormals   = np.empty((0, 3), dtype=np.float32)
-            mat_indices = np.empty((0, 1), dtype=np.int32)
-            for faceVertexCount in faceVertexCounts:
-                if(faceVertexCount < 3):
-                    print(f"Skipping face with {faceVertexCount} vertices")
-                    index += faceVertexCount
-                    continue
-                
-                for i in range(1, faceVertexCount - 1):
-                    v0 = faceVertexIndices[index]
-                    v1 = faceVertexIndices[index + i]
-                    v2 = faceVertexIndices[index + i + 1]
-
-                    if  v0 < 0 or v0 >= vertices.shape[0] or v1 < 0 or v1 >= vertices.shape[0] or v2 < 0 or v2 >= vertices.shape[0]:
-                        print(f"Skipping face with invalid indices: {v0}, {v1}, {v2}")
-                        continue
-                    
-                    if index < normals.shape[0] and index + i < normals.shape[0] and index + i + 1 < normals.shape[0]:
-                        triangles = np.vstack((triangles, np.array([ vertices[v0], vertices[v1], vertices[v2]])))
-                        vnormals = np.vstack((vnormals, np.array([normals[v0], normals[v1], normals[v2]])))
-                    else:
-                        face_normal = np.cross(vertices[v1] - vertices[v0], vertices[v2] - vertices[v0])
-                        face_normal = face_normal / np.linalg.norm(face_normal)
-                        triangles = np.vstack((triangles, np.array([ vertices[v0], vertices[v1], vertices[v2]])))
-                        vnormals = np.vstack((vnormals, np.array([face_normal, face_normal, face_normal])))
-                    mat_indices = np.vstack((mat_indices, np.array([material_id])))  
-                index += faceVertexCount
+            triangles, vnormals, mat_indices = UsdGeo.load_geo(geo_prim, materials, time)
             geos.append(triangles)
             norms.append(vnormals)
             mats.append(mat_indices)
-        return geos, norms, mats
\ No newline at end of file
+        return geos, norms, mats
+
+    def load_geo(geo_prim, materials: list, time: Usd.TimeCode = Usd.TimeCode.Default()):
+        """World space (triangles, vnormals, mats) of one Mesh prim at time."""
+        print(f"\nLoaded Geo: {geo_prim.GetPath()}")
+        xform = UsdGeom.Xformable(geo_prim).ComputeLocalToWorldTransform(time=time)
+        material_id = UsdGeo.material_id(geo_prim, materials)
+        print(f"Material name: {materials[material_id].name}")
+        return UsdGeo.load_mesh(geo_prim, np.array(xform, dtype=np.float64), material_id, time)
+
+    def might_be_time_varying(geo_prim) -> bool:
+        """Whether the mesh's points, normals, topology or the transform of it or an ancestor may be animated."""
+        mesh_prim = UsdGeom.Mesh(geo_prim)
+        for attr in (mesh_prim.GetPointsAttr(), mesh_prim.GetNormalsAttr(),
+                     mesh_prim.GetFaceVertexCountsAttr(), mesh_prim.GetFaceVertexIndicesAttr()):
+            if attr and attr.ValueMightBeTimeVarying():
+                return True
+        prim = geo_prim
+        while prim and not prim.IsPseudoRoot():
+            if prim.IsA(UsdGeom.Xformable) and UsdGeom.Xformable(prim).TransformMightBeTimeVarying():
+                return True
+            prim = prim.GetParent()
+        return False
+
+    def load_instances(usd_loader: UsdLoader, materials: list, time: Usd.TimeCode = Usd.TimeCode.Default()):
+        """Prototypes and instances of instanceable prims and PointInstancers.
+
+        Returns (prototypes, instances) as compile_scene expects them: prototypes hold object
+        space (geos, norms, mats), instances are (prototype index, object_to_world) pairs.
+        Instances share a prototype when they have the same source prim and bound materials.
+        """
+        xform_cache = UsdGeom.XformCache(time)
+        prototypes, instances = [], []
+        keys = {}
+
+        def prototype_index(source, root):
+            meshes = [prim for prim in Usd.PrimRange(root, Usd.TraverseInstanceProxies()) if prim.IsA(UsdGeom.Mesh)]
+            material_ids = tuple(UsdGeo.material_id(mesh, materials) for mesh in meshes)
+            key = (str(source.GetPath()), material_ids)
+            if key not in keys:
+                print(f"\nLoaded prototype: {source.GetPath()} ({len(meshes)} meshes)")
+                geos, norms, mats = [], [], []
+                for mesh, material_id in zip(meshes, material_ids):
+                    # Relative to the root, whose own transform is part of each instance's
+                    xform = np.eye(4) if mesh == root else np.array(xform_cache.ComputeRelativeTransform(mesh, root)[0], dtype=np.float64)
+                    triangles, vnormals, mat_indices = UsdGeo.load_mesh(mesh, xform, material_id, time)
+                    geos.append(triangles)
+                    norms.append(vnormals)
+                    mats.append(mat_indices)
+                keys[key] = len(prototypes)
+                prototypes.append((np.concatenate(geos) if geos else np.empty((0, 3), dtype=np.float32),
+                                   np.concatenate(norms) if norms else np.empty((0, 3), dtype=np.float32),
+                                   np.concatenate(mats) if mats else np.empty((0, 1), dtype=np.int32)))
+            return keys[key]
+
+        for instance in usd_loader.find_instances():
+            index = prototype_index(instance.GetPrototype(), instance)
+            instances.append((index, np.array(xform_cache.GetLocalToWorldTransform(instance), dtype=np.float64)))
+
+        for prim in usd_loader.find_point_instancers():
+            instancer = UsdGeom.PointInstancer(prim)
+            proto_indices = np.asarray(instancer.GetProtoIndicesAttr().Get(time) or [], dtype=np.int64)
+            if proto_indices.shape[0] == 0:
+                continue
+            # Transforms include each prototype root's own transform, relative to the instancer
+            xforms = np.array(instancer.ComputeInstanceTransformsAtTime(time, time, UsdGeom.PointInstancer.IncludeProtoXform,
+                                                                         UsdGeom.PointInstancer.IgnoreMask), dtype=np.float64).reshape(-1, 4, 4)
+            xforms = xforms @ np.array(xform_cache.GetLocalToWorldTransform(prim), dtype=np.float64)
+            mask = np.asarray(instancer.ComputeMaskAtTime(time), dtype=bool)
+            visible = mask if mask.shape[0] == proto_indices.shape[0] else np.ones(proto_indices.shape[0], dtype=bool)
+            stage = prim.GetStage()
+            targets = [prototype_index(stage.GetPrimAtPath(path), stage.GetPrimAtPath(path))
+                       for path in instancer.GetPrototypesRel().GetTargets()]
+            print(f"\nLoaded PointInstancer: {prim.GetPath()} ({int(visible.sum())} instances of {len(targets)} prototypes)")
+            for proto_index, xform in zip(proto_indices[visible], xforms[visible]):
+                if 0 <= proto_index < len(targets):
+                    instances.append((targets[proto_index], xform))
+
+        if instances:
+            print(f"Loaded {len(instances)} instances of {len(prototypes)} prototypes")
+        return prototypes, instances
+
+    def material_id(geo_prim, materials: list) -> int:
+        bound_material = UsdShade.MaterialBindingAPI(geo_prim).ComputeBoundMaterial()
+        if bound_material:
+            material_name = bound_material[0].GetPrim().GetPath()
+        else:
+            material_name = "ERROR"
+
+        for i, material in enumerate(materials):
+            if material.name == material_name:
+                return i
+        raise Exception(f"Material not found: {material_name}")
+
+    def load_mesh(geo_prim, xform: np.ndarray, material_id: int, time: Usd.TimeCode = Usd.TimeCode.Default()):
+        """Triangulate one Mesh prim with the given row-vector transform. Returns (triangles, vnormals, mats)."""
+        mesh_prim = UsdGeom.Mesh(geo_prim)
+        pointsData = mesh_prim.GetPointsAttr().Get(time)
+        faceVertexCounts = mesh_prim.GetFaceVertexCountsAttr().Get(time)
+        faceVertexIndices = mesh_prim.GetFaceVertexIndicesAttr().Get(time)
+        normalsAttr = mesh_prim.GetNormalsAttr()
+        normalsData = normalsAttr.Get(time) if normalsAttr else None
+        if normalsData is None:
+            print("No normals found, computing normals")
+
+        triangles, vnormals = UsdGeo.triangulate(
+            points=np.asarray(pointsData, dtype=np.float64).reshape(-1, 3),
+            face_vertex_counts=np.asarray(faceVertexCounts, dtype=np.int64),
+            face_vertex_indices=np.asarray(faceVertexIndices, dtype=np.int64),
+            normals=None if normalsData is None else np.asarray(normalsData, dtype=np.float64).reshape(-1, 3),
+            normals_interpolation=mesh_prim.GetNormalsInterpolation(),
+            xform=xform,
+        )
+        mat_indices = np.full((triangles.shape[0] // 3, 1), material_id, dtype=np.int32)
+        return triangles, vnormals, mat_indices
+
+    def triangulate(points: np.ndarray, face_vertex_counts: np.ndarray, face_vertex_indices: np.ndarray,
+                    normals: np.ndarray, normals_interpolation: str, xform: np.ndarray):
+        """Fan-triangulate a mesh in world space.
+
+        Returns (triangles, vnormals), both float32 arrays of shape (3 * num_triangles, 3)
+        with three consecutive rows per triangle, as expected by Render and the BVH.
+        """
+        # USD matrices act on row vectors: p' = [p, 1] @ M
+        homogeneous = np.hstack((points, np.ones((points.shape[0], 1)))) @ xform
+        vertices = homogeneous[:, :3] / homogeneous[:, 3:]
+
+        face_offsets = np.cumsum(face_vertex_counts) - face_vertex_counts
+        degenerate = face_vertex_counts < 3
+        if np.any(degenerate):
+            print(f"Skipping {np.count_nonzero(degenerate)} faces with fewer than 3 vertices")
+
+        # Face f with n vertices yields triangles (0, i, i + 1) for i in [1, n - 2]
+        tris_per_face = np.where(degenerate, 0, face_vertex_counts - 2)
+        num_triangles = int(tris_per_face.sum())
+        tri_face = np.repeat(np.arange(face_vertex_counts.shape[0]), tris_per_face)
+        tri_first = np.repeat(np.cumsum(tris_per_face) - tris_per_face, tris_per_face)
+        tri_local = np.arange(num_triangles) - tri_first + 1
+
+        corners = np.empty((num_triangles, 3), dtype=np.int64)
+        corners[:, 0] = face_offsets[tri_face]
+        corners[:, 1] = corners[:, 0] + tri_local
+        corners[:, 2] = corners[:, 1] + 1
+        vertex_ids = face_vertex_indices[corners]
+
+        valid = np.all((vertex_ids >= 0) & (vertex_ids < vertices.shape[0]), axis=1)
+        if not np.all(valid):
+            print(f"Skipping {np.count_nonzero(~valid)} triangles with invalid indices")
+            corners = corners[valid]
+            vertex_ids = vertex_ids[valid]
+
+        triangles = vertices[vertex_ids]
+
+        tri_normals = None
+        if normals is not None:
+            normal_xform = np.linalg.inv(xform).T[:3, :3]
+            normals = normals @ normal_xform
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = normals / np.where(lengths > 0.0, lengths, 1.0)
+            if normals_interpolation == UsdGeom.Tokens.faceVarying and normals.shape[0] == face_vertex_indices.shape[0]:
+                tri_normals = normals[corners]
+            elif normals.shape[0] == vertices.shape[0]:
+                tri_normals = normals[vertex_ids]
+
+        if tri_normals is None:
+            face_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+            lengths = np.linalg.norm(face_normals, axis=1, keepdims=True)
+            face_normals = face_normals / np.where(lengths > 0.0, lengths, 1.0)
+            tri_normals = np.repeat(face_normals[:, None, :], 3, axis=1)
+
+        return (triangles.reshape(-1, 3).astype(np.float32),
+                tri_normals.reshape(-1, 3).astype(np.float32))
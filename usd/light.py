@@ -5,17 +5,17 @@ from usd.loader import UsdLoader
 import mlx.core as mx
 from math import atan
 class UsdLight:
-    def load_lights(usd_loader: UsdLoader):
+    def load_lights(usd_loader: UsdLoader, time: Usd.TimeCode = Usd.TimeCode.Default()):
         lights = []
         for light_prim in usd_loader.find_lights():
             if light_prim.IsA(UsdLux.RectLight):
                 print(f"\nLoaded RectLight: {light_prim.GetPath()}")
                 light = Light()
-                xform = UsdGeom.Xformable(light_prim).ComputeLocalToWorldTransform(time=Usd.TimeCode.Default())
+                xform = UsdGeom.Xformable(light_prim).ComputeLocalToWorldTransform(time=time)
 
                 color_attr = UsdLux.RectLight(light_prim).GetColorAttr()
                 if color_attr:
-                    light.color = mx.array(color_attr.Get())
+                    light.color = mx.array(color_attr.Get(time))
                     print(f"Color: {light.color}")
                 else:
                     print(f"No color attribute found for {light_prim.GetPath()}")
@@ -23,14 +23,14 @@ class UsdLight:
                 
                 intensity_attr = UsdLux.RectLight(light_prim).GetIntensityAttr()
                 if intensity_attr:
-                    light.intensity = intensity_attr.Get()
+                    light.intensity = intensity_attr.Get(time)
                     print(f"Intensity: {light.intensity}")
                 else:
                     print(f"No intensity attribute found for {light_prim.GetPath()}")
           
                 width_attr = UsdLux.RectLight(light_prim).GetWidthAttr()
                 if width_attr:
-                    light.width = width_attr.Get()
+                    light.width = width_attr.Get(time)
                     print(f"Width: {light.width}")
                 else:
                     print(f"No width attribute found for {light_prim.GetPath()}")
@@ -38,7 +38,7 @@ class UsdLight:
                 
                 height_attr = UsdLux.RectLight(light_prim).GetHeightAttr()
                 if height_attr:
-                    light.height = height_attr.Get()
+                    light.height = height_attr.Get(time)
                     print(f"Height: {light.height}")
                 else:
                     print(f"No height attribute found for {light_prim.GetPath()}")
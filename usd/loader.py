@@ -1,3 +1,5 @@
+import hashlib
+import os
 import pxr
 from pxr import Usd, UsdGeom, UsdShade, UsdLux
 
@@ -8,6 +10,25 @@ class UsdLoader:
         self.meters_per_unit = UsdGeom.GetStageMetersPerUnit(self.stage)
         print(f"Meters per unit: {self.meters_per_unit}")
 
+    def content_hash(self):
+        """Hash the contents of every layer the stage uses (layer stack, references and payloads)."""
+        digest = hashlib.sha256()
+        layers = self.stage.GetUsedLayers()
+        for layer in sorted((layer for layer in layers if not layer.anonymous), key=lambda layer: layer.identifier):
+            digest.update(layer.identifier.encode())
+            if layer.realPath and os.path.isfile(layer.realPath) and not layer.dirty:
+                with open(layer.realPath, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+            else:
+                digest.update(layer.ExportToString().encode())
+        # Anonymous identifiers (e.g. the session layer) embed a memory address, so these are
+        # hashed and ordered by content alone
+        anonymous = [hashlib.sha256(layer.ExportToString().encode()).digest() for layer in layers if layer.anonymous]
+        for layer_digest in sorted(anonymous):
+            digest.update(layer_digest)
+        return digest.hexdigest()
+
     def find_camera(self):
         for prim in self.stage.Traverse():
             if prim.IsA(UsdGeom.Camera):
@@ -23,12 +44,36 @@ class UsdLoader:
         return lights
 
     def find_geos(self):
+        """Mesh prims, except PointInstancer prototypes, which are only rendered through their instances."""
+        prototypes = self.point_instancer_prototypes()
         geos = []
         for prim in self.stage.TraverseAll():
-            if prim.IsA(UsdGeom.Mesh):
+            if prim.IsA(UsdGeom.Mesh) and not self.in_prototype(prim, prototypes):
                 geos.append(prim)
         return geos
 
+    def find_instances(self):
+        """Instanceable prims; the meshes below them are instance proxies TraverseAll skips."""
+        prototypes = self.point_instancer_prototypes()
+        instances = []
+        for prim in self.stage.TraverseAll():
+            if prim.IsInstance() and not self.in_prototype(prim, prototypes):
+                instances.append(prim)
+        return instances
+
+    def find_point_instancers(self):
+        instancers = []
+        for prim in self.stage.TraverseAll():
+            if prim.IsA(UsdGeom.PointInstancer):
+                instancers.append(prim)
+        return instancers
+
+    def point_instancer_prototypes(self):
+        return [path for prim in self.find_point_instancers() for path in UsdGeom.PointInstancer(prim).GetPrototypesRel().GetTargets()]
+
+    def in_prototype(self, prim, prototypes):
+        return any(prim.GetPath().HasPrefix(path) for path in prototypes)
+
     def find_materials(self):
         materials = []
         for prim in self.stage.TraverseAll():
@@ -0,0 +1,41 @@
+from core.bvh import BVH
+from core.scene import CompiledScene, compile_scene
+from core.profiler import Profiler
+from core.scene_cache import SceneCache
+from usd.loader import UsdLoader
+from usd.light import UsdLight
+from usd.geo import UsdGeo
+from usd.material import UsdMaterial
+class UsdScene:
+    def settings(bvh_settings: dict = None):
+        """Everything besides the USD content that changes the compiled buffers."""
+        return {
+            "time_code": "default",
+            "geo_loader_version": UsdGeo.LOADER_VERSION,
+            "bvh_builder_version": BVH.BUILDER_VERSION,
+            "bvh": bvh_settings or {},
+        }
+
+    def load_scene(usd_loader: UsdLoader, cache: SceneCache = None, bvh_settings: dict = None, profiler: Profiler = None) -> CompiledScene:
+        profiler = profiler or Profiler(enabled=False)
+        key = None
+        if cache is not None:
+            with profiler.stage("cache_load"):
+                key = cache.key(usd_loader.content_hash(), UsdScene.settings(bvh_settings))
+                scene = cache.load(key)
+            if scene is not None:
+                return scene
+
+        with profiler.stage("ingest"):
+            lights = UsdLight.load_lights(usd_loader)
+            materials = UsdMaterial.load_materials(usd_loader)
+            geos, norms, mats = UsdGeo.load_geos(usd_loader, materials)
+            prototypes, instances = UsdGeo.load_instances(usd_loader, materials)
+        print(f"Loaded {len(geos)} geos, {len(norms)} normals, {len(mats)} materials")
+
+        scene = compile_scene(geos, norms, mats, lights, profiler=profiler, prototypes=prototypes, instances=instances,
+                              **(bvh_settings or {}))
+        if cache is not None:
+            with profiler.stage("cache_store"):
+                cache.store(key, scene)
+        return scene
@@ -0,0 +1,59 @@
+from pxr import Usd
+from core.camera import Camera
+from core.profiler import Profiler
+from core.scene import CompiledScene, DynamicScene, compile_scene
+from usd.loader import UsdLoader
+from usd.camera import UsdCamera
+from usd.light import UsdLight
+from usd.geo import UsdGeo
+from usd.material import UsdMaterial
+class UsdSequence:
+    """Compiled scenes of an animated stage, one frame at a time.
+
+    Materials and the mesh list are read once. After the first frame only meshes whose
+    points, topology or transforms might vary over time are read again, and DynamicScene
+    refits the BVH unless its quality degraded too far. Instanced stages are recompiled
+    every frame.
+    """
+    def __init__(self, usd_loader: UsdLoader, bvh_settings: dict = None, rebuild_threshold: float = 0.5, profiler: Profiler = None):
+        self.usd_loader = usd_loader
+        self.bvh_settings = bvh_settings or {}
+        self.profiler = profiler or Profiler(enabled=False)
+        self.materials = UsdMaterial.load_materials(usd_loader)
+        self.meshes = usd_loader.find_geos()
+        self.varying = [UsdGeo.might_be_time_varying(prim) for prim in self.meshes]
+        self.instanced = bool(usd_loader.find_instances() or usd_loader.find_point_instancers())
+        self.dynamic = DynamicScene(rebuild_threshold, self.profiler, **self.bvh_settings)
+        self.geos = None
+        self.norms = None
+        self.mats = None
+        print(f"{sum(self.varying)} of {len(self.meshes)} meshes may be animated")
+
+    def frame_range(self):
+        """The stage's start and end time codes."""
+        stage = self.usd_loader.stage
+        return int(stage.GetStartTimeCode()), int(stage.GetEndTimeCode())
+
+    def camera(self, frame: float) -> Camera:
+        return UsdCamera.load_camera(self.usd_loader, Usd.TimeCode(frame))
+
+    def scene(self, frame: float) -> CompiledScene:
+        time = Usd.TimeCode(frame)
+        lights = UsdLight.load_lights(self.usd_loader, time)
+        with self.profiler.stage("ingest", frame=frame):
+            if self.geos is None:
+                loaded = [UsdGeo.load_geo(prim, self.materials, time) for prim in self.meshes]
+                self.geos = [geo for geo, _, _ in loaded]
+                self.norms = [norm for _, norm, _ in loaded]
+                self.mats = [mat for _, _, mat in loaded]
+            else:
+                for i, prim in enumerate(self.meshes):
+                    if self.varying[i]:
+                        self.geos[i], self.norms[i], self.mats[i] = UsdGeo.load_geo(prim, self.materials, time)
+
+        if self.instanced:
+            with self.profiler.stage("ingest", frame=frame):
+                prototypes, instances = UsdGeo.load_instances(self.usd_loader, self.materials, time)
+            return compile_scene(self.geos, self.norms, self.mats, lights, profiler=self.profiler,
+                                 prototypes=prototypes, instances=instances, **self.bvh_settings)
+        return self.dynamic.update(self.geos, self.norms, self.mats, lights)